@@ -0,0 +1,66 @@
+import re
+import subprocess
+import sys
+
+# Modules `symparse run` imports before processing the first line on a warm cache
+WARM_PATH_IMPORT = "import symparse.cli, symparse.pipeline, symparse.output"
+
+# Stacks that must only be imported on the first cache miss (or never)
+LAZY_MODULES = ("litellm", "sentence_transformers", "torch", "numpy", "pyarrow")
+
+# Cumulative import time budget for the warm path
+BUDGET_MS = 300.0
+
+RUNS = 5
+
+_LINE = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \| ( *)(\S+)$")
+
+def measure_import():
+    """Returns (cumulative ms of the symparse imports, set of imported top-level packages)."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", WARM_PATH_IMPORT],
+        capture_output=True,
+        text=True,
+        check=True
+    )
+    total_us = 0
+    packages = set()
+    for line in result.stderr.splitlines():
+        m = _LINE.match(line)
+        if not m:
+            continue
+        _, cumulative, indent, name = m.groups()
+        packages.add(name.split(".")[0])
+        # Top-level entries already include everything they pulled in
+        if not indent and name.startswith("symparse"):
+            total_us += int(cumulative)
+    return total_us / 1000, packages
+
+def run_benchmark(budget_ms=BUDGET_MS):
+    times = []
+    loaded_lazy = set()
+    for run in range(1, RUNS + 1):
+        elapsed_ms, packages = measure_import()
+        times.append(elapsed_ms)
+        loaded_lazy |= packages.intersection(LAZY_MODULES)
+        print(f"Run {run}/{RUNS}: {elapsed_ms:.2f}ms")
+
+    # The minimum is the least noisy estimate of the import cost itself
+    best = min(times)
+    print("\n======== IMPORT TIME BENCHMARK (warm path) ========")
+    print(f"Best: {best:.2f}ms, Max: {max(times):.2f}ms (budget {budget_ms:.0f}ms)")
+    print(f"Lazy stacks imported: {', '.join(sorted(loaded_lazy)) or 'none'}")
+    print("===================================================")
+
+    failed = False
+    if loaded_lazy:
+        print(f"FAIL: {', '.join(sorted(loaded_lazy))} imported on the warm path", file=sys.stderr)
+        failed = True
+    if best > budget_ms:
+        print(f"FAIL: warm path import took {best:.2f}ms, over the {budget_ms:.0f}ms budget", file=sys.stderr)
+        failed = True
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    budget = float(sys.argv[1]) if len(sys.argv) > 1 else BUDGET_MS
+    sys.exit(run_benchmark(budget))
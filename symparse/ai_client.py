@@ -3,14 +3,22 @@ import logging
 import os
 import configparser
 from pathlib import Path
-from litellm import completion
-import litellm
+from typing import Any, List, Tuple
 
-# Suppress annoying debug output from litellm if any
-litellm.suppress_debug_info = True
+from symparse import codec
 
 logger = logging.getLogger(__name__)
 
+def completion(**kwargs):
+    """
+    Calls ``litellm.completion``. litellm takes seconds to import, so it is only
+    loaded on the first AI Path request; fully cached runs never import it.
+    """
+    import litellm
+    # Suppress annoying debug output from litellm if any
+    litellm.suppress_debug_info = True
+    return litellm.completion(**kwargs)
+
 class ConfidenceDegradationError(Exception):
     """Raised when structured generation passes schema but fails the logprob Confidence Egress Gate."""
     pass
@@ -46,52 +54,52 @@ class AIClient:
         Handles LLM extraction enforcing structured generation.
         Implements a Confidence Egress Gate using token logprobs.
         """
-        # Build a concrete example showing the model what output shape to produce
-        def _build_example(props: dict) -> dict:
-            """Recursively build example object from schema properties."""
-            obj = {}
-            for key, prop in props.items():
-                ptype = prop.get("type", "string")
-                if ptype == "string":
-                    obj[key] = f"<extracted {key}>"
-                elif ptype == "number":
-                    obj[key] = 0
-                elif ptype == "integer":
-                    obj[key] = 0
-                elif ptype == "boolean":
-                    obj[key] = False
-                elif ptype == "array":
-                    items_schema = prop.get("items", {})
-                    if items_schema.get("type") == "object" and "properties" in items_schema:
-                        obj[key] = [_build_example(items_schema["properties"])]
-                    else:
-                        obj[key] = [f"<extracted {key} item>"]
-                elif ptype == "object" and "properties" in prop:
-                    obj[key] = _build_example(prop["properties"])
-                elif ptype == "object":
-                    obj[key] = {}
-                else:
-                    obj[key] = f"<extracted {key}>"
-            return obj
+        field_list, example_output = _prompt_fields(schema)
+        messages = [
+            {"role": "system", "content": "You are a data extraction tool. Given raw text, extract values into a JSON object. Respond with ONLY the JSON object. No schema definitions, no markdown, no explanation."},
+            {"role": "user", "content": (
+                f"Extract the following fields from the text below: {field_list}\n\n"
+                f"Return a JSON object like this example:\n{example_output}\n\n"
+                f"Text to extract from:\n{text}\n\n"
+                f"Respond with ONLY the JSON object containing the extracted values:"
+            )}
+        ]
+        return codec.loads(self._complete(messages))
 
-        properties = schema.get("properties", {})
-        example_obj = _build_example(properties)
-        
-        required_fields = schema.get("required", list(properties.keys()))
-        field_list = ", ".join(f'"{f}"' for f in required_fields)
-        example_output = json.dumps(example_obj, indent=2)
-        
+    def extract_batch(self, texts: List[str], schema: dict) -> List[Any]:
+        """
+        Extracts several records in one request, sharing the system prompt and
+        schema example between them. Returns one element per input text, in order;
+        elements are not validated here, callers check each one individually.
+        Raises ValueError if the response is not an array of len(texts) elements.
+        """
+        field_list, example_output = _prompt_fields(schema)
+        numbered = "\n".join(f"{i}. {text}" for i, text in enumerate(texts, 1))
+        messages = [
+            {"role": "system", "content": "You are a data extraction tool. Given numbered raw text records, extract values from each record into its own JSON object and return them as a JSON array in record order. Respond with ONLY the JSON array. No schema definitions, no markdown, no explanation."},
+            {"role": "user", "content": (
+                f"Extract the following fields from each record below: {field_list}\n\n"
+                f"Each element of the array must be a JSON object like this example:\n{example_output}\n\n"
+                f"Records to extract from (one per line):\n{numbered}\n\n"
+                f"Respond with ONLY a JSON array of exactly {len(texts)} objects, one per record, in order:"
+            )}
+        ]
+        results = codec.loads(self._complete(messages))
+        # Tolerate models that wrap the array in a single-key object
+        if isinstance(results, dict) and len(results) == 1:
+            results = next(iter(results.values()))
+        if not isinstance(results, list) or len(results) != len(texts):
+            raise ValueError(
+                f"Batch extraction returned {len(results) if isinstance(results, list) else type(results).__name__} "
+                f"elements for {len(texts)} records."
+            )
+        return results
+
+    def _complete(self, messages: List[dict]) -> str:
+        """Sends *messages* to the backend and returns the raw JSON text after the Confidence Egress Gate."""
         kwargs = {
             "model": self.model,
-            "messages": [
-                {"role": "system", "content": "You are a data extraction tool. Given raw text, extract values into a JSON object. Respond with ONLY the JSON object. No schema definitions, no markdown, no explanation."},
-                {"role": "user", "content": (
-                    f"Extract the following fields from the text below: {field_list}\n\n"
-                    f"Return a JSON object like this example:\n{example_output}\n\n"
-                    f"Text to extract from:\n{text}\n\n"
-                    f"Respond with ONLY the JSON object containing the extracted values:"
-                )}
-            ],
+            "messages": messages,
             "temperature": 0.0,
             "max_tokens": self.max_tokens,
             # drop_params silently drops logprobs/top_logprobs for providers that don't support them
@@ -140,4 +148,43 @@ class AIClient:
                         f"Semantic degradation detected. Average logprob ({avg_logprob:.2f}) is below threshold ({self.logprob_threshold:.2f})."
                     )
 
-        return json.loads(raw_json)
+        return raw_json
+
+
+def _build_example(props: dict) -> dict:
+    """Recursively build example object from schema properties."""
+    obj = {}
+    for key, prop in props.items():
+        ptype = prop.get("type", "string")
+        if ptype == "string":
+            obj[key] = f"<extracted {key}>"
+        elif ptype == "number":
+            obj[key] = 0
+        elif ptype == "integer":
+            obj[key] = 0
+        elif ptype == "boolean":
+            obj[key] = False
+        elif ptype == "array":
+            items_schema = prop.get("items", {})
+            if items_schema.get("type") == "object" and "properties" in items_schema:
+                obj[key] = [_build_example(items_schema["properties"])]
+            else:
+                obj[key] = [f"<extracted {key} item>"]
+        elif ptype == "object" and "properties" in prop:
+            obj[key] = _build_example(prop["properties"])
+        elif ptype == "object":
+            obj[key] = {}
+        else:
+            obj[key] = f"<extracted {key}>"
+    return obj
+
+
+def _prompt_fields(schema: dict) -> Tuple[str, str]:
+    """Returns the quoted required-field list and the example output shown to the model."""
+    # Build a concrete example showing the model what output shape to produce
+    properties = schema.get("properties", {})
+    example_obj = _build_example(properties)
+    
+    required_fields = schema.get("required", list(properties.keys()))
+    field_list = ", ".join(f'"{f}"' for f in required_fields)
+    return field_list, json.dumps(example_obj, indent=2)
@@ -1,35 +1,225 @@
 import os
+import re
 import json
+import time
+import atexit
 import logging
 import hashlib
+import threading
+import weakref
+from contextlib import contextmanager
+from dataclasses import dataclass, field
 from pathlib import Path
-from typing import Optional
-import portalocker
+from typing import Any, Callable, List, Optional, Tuple
+import re2
+
+from symparse import codec, embeddings
+from symparse.storage import open_store
 
 logger = logging.getLogger(__name__)
 
 CACHE_DIR = Path.home() / ".symparse_cache"
 
+# Dense-vector Tier-2 gate: cosine threshold and how many nearest archetypes are considered
+COSINE_THRESHOLD = 0.6
+VECTOR_TOP_K = 5
+
+# Which archetypes go first when the cache is over its limits
+EVICTION_POLICIES = ("lru", "lfu")
+# Hit counts and last-use times are buffered in memory and committed this often
+USAGE_FLUSH_INTERVAL_S = 60.0
+# Per-extractor counters kept on each archetype record (exec_ns / executions = mean run time)
+EXTRACTOR_COUNTERS = (
+    "hits", "similarity_rejections", "validation_failures", "execution_failures",
+    "quarantines", "executions", "exec_ns"
+)
+
+# Managers with buffered usage, flushed when the interpreter exits
+_live_managers: "weakref.WeakSet" = weakref.WeakSet()
+
+@atexit.register
+def _flush_live_managers():
+    for manager in list(_live_managers):
+        manager.flush_usage()
+
+# Persisted timestamps (last use, quarantine) are wall-clock epoch seconds, but
+# advance with the monotonic clock so a clock step mid-run cannot reorder them
+_WALL_ANCHOR = time.time() - time.monotonic()
+
+def _wall_now() -> float:
+    return _WALL_ANCHOR + time.monotonic()
+
+def _run_untimed(stage: str, func: Callable, *args, **kwargs):
+    return func(*args, **kwargs)
+
+def _env_int(name: str) -> Optional[int]:
+    value = os.getenv(name)
+    return int(value) if value else None
+
+# Single-pass structural normalizer. Alternatives are tried in the order the
+# former sequential substitutions ran (IP, timestamps, email, path, number).
+_NORMALIZE_PARTS = (
+    r'(?P<IP>\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3})',
+    r'(?P<TS>\d{1,2}/\w{3}/\d{4}:\d{2}:\d{2}:\d{2}\s*[+\-]?\d{4})',
+    r'(?P<ISO>\d{4}-\d{2}-\d{2}[T ]\d{2}:\d{2}:\d{2}[^\s]*)',
+    r'(?P<EMAIL>[\w.+-]+@[\w.-]+\.\w+)',
+    r'(?P<PATH>/[\w./\-_%~]*)',
+    r'(?P<NUM>\b\d{2,}\b)',
+)
+_NORMALIZE = re.compile("|".join(_NORMALIZE_PARTS))
+# The email alternative is the costliest to attempt at every position and can
+# only match when the line contains '@', so most lines use this variant.
+_NORMALIZE_NO_EMAIL = re.compile("|".join(p for p in _NORMALIZE_PARTS if "EMAIL" not in p))
+_PLACEHOLDERS = {"IP": "<IP>", "TS": "<TS>", "ISO": "<TS>", "EMAIL": "<EMAIL>", "PATH": "<PATH>", "NUM": "<NUM>"}
+
+# Skeleton pass over normalized text: placeholders are kept, letter runs become
+# `a`, digit runs `9`, whitespace runs a single space; punctuation is untouched.
+_SKELETON_RUNS = re.compile(r'(<[A-Z]+>)|([^\W\d_]+)|(\d+)|(\s+)')
+_SKELETON_CHARS = (None, None, "a", "9", " ")
+
+
+# Stripped from token ends before looking a token up in extracted values
+_TOKEN_PUNCTUATION = "\"'()[]{},;:"
+
+
+def _leaf_strings(value: Any) -> List[str]:
+    """String forms of the scalars in an extraction result."""
+    if isinstance(value, dict):
+        return [leaf for item in value.values() for leaf in _leaf_strings(item)]
+    if isinstance(value, list):
+        return [leaf for item in value for leaf in _leaf_strings(item)]
+    return [] if value is None else [str(value)]
+
+
+def _placeholder(match: re.Match) -> str:
+    return _PLACEHOLDERS[match.lastgroup]
+
+
+def _skeleton_char(match: re.Match) -> str:
+    return match.group(1) if match.lastindex == 1 else _SKELETON_CHARS[match.lastindex]
+
+
+@dataclass
+class CachedExtractor:
+    """A cached extraction script selected for one input line."""
+    schema_hash: str
+    archetype_id: str
+    script: str
+    # Identifies this revision of the script for the compiled-extractor memo
+    revision: str = ""
+    # Set when the similarity gate routed a line of another format here: the
+    # line's tokens the archetype lacks, which the extraction must account for
+    # (see CacheManager.confirm_route), and the line's signature id
+    novel_tokens: frozenset = frozenset()
+    signature_id: str = ""
+
+@dataclass
+class _CommitRequest:
+    """Operations one thread handed to the group commit, and how their commit went."""
+    operations: List[Callable]
+    done: bool = False
+    error: Optional[BaseException] = None
+
+@dataclass
+class _PatternDispatch:
+    """re2.Set over the template patterns of one schema's archetypes."""
+    pattern_set: Optional["re2.Set"]
+    archetype_ids: List[str] = field(default_factory=list)
+    patterns: List[str] = field(default_factory=list)
+    # Archetypes without a usable template pattern (e.g. LLM-written scripts)
+    uncovered: frozenset = frozenset()
+
+    def match(self, text: str) -> Optional[str]:
+        """One scan over *text*; the most specific (longest) matching pattern wins."""
+        if self.pattern_set is None:
+            return None
+        hits = self.pattern_set.Match(text)
+        if not hits:
+            return None
+        best = max(hits, key=lambda i: (len(self.patterns[i]), -i))
+        return self.archetype_ids[best]
+
+@dataclass
+class _VectorIndex:
+    """Archetype embeddings of one schema as a (rows x dim) float32 matrix."""
+    matrix: Any
+    row_ids: List[Optional[str]]
+    norms: Any
+
+    @property
+    def archetype_ids(self) -> set:
+        return {a for a in self.row_ids if a is not None}
+
+    def top_k(self, query, k: int, allowed=None) -> List[Tuple[str, float]]:
+        """The *k* most cosine-similar archetypes (optionally restricted to *allowed*), best first."""
+        import numpy as np
+        query = np.asarray(query, dtype=np.float32)
+        denom = self.norms * float(np.linalg.norm(query))
+        with np.errstate(divide="ignore", invalid="ignore"):
+            scores = np.where(denom > 0, (self.matrix @ query) / denom, 0.0)
+        valid = np.array([a is not None and (allowed is None or a in allowed) for a in self.row_ids], dtype=bool)
+        scores = np.where(valid, scores, -np.inf)
+        k = min(k, int(valid.sum()))
+        if k <= 0:
+            return []
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(self.row_ids[i], float(scores[i])) for i in top]
+
 class CacheManager:
-    def __init__(self, cache_dir: Path = CACHE_DIR):
+    def __init__(
+        self,
+        cache_dir: Path = CACHE_DIR,
+        backend: Optional[str] = None,
+        max_entries: Optional[int] = None,
+        max_bytes: Optional[int] = None,
+        eviction: Optional[str] = None
+    ):
         self.cache_dir = Path(cache_dir)
         # Enforce highly secure user-only cache permissions to prevent exposing logs globally
         self.cache_dir.mkdir(parents=True, exist_ok=True, mode=0o700)
-        self._init_metadata()
+        # metadata.json + script files, or a WAL-mode SQLite database (see symparse.storage)
+        self._store = open_store(self.cache_dir, backend, upgrade=self._upgrade_entry)
         self._ensure_gitignore()
-        self._encoder = None
+        # Shared by every CacheManager in the process so the model loads once
+        self._embeddings = embeddings.default_cache()
+        # In-memory snapshot of the schema entries looked up so far plus the script
+        # sources they point to. Dropped only when the store's change stamp moves
+        # (metadata.json's (mtime, size, inode), or SQLite's data_version).
+        self._entries: dict = {}
+        self._index_stamp: Optional[tuple] = None
+        self._scripts: dict = {}
+        # (schema_hash, signature id) -> archetype id resolved by the re2.Set, or by the
+        # Tier-2 gate once the routed script was confirmed to cover the whole line
+        self._aliases: dict = {}
+        # (schema_hash, archetype id) -> frozenset of normalized archetype tokens
+        self._token_sets: dict = {}
+        # schema_hash -> _PatternDispatch built from the archetypes' template patterns
+        self._dispatch: dict = {}
+        # schema_hash -> _VectorIndex over the memory-mapped archetype embedding matrix
+        self._vectors: dict = {}
+        # Per-thread list of operations deferred by batch()
+        self._local = threading.local()
+        # Group commit: commits requested by other threads while one is being
+        # written queue up here and land together in the next one
+        self._commit_cond = threading.Condition()
+        self._commit_queue: List[_CommitRequest] = []
+        self._committing = False
+        # run_stage(stage, func, *args) runs the stages timed inside lookups; the Engine
+        # replaces it with its own timer
+        self.run_stage: Callable[..., Any] = _run_untimed
 
-    def _init_metadata(self):
-        """Ensure the global metadata file exists safely."""
-        meta_file = self.cache_dir / "metadata.json"
-        
-        # Touch metadata file if it doesn't exist to allow read-locking later
-        if not meta_file.exists():
-            with open(meta_file, "a") as f:
-                portalocker.lock(f, portalocker.LOCK_EX)
-                if os.path.getsize(meta_file) == 0:
-                    f.write(json.dumps({"schemas": {}}))
-                portalocker.unlock(f)
+        # Size limits enforced on save (None = unbounded) and the eviction order
+        self.max_entries = max_entries if max_entries is not None else _env_int("SYMPARSE_CACHE_MAX_ENTRIES")
+        self.max_bytes = max_bytes if max_bytes is not None else _env_int("SYMPARSE_CACHE_MAX_BYTES")
+        self.eviction = (eviction or os.getenv("SYMPARSE_CACHE_EVICTION") or "lru").lower()
+        if self.eviction not in EVICTION_POLICIES:
+            raise ValueError(f"Unknown eviction policy: {self.eviction} (expected one of {', '.join(EVICTION_POLICIES)})")
+        # (schema_hash, archetype id) -> counter increments and last use since the last flush_usage()
+        self._usage: dict = {}
+        self._usage_lock = threading.Lock()
+        self._usage_flushed = time.monotonic()
+        _live_managers.add(self)
 
     def _ensure_gitignore(self):
         """Auto-add .symparse_cache to the project .gitignore if one exists nearby.
@@ -53,6 +243,80 @@ class CacheManager:
         except (OSError, PermissionError):
             pass  # Best-effort; never fail on gitignore management
 
+    @property
+    def backend(self) -> str:
+        """Name of the storage backend in use (``json`` or ``sqlite``)."""
+        return self._store.name
+
+    def _refresh_index(self):
+        """
+        Drops the snapshot if the store changed since it was taken. A single
+        stat() (or data_version read) replaces the open, shared lock and parse on
+        warm lines, while scripts compiled by other processes still show up on
+        the next call.
+        """
+        stamp = self._store.stamp()
+        if stamp is not None and stamp == self._index_stamp:
+            return
+        self._index_stamp = stamp
+        # Script sources and routing aliases are only trusted for the index generation they were built under
+        self._entries = {}
+        self._scripts = {}
+        self._aliases = {}
+        self._token_sets = {}
+        self._dispatch = {}
+        self._vectors = {}
+
+    def _schema_entry(self, schema_hash: str) -> Optional[dict]:
+        """Returns one schema's entry from the snapshot, loading it from the store once per generation."""
+        self._refresh_index()
+        try:
+            return self._entries[schema_hash]
+        except KeyError:
+            entry = self._entries[schema_hash] = self._store.load_entry(schema_hash)
+            return entry
+
+    def _upgrade_entry(self, schema_hash: str, entry: dict) -> dict:
+        """
+        Converts a pre-archetype entry ({"archetype_text", ...} with <hash>.py) into
+        {"archetypes": {archetype_id: {...}}}, keeping the legacy script file name.
+        """
+        if "archetypes" in entry:
+            return entry
+        archetype = dict(entry)
+        archetype.setdefault("script", f"{schema_hash}.py")
+        archetype_id = self._archetype_id(archetype.get("archetype_text", ""))
+        return {"archetypes": {archetype_id: archetype}}
+
+    def _invalidate_index(self):
+        """Forces the next lookup to reload from the store (used after local writes)."""
+        self._index_stamp = None
+        self._entries = {}
+        self._scripts = {}
+        self._aliases = {}
+        self._token_sets = {}
+        self._dispatch = {}
+        self._vectors = {}
+
+    def _read_script(self, script_name: str, digest: Optional[str] = None) -> Optional[str]:
+        """
+        Returns a script's source, reading it from the store once per index
+        generation. A source that does not match the archetype's recorded
+        *digest* (lost or replaced since the index was read) is treated as missing.
+        """
+        script = self._scripts.get(script_name)
+        if script is not None:
+            return script
+
+        script = self._store.read_script(script_name)
+        if script is None:
+            return None
+        if digest is not None and self._script_digest(script) != digest:
+            logger.debug(f"Cached script {script_name} does not match its index entry; ignoring it.")
+            return None
+        self._scripts[script_name] = script
+        return script
+
     def _hash_schema(self, schema_dict: dict) -> str:
         """Tier 1: Deterministic exact-match hashing."""
         schema_json = json.dumps(schema_dict, sort_keys=True).encode("utf-8")
@@ -64,21 +328,44 @@ class CacheManager:
         Structural normalization: replace variable content (IPs, dates, numbers,
         URLs, emails) with canonical tokens so that structurally identical log
         lines compare as highly similar even when their data differs.
+        Runs as one precompiled alternation instead of one pass per token kind.
         """
-        import re
-        t = text
-        # IP addresses → <IP>
-        t = re.sub(r'\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3}', '<IP>', t)
-        # Timestamps like 14/Feb/2025:14:32:01 or ISO-8601 variants
-        t = re.sub(r'\d{1,2}/\w{3}/\d{4}:\d{2}:\d{2}:\d{2}\s*[+\-]?\d{4}', '<TS>', t)
-        t = re.sub(r'\d{4}-\d{2}-\d{2}[T ]\d{2}:\d{2}:\d{2}[^\s]*', '<TS>', t)
-        # Email addresses → <EMAIL>
-        t = re.sub(r'[\w.+-]+@[\w.-]+\.\w+', '<EMAIL>', t)
-        # URL paths → <PATH>
-        t = re.sub(r'/[\w./\-_%~]*', '<PATH>', t)
-        # Remaining multi-digit numbers → <NUM>
-        t = re.sub(r'\b\d{2,}\b', '<NUM>', t)
-        return t
+        pattern = _NORMALIZE if "@" in text else _NORMALIZE_NO_EMAIL
+        return pattern.sub(_placeholder, text)
+
+    @staticmethod
+    def _token_set(normalized: str) -> frozenset:
+        """Jaccard token set of an already normalized line."""
+        return frozenset(normalized.lower().split())
+
+    @staticmethod
+    def _skeleton(normalized: str) -> str:
+        return _SKELETON_RUNS.sub(_skeleton_char, normalized)
+
+    @staticmethod
+    def _signature_id(skeleton: str) -> str:
+        return hashlib.sha256(skeleton.encode("utf-8")).hexdigest()[:16]
+
+    @classmethod
+    def structural_signature(cls, text: str) -> str:
+        """
+        Normalized token skeleton of a line: variable content becomes canonical
+        placeholders, letter runs become `a`, digit runs `9`, whitespace runs a
+        single space, and punctuation is kept verbatim. Lines of the same format
+        share a skeleton even when their data differs.
+        """
+        return cls._skeleton(cls._normalize_for_similarity(text))
+
+    @classmethod
+    def _archetype_id(cls, text: str) -> str:
+        """Stable short key for the structural signature of *text*."""
+        return cls._signature_id(cls.structural_signature(text))
+
+    @staticmethod
+    def _jaccard(set1: frozenset, set2: frozenset) -> float:
+        if not set1 or not set2:
+            return 0.0
+        return len(set1 & set2) / float(len(set1 | set2))
 
     def _semantic_similarity(self, text1: str, text2: str) -> float:
         """
@@ -86,193 +373,667 @@ class CacheManager:
         Applies structural normalization before Jaccard to handle log lines with
         identical formats but varying data (IPs, timestamps, URLs, etc.).
         """
-        n1 = self._normalize_for_similarity(text1)
-        n2 = self._normalize_for_similarity(text2)
-        set1 = set(n1.lower().split())
-        set2 = set(n2.lower().split())
-        if not set1 or not set2:
-            return 0.0
-        return len(set1.intersection(set2)) / float(len(set1.union(set2)))
+        return self._jaccard(
+            self._token_set(self._normalize_for_similarity(text1)),
+            self._token_set(self._normalize_for_similarity(text2))
+        )
+
+    def _archetype_tokens(self, schema_hash: str, archetype_id: str, script_info: dict) -> frozenset:
+        """
+        Token set of a stored archetype. Precomputed at save time; entries written
+        before that are normalized once per index generation.
+        """
+        key = (schema_hash, archetype_id)
+        tokens = self._token_sets.get(key)
+        if tokens is None:
+            stored = script_info.get("archetype_tokens")
+            if stored is not None:
+                tokens = frozenset(stored)
+            else:
+                tokens = self._token_set(self._normalize_for_similarity(script_info.get("archetype_text", "")))
+            self._token_sets[key] = tokens
+        return tokens
         
-    def _cosine_similarity(self, vec1: list[float], vec2: list[float]) -> float:
-        import math
-        dot = sum(a*b for a, b in zip(vec1, vec2))
-        mag1 = math.sqrt(sum(a*a for a in vec1))
-        mag2 = math.sqrt(sum(b*b for b in vec2))
-        if mag1 * mag2 == 0:
-            return 0.0
-        return dot / (mag1 * mag2)
+    def _cosine_similarity(self, vec1, vec2) -> float:
+        return embeddings.cosine_similarity(vec1, vec2)
         
-    def _get_embedding(self, text: str) -> list[float]:
-        if self._encoder is None:
-            try:
-                from sentence_transformers import SentenceTransformer
-                # Use a widely available, tiny and fast model
-                self._encoder = SentenceTransformer("all-MiniLM-L6-v2")
-            except ImportError:
-                logger.warning("sentence-transformers not installed. Falling back to Jaccard similarity.")
-                return []
-        return self._encoder.encode(text).tolist()
+    def _get_embedding(self, text: str):
+        """Embedding of *text*'s normalized form from the process-wide LRU, or None without an encoder."""
+        return self._embeddings.embed(self._normalize_for_similarity(text))
+
+    def prefetch_embeddings(self, schema_hash: str, texts: List[str]):
+        """
+        Encodes, in micro-batches, the lines among *texts* that will reach the
+        embedding gate (no signature or alias route yet), so the per-line lookups
+        that follow are LRU hits.
+        """
+        entry = self._schema_entry(schema_hash)
+        if not entry or not any(self._has_vector(a) for a in entry["archetypes"].values()):
+            return
+        archetypes = entry["archetypes"]
+        pending = []
+        for text in texts:
+            normalized = self._normalize_for_similarity(text)
+            signature_id = self._signature_id(self._skeleton(normalized))
+            if signature_id not in archetypes and (schema_hash, signature_id) not in self._aliases:
+                pending.append(normalized)
+        if pending:
+            self._embeddings.embed_many(pending)
 
-    def fetch_script(self, schema_dict: dict, text: str, use_embeddings: bool = False) -> Optional[str]:
+    def fetch_script(self, schema_dict: dict, text: str, use_embeddings: bool = False, schema_hash: Optional[str] = None) -> Optional[str]:
         """
         Retrieves compiled fast path logic implementing Two-Tier Caching.
-        Reads must be process-safe using shared locks.
+        Served from the in-memory index snapshot; the store is only read again
+        when it changed since the last lookup. Callers that already know
+        the schema hash can pass it to skip re-hashing.
         """
-        schema_hash = self._hash_schema(schema_dict)
-        meta_file = self.cache_dir / "metadata.json"
-        
-        with open(meta_file, "r") as f:
-            portalocker.lock(f, portalocker.LOCK_SH) # Shared lock for process-safe reads
-            try:
-                meta = json.load(f)
-            finally:
-                portalocker.unlock(f)
-        
-        if schema_hash not in meta.get("schemas", {}):
+        hit = self.lookup(schema_dict, text, use_embeddings, schema_hash=schema_hash)
+        return hit.script if hit else None
+
+    def lookup(self, schema_dict: dict, text: str, use_embeddings: bool = False, schema_hash: Optional[str] = None,
+               count: bool = True, _retried: bool = False) -> Optional[CachedExtractor]:
+        """
+        Routes *text* to one of the schema's archetype extractors.
+        An exact structural-signature match is an O(1) dictionary hit; otherwise a
+        single re2.Set scan finds the archetypes whose template pattern matches
+        the whole line, then the Tier-2 similarity gate considers any archetype
+        without one. A Set match is remembered for that signature until the index
+        changes; a Tier-2 route only once :meth:`confirm_route` accepted it.
+        With *count* off (a replay of a line already counted) the hit is not recorded.
+        """
+        schema_hash = schema_hash or self._hash_schema(schema_dict)
+        entry = self._schema_entry(schema_hash)
+        if not entry or not entry["archetypes"]:
             return None
-            
-        # Contrastive Collision Detection (Tier 2) check
-        # We ensure the structure intended actually matches the semantic archetype of this script
-        script_info = meta["schemas"][schema_hash]
-        
-        if use_embeddings and "archetype_vector" in script_info:
-            target_vec = self._get_embedding(text)
-            if target_vec:
-                similarity = self._cosine_similarity(target_vec, script_info["archetype_vector"])
-                logger.debug(f"Tier 2 Cosine Similarity: {similarity:.2f}")
-                if similarity < 0.6:  # Higher threshold for dense vectors
-                    logger.warning(f"Tier 2 Collision: Low semantic vector similarity ({similarity:.2f}). Bypassing script.")
-                    return None
-            else:
-                # Fallback if sentence-transformers import failed but flag was set
-                example_text = script_info.get("archetype_text", "")
-                similarity = self._semantic_similarity(text, example_text)
-                if similarity < 0.2:
-                    logger.warning(f"Tier 2 Collision Detected: Exact schema match but low semantic similarity ({similarity:.2f}). Bypassing script.")
-                    return None
-        else:
-            example_text = script_info.get("archetype_text", "")
-            similarity = self._semantic_similarity(text, example_text)
-            if similarity < 0.2:  # Semantic similarity threshold
-                logger.warning(f"Tier 2 Collision Detected: Exact schema match but low semantic similarity ({similarity:.2f}). Bypassing script.")
+        archetypes = entry["archetypes"]
+
+        # One normalization pass feeds both the signature and the Tier-2 token set
+        normalized = self._normalize_for_similarity(text)
+        signature_id = self._signature_id(self._skeleton(normalized))
+        archetype_id = signature_id if signature_id in archetypes else self._aliases.get((schema_hash, signature_id))
+        novel_tokens = frozenset()
+        if archetype_id is None:
+            # One re2.Set scan over every template pattern; only archetypes the Set
+            # cannot speak for are left to the similarity gate
+            dispatch = self._pattern_dispatch(schema_hash, archetypes)
+            archetype_id = dispatch.match(text)
+            if archetype_id is None and dispatch.uncovered:
+                candidates = {a: archetypes[a] for a in dispatch.uncovered}
+                archetype_id = self.run_stage(
+                    "similarity_gate", self._tier2_route, schema_hash, candidates, text, normalized, use_embeddings
+                )
+                if archetype_id is not None:
+                    # Similar is not the same format: content the archetype's example
+                    # lacks (e.g. an extra trailing field) must show up in the extraction
+                    novel_tokens = self._token_set(normalized) - self._archetype_tokens(
+                        schema_hash, archetype_id, archetypes[archetype_id]
+                    )
+            if archetype_id is None:
                 return None
-            
-        script_path = self.cache_dir / f"{schema_hash}.py"
-        if script_path.exists():
-            # Acquire shared lock for reading
-            with open(script_path, "r") as f:
-                portalocker.lock(f, portalocker.LOCK_SH)
+            if not novel_tokens:
+                self._aliases[(schema_hash, signature_id)] = archetype_id
+
+        script_info = archetypes[archetype_id]
+        if "quarantined" in script_info:
+            # Kept for stats and replaced by the next compile of this format, but no longer trusted
+            return None
+        script = self._read_script(script_info.get("script", f"{schema_hash}-{archetype_id}.py"), script_info.get("digest"))
+        if script is None:
+            if not _retried and self._store.stamp() != self._index_stamp:
+                # The script was replaced by a writer after this snapshot was taken
+                return self.lookup(schema_dict, text, use_embeddings, schema_hash, count, _retried=True)
+            return None
+        if count:
+            self.record_counters(schema_hash, archetype_id, hits=1)
+        # The recorded digest names the revision; older entries without one use the index generation
+        revision = script_info.get("digest") or f"generation:{self._index_stamp}"
+        if novel_tokens:
+            return CachedExtractor(schema_hash, archetype_id, script, revision, novel_tokens, signature_id)
+        return CachedExtractor(schema_hash, archetype_id, script, revision)
+
+    def confirm_route(self, cached: CachedExtractor, extracted: Any) -> bool:
+        """
+        Checks that *extracted*, the result of a similarity-routed script, accounts
+        for every token of the line that the archetype's example lacks. Confirmed
+        routes are remembered for the line's signature; an unconfirmed one means
+        the script skipped part of the line, which then deserves its own extractor.
+        """
+        if not cached.novel_tokens:
+            return True
+        values = " ".join(_leaf_strings(extracted))
+        covered = self._normalize_for_similarity(values).lower()
+        for token in cached.novel_tokens:
+            token = token.strip(_TOKEN_PUNCTUATION)
+            if token and token not in covered:
+                return False
+        self._aliases[(cached.schema_hash, cached.signature_id)] = cached.archetype_id
+        return True
+
+    def record_counters(self, schema_hash: str, archetype_id: str, **increments: int):
+        """
+        Adds *increments* (names from EXTRACTOR_COUNTERS) to an extractor's
+        counters in memory; they reach the store in batched flushes. A routed
+        hit also refreshes the extractor's last-use time.
+        """
+        now = time.monotonic()
+        key = (schema_hash, archetype_id)
+        with self._usage_lock:
+            counters = self._usage.setdefault(key, {})
+            for name, value in increments.items():
+                counters[name] = counters.get(name, 0) + value
+            if "hits" in increments:
+                counters["last_used"] = _wall_now()
+            due = now - self._usage_flushed >= USAGE_FLUSH_INTERVAL_S
+        if due:
+            self.flush_usage()
+
+    def flush_usage(self):
+        """
+        Adds the counters and last-use times gathered since the previous flush
+        to the archetype records in one commit. Called every
+        USAGE_FLUSH_INTERVAL_S from lookups, by worker processes on exit and at
+        interpreter exit; usage is advisory, so a failed flush only logs.
+        """
+        with self._usage_lock:
+            usage, self._usage = self._usage, {}
+            self._usage_flushed = time.monotonic()
+        if not usage:
+            return
+
+        def operation(txn) -> List[str]:
+            for (schema_hash, archetype_id), counters in usage.items():
+                info = txn.edit(schema_hash).entry["archetypes"].get(archetype_id)
+                if info is None:
+                    continue
+                for name, value in counters.items():
+                    if name == "last_used":
+                        info["last_used"] = max(info.get("last_used", 0), round(value, 3))
+                    else:
+                        info[name] = info.get(name, 0) + value
+            return []
+
+        try:
+            self._commit([operation])
+        except Exception as e:
+            logger.warning(f"Could not record cache usage: {e}")
+
+    def extractor_stats(self) -> List[dict]:
+        """
+        One row per cached extractor with its persisted counters (after flushing
+        this process's buffer), failure rate and mean execution time.
+        """
+        self.flush_usage()
+        rows = []
+        for schema_hash, entry in self.list_cache().items():
+            for archetype_id, info in entry["archetypes"].items():
+                row = {
+                    "schema_hash": schema_hash,
+                    "archetype_id": archetype_id,
+                    "archetype_text": info.get("archetype_text", ""),
+                    "quarantined": "quarantined" in info,
+                }
+                row.update({name: info.get(name, 0) for name in EXTRACTOR_COUNTERS})
+                failures = row["validation_failures"] + row["execution_failures"]
+                row["failure_rate"] = failures / row["hits"] if row["hits"] else 0.0
+                row["mean_exec_ms"] = row["exec_ns"] / row["executions"] / 1e6 if row["executions"] else 0.0
+                rows.append(row)
+        return rows
+
+    def _pattern_dispatch(self, schema_hash: str, archetypes: dict) -> _PatternDispatch:
+        """Builds (once per index generation) the re2.Set dispatcher for a schema."""
+        dispatch = self._dispatch.get(schema_hash)
+        if dispatch is not None:
+            return dispatch
+
+        from symparse.compiler import extract_template_pattern
+        # Anchored patterns must cover the whole line, so a line with extra fields
+        # is not handed to the extractor of a shorter format
+        pattern_set = re2.Set.FullMatchSet()
+        archetype_ids, patterns, uncovered = [], [], set()
+        for archetype_id, script_info in archetypes.items():
+            if "pattern" in script_info:
+                pattern = script_info["pattern"]
+            else:
+                # Entries saved before patterns were recorded
+                script = self._read_script(script_info.get("script", f"{schema_hash}-{archetype_id}.py"), script_info.get("digest"))
+                pattern = extract_template_pattern(script, script_info.get("archetype_text")) if script else None
+            if pattern:
                 try:
-                    return f.read()
-                finally:
-                    portalocker.unlock(f)
-                    
-        return None
+                    pattern_set.Add(pattern)
+                except re2.error:
+                    pattern = None
+            if pattern:
+                archetype_ids.append(archetype_id)
+                patterns.append(pattern)
+            else:
+                uncovered.add(archetype_id)
 
-    def save_script(self, schema_dict: dict, text: str, script_content: str, use_embeddings: bool = False):
+        if archetype_ids:
+            pattern_set.Compile()
+        else:
+            pattern_set = None
+        dispatch = _PatternDispatch(pattern_set, archetype_ids, patterns, frozenset(uncovered))
+        self._dispatch[schema_hash] = dispatch
+        return dispatch
+
+    def _tier2_route(self, schema_hash: str, archetypes: dict, text: str, normalized: str, use_embeddings: bool) -> Optional[str]:
         """
-        Saves a generated extraction script into the cache.
-        Writes must be strictly serialized via portalocker exclusive locks.
+        Contrastive Collision Detection (Tier 2).
+        Returns the archetype whose example is most similar to *text*, or None if
+        even the best candidate falls below the similarity threshold. Archetypes
+        with stored embeddings are ranked by a top-k cosine search over the
+        schema's vector matrix; the rest are scored by Jaccard similarity.
         """
-        schema_hash = self._hash_schema(schema_dict)
-        
-        script_path = self.cache_dir / f"{schema_hash}.py"
-        
-        # Lock and write the compiled extraction script
-        with open(script_path, "w") as f:
-            portalocker.lock(f, portalocker.LOCK_EX)
+        best_id, best_score, threshold = None, -1.0, 0.2
+        # Closest candidate regardless of threshold, charged with the rejection if nothing qualifies
+        nearest_id, nearest_score = None, -1.0
+        target_tokens = self._token_set(normalized)
+        vector_index = None
+        if use_embeddings and any(self._has_vector(a) for a in archetypes.values()):
+            target_vec = self._embeddings.embed(normalized)
+            if target_vec is not None:
+                vector_index = self._vector_index(schema_hash, self._schema_entry(schema_hash)["archetypes"])
+
+        vectored = set()
+        if vector_index is not None:
+            vectored = vector_index.archetype_ids
+            for archetype_id, similarity in vector_index.top_k(target_vec, VECTOR_TOP_K, allowed=archetypes):
+                logger.debug(f"Tier 2 Cosine Similarity: {similarity:.2f}")
+                if similarity > nearest_score:
+                    nearest_id, nearest_score = archetype_id, similarity
+                # Higher threshold for dense vectors
+                if similarity >= COSINE_THRESHOLD and similarity > best_score:
+                    best_id, best_score = archetype_id, similarity
+
+        for archetype_id, script_info in archetypes.items():
+            if archetype_id in vectored:
+                continue
+            # Jaccard over structurally normalized tokens (also the fallback if
+            # sentence-transformers import failed but the flag was set)
+            similarity = self._jaccard(target_tokens, self._archetype_tokens(schema_hash, archetype_id, script_info))
+            if similarity > nearest_score:
+                nearest_id, nearest_score = archetype_id, similarity
+            if similarity >= threshold and similarity > best_score:
+                best_id, best_score = archetype_id, similarity
+
+        if best_id is None:
+            logger.warning("Tier 2 Collision Detected: Exact schema match but low semantic similarity to every archetype. Bypassing script.")
+            if nearest_id is not None:
+                self.record_counters(schema_hash, nearest_id, similarity_rejections=1)
+        return best_id
+
+    @staticmethod
+    def _has_vector(script_info: dict) -> bool:
+        return "vector_row" in script_info or "archetype_vector" in script_info
+
+    def _vector_index(self, schema_hash: str, archetypes: dict) -> Optional[_VectorIndex]:
+        """
+        Maps the schema's vector file read-only (once per index generation) and
+        pairs its rows with archetype ids. Vectors still stored inline by older
+        versions are stacked underneath.
+        """
+        if schema_hash in self._vectors:
+            return self._vectors[schema_hash]
+        import numpy as np
+
+        matrix, row_ids = None, []
+        entry = self._schema_entry(schema_hash) or {}
+        vector_file = entry.get("vector_file")
+        if vector_file:
             try:
-                f.write(script_content)
-                f.flush()
-                # Ensure data is synced to disk to avoid concurrent streaming corruption
-                os.fsync(f.fileno()) 
-            finally:
-                portalocker.unlock(f)
-                
-        # Lock and update the metadata global index
-        meta_file = self.cache_dir / "metadata.json"
-        
-        with open(meta_file, "r+") as f:
-            portalocker.lock(f, portalocker.LOCK_EX)
+                matrix = np.load(self.cache_dir / vector_file, mmap_mode="r")
+                row_ids = [None] * len(matrix)
+            except (FileNotFoundError, ValueError):
+                # Replaced by a concurrent writer; the next index generation picks up the new file
+                matrix = None
+        for archetype_id, script_info in archetypes.items():
+            row = script_info.get("vector_row")
+            if matrix is not None and row is not None and row < len(row_ids):
+                row_ids[row] = archetype_id
+
+        legacy = [(a, info["archetype_vector"]) for a, info in archetypes.items()
+                  if "archetype_vector" in info and a not in row_ids]
+        if legacy:
+            inline = np.asarray([vec for _, vec in legacy], dtype=np.float32)
+            if matrix is None:
+                matrix, row_ids = inline, []
+            elif inline.shape[1] == matrix.shape[1]:
+                matrix = np.vstack([matrix, inline])
+            else:
+                legacy = []
+            row_ids += [a for a, _ in legacy]
+
+        index = None
+        if matrix is not None and any(a is not None for a in row_ids):
+            index = _VectorIndex(matrix, row_ids, np.linalg.norm(matrix, axis=1))
+        self._vectors[schema_hash] = index
+        return index
+
+    def _store_vectors(self, schema_hash: str, entry: dict, archetype_id: str, vec) -> Optional[str]:
+        """
+        Writes the schema's vector matrix with *vec* as *archetype_id*'s row.
+        Called under the metadata lock. Rows are compacted (dropping purged
+        archetypes, migrating inline vectors) into a new generation file so that
+        readers mapping the previous one are unaffected. Returns the superseded file.
+        """
+        import numpy as np
+        vec = np.asarray(vec, dtype=np.float32)
+        archetypes = entry["archetypes"]
+        previous = entry.get("vector_file")
+        old = None
+        if previous:
             try:
-                content = f.read()
-                meta = json.loads(content) if content else {"schemas": {}}
-                
-                meta.setdefault("schemas", {})
-                schema_entry = {
-                    "archetype_text": text,
-                    "compiled": True
-                }
-                
-                if use_embeddings:
-                    vec = self._get_embedding(text)
-                    if vec:
-                        schema_entry["archetype_vector"] = vec
-                
-                meta["schemas"][schema_hash] = schema_entry
-                
-                f.seek(0)
-                f.truncate()
-                f.write(json.dumps(meta))
-                f.flush()
-                os.fsync(f.fileno())
-            finally:
-                portalocker.unlock(f)
+                old = np.load(self.cache_dir / previous)
+            except (FileNotFoundError, ValueError):
+                old = None
+
+        rows = []
+        for other_id, info in archetypes.items():
+            row = info.pop("vector_row", None)
+            inline = info.pop("archetype_vector", None)
+            if other_id == archetype_id:
+                continue
+            if old is not None and row is not None and row < len(old):
+                other = old[row]
+            elif inline is not None:
+                other = np.asarray(inline, dtype=np.float32)
+            else:
+                continue
+            if other.shape == vec.shape:
+                info["vector_row"] = len(rows)
+                rows.append(other)
+        archetypes[archetype_id]["vector_row"] = len(rows)
+        rows.append(vec)
+
+        generation = entry.get("vector_generation", 0) + 1
+        vector_file = f"{schema_hash}-vectors-{generation}.npy"
+        # A new file name per generation; it is only referenced once the index commit lands
+        with open(self.cache_dir / vector_file, "wb") as f:
+            np.save(f, np.stack(rows))
+        entry["vector_file"] = vector_file
+        entry["vector_generation"] = generation
+        return previous
+
+    @contextmanager
+    def batch(self):
+        """
+        Groups the saves and purges made by this thread into one store commit
+        (one metadata.json replacement, or one SQLite transaction) when the
+        block exits. Lookups inside the block do not see the pending changes.
+        """
+        pending = getattr(self._local, "pending", None)
+        if pending is not None:
+            # Nested batches join the outermost one
+            yield
+            return
+        self._local.pending = []
+        try:
+            yield
+            operations = self._local.pending
+        finally:
+            self._local.pending = None
+        self._commit(operations)
+
+    def _commit(self, operations: List[Callable]):
+        """
+        Applies *operations* (callables taking a store transaction) and returns
+        once they are committed. While another thread's commit is in flight the
+        operations are queued, and the next thread to commit writes everything
+        queued so far as one commit (one fsync for concurrent AI Path compiles).
+        """
+        if not operations:
+            return
+        request = _CommitRequest(operations)
+        with self._commit_cond:
+            self._commit_queue.append(request)
+            while self._committing and not request.done:
+                self._commit_cond.wait()
+            if not request.done:
+                # This thread leads the next commit, taking every queued request along
+                self._committing = True
+                group, self._commit_queue = self._commit_queue, []
+        if not request.done:
+            error = None
+            try:
+                self._apply([operation for queued in group for operation in queued.operations])
+            except BaseException as e:
+                error = e
+            with self._commit_cond:
+                for queued in group:
+                    queued.done, queued.error = True, error
+                self._committing = False
+                self._commit_cond.notify_all()
+        if request.error is not None:
+            raise request.error
+
+    def _apply(self, operations: List[Callable]):
+        """Runs *operations* in one store transaction."""
+        stale_files = []
+        with self._store.transaction() as txn:
+            for operation in operations:
+                stale_files.extend(operation(txn))
+        self._invalidate_index()
+        for name in stale_files:
+            self._store.remove_file(name)
+
+    def _submit(self, operation: Callable):
+        pending = getattr(self._local, "pending", None)
+        if pending is not None:
+            pending.append(operation)
+        else:
+            self._commit([operation])
+
+    @staticmethod
+    def _script_digest(script_content: str) -> str:
+        return hashlib.sha256(script_content.encode("utf-8")).hexdigest()[:16]
+
+    def save_script(self, schema_dict: dict, text: str, script_content: str, use_embeddings: bool = False, schema_hash: Optional[str] = None):
+        """
+        Saves a generated extraction script into the cache as the archetype for
+        *text*'s structural signature. Other archetypes of the same schema are kept.
+        Writes are strictly serialized by the store (portalocker exclusive locks,
+        or a SQLite write transaction); inside :meth:`batch` they are deferred
+        to the batch commit.
+        """
+        from symparse.compiler import extract_template_pattern, invalidate_extractors
+        schema_hash = schema_hash or self._hash_schema(schema_dict)
+        archetype_id = self._archetype_id(text)
+        script_name = f"{schema_hash}-{archetype_id}.py"
+        
+        # Any memoized extractor for the previous revision is now stale
+        invalidate_extractors(schema_hash, archetype_id)
+
+        archetype = {
+            "archetype_text": text,
+            "archetype_tokens": sorted(self._token_set(self._normalize_for_similarity(text))),
+            "script": script_name,
+            "script_bytes": len(script_content.encode("utf-8")),
+            # Usage starts at save time so a fresh archetype is not the first eviction candidate
+            "hits": 0,
+            "last_used": round(_wall_now(), 3),
+            # Lets readers reject a script that did not survive a crash intact
+            "digest": self._script_digest(script_content),
+            # Full-line pattern of template scripts, registered in the schema's re2.Set
+            "pattern": extract_template_pattern(script_content, text),
+            "compiled": True
+        }
+        vec = self._get_embedding(text) if use_embeddings else None
+
+        def operation(txn) -> List[str]:
+            edit = txn.edit(schema_hash)
+            entry = edit.entry
+            archetypes = entry["archetypes"]
+            previous = archetypes.get(archetype_id, {})
+            replaced = previous.get("script")
+            archetypes[archetype_id] = dict(archetype)
+            # A recompiled extractor keeps the traffic history of the one it replaces
+            for name in EXTRACTOR_COUNTERS:
+                if name in previous:
+                    archetypes[archetype_id][name] = previous[name]
+            edit.put_script(script_name, script_content)
+            # A legacy <hash>.py for the same archetype is superseded by the new script
+            if replaced and replaced != script_name:
+                edit.drop_script(replaced)
+            stale = []
+            if vec is not None:
+                # Vectors live in a memory-mapped .npy matrix, not in the index
+                stale_vectors = self._store_vectors(schema_hash, entry, archetype_id, vec)
+                if stale_vectors:
+                    stale.append(stale_vectors)
+            evicted_files, _ = self._evict(txn, keep=(schema_hash, archetype_id))
+            return stale + evicted_files
+
+        self._submit(operation)
                 
     def list_cache(self):
         """Displays all locally compiled extraction scripts and schema hashes."""
-        meta_file = self.cache_dir / "metadata.json"
-        with open(meta_file, "r") as f:
-            portalocker.lock(f, portalocker.LOCK_SH)
-            try:
-                content = f.read()
-                if not content:
-                    return {}
-                meta = json.loads(content)
-                return meta.get("schemas", {})
-            finally:
-                portalocker.unlock(f)
+        return self._store.load_all()
 
     def clear_cache(self):
         """Wipes the local compilation directory."""
-        for p in self.cache_dir.glob("*"):
-            if p.is_file():
-                # Acquire exclusive lock on the file before unlinking to prevent racing
-                try:
-                    with open(p, "a") as f:
-                        portalocker.lock(f, portalocker.LOCK_EX)
-                        os.unlink(p)
-                except FileNotFoundError:
-                    pass
-        self._init_metadata()
+        from symparse.compiler import invalidate_extractors
+        invalidate_extractors()
+        self._store.clear()
+        self._invalidate_index()
                     
-    def delete_script(self, schema_dict: dict):
-        """Deletes a cached script when the Fast Path fails validation."""
-        schema_hash = self._hash_schema(schema_dict)
-        script_path = self.cache_dir / f"{schema_hash}.py"
+    def has_extractor(self, schema_hash: str, archetype_id: str) -> bool:
+        """True if *archetype_id* has a cached extractor that is not quarantined."""
+        entry = self._schema_entry(schema_hash)
+        script_info = entry["archetypes"].get(archetype_id) if entry else None
+        return script_info is not None and "quarantined" not in script_info
+
+    def quarantine_script(self, schema_dict: dict, schema_hash: Optional[str] = None, archetype_id: Optional[str] = None,
+                          revision: Optional[str] = None):
+        """
+        Stops routing lines to an archetype whose script keeps failing. The
+        record, script and counters stay in place (so ``cache stats`` still
+        shows them) until the next compile of that format replaces them.
+        With *revision* (the ``CachedExtractor.revision`` that failed) the
+        archetype is only quarantined if it still holds that script: the cache
+        is shared by every worker process, and another one may have recompiled it.
+        """
+        from symparse.compiler import invalidate_extractors
+        schema_hash = schema_hash or self._hash_schema(schema_dict)
+        invalidate_extractors(schema_hash, archetype_id)
+
+        def operation(txn) -> List[str]:
+            script_info = txn.edit(schema_hash).entry["archetypes"].get(archetype_id)
+            if script_info is None:
+                return []
+            if revision is not None and revision != script_info.get("digest", revision):
+                logger.info(f"Not quarantining {archetype_id}: its script was replaced since it failed.")
+                return []
+            script_info["quarantined"] = round(_wall_now(), 3)
+            return []
+
+        self._submit(operation)
+
+    def delete_script(self, schema_dict: dict, schema_hash: Optional[str] = None, archetype_id: Optional[str] = None):
+        """
+        Deletes cached scripts. With *archetype_id* only that archetype is
+        purged; otherwise every archetype of the schema is removed.
+        """
+        from symparse.compiler import invalidate_extractors
+        schema_hash = schema_hash or self._hash_schema(schema_dict)
+        invalidate_extractors(schema_hash, archetype_id)
         
-        if script_path.exists():
-            with open(script_path, "a") as f:
-                portalocker.lock(f, portalocker.LOCK_EX)
-                os.unlink(script_path)
-                # Note: unlinking does not intrinsically close/unlock the descriptor on all OSs, 
-                # but portalocker context handles closure implicitly, or the file handle garbage collection does.
-                
-        # Remove metadata definition
-        meta_file = self.cache_dir / "metadata.json"
-        with open(meta_file, "r+") as f:
-            portalocker.lock(f, portalocker.LOCK_EX)
-            try:
-                content = f.read()
-                meta = json.loads(content) if content else {"schemas": {}}
-                if schema_hash in meta.get("schemas", {}):
-                        del meta["schemas"][schema_hash]
-                        f.seek(0)
-                        f.truncate()
-                        f.write(json.dumps(meta))
-                        f.flush()
-                        os.fsync(f.fileno())
-            finally:
-                portalocker.unlock(f)
+        # Remove the index entry and its scripts in one store transaction
+        def operation(txn) -> List[str]:
+            edit = txn.edit(schema_hash)
+            if archetype_id is not None:
+                return self._drop_archetype(edit, archetype_id)
+            edit.drop_script(f"{schema_hash}.py")
+            stale = []
+            for other_id in list(edit.entry["archetypes"]):
+                stale += self._drop_archetype(edit, other_id)
+            return stale
+
+        self._submit(operation)
+
+    @staticmethod
+    def _drop_archetype(edit, archetype_id: str) -> List[str]:
+        """Removes one archetype and its script from *edit*; returns files to delete after the commit."""
+        archetypes = edit.entry["archetypes"]
+        archetype = archetypes.pop(archetype_id, None)
+        if archetype is not None:
+            edit.drop_script(archetype.get("script", ""))
+        if archetypes:
+            return []
+        # The schema goes away with its last archetype
+        vector_file = edit.entry.get("vector_file")
+        edit.entry = {"archetypes": {}}
+        return [vector_file] if vector_file else []
+
+    @staticmethod
+    def _archetype_bytes(script_info: dict) -> int:
+        """Approximate storage cost of an archetype: its script plus its index record."""
+        return script_info.get("script_bytes", 0) + len(codec.dumps_compact(script_info))
+
+    def _eviction_key(self, script_info: dict) -> tuple:
+        """Sort key ranking archetypes from least to most valuable under the eviction policy."""
+        # Quarantined extractors serve no traffic and go first under either policy
+        active = "quarantined" not in script_info
+        last_used = script_info.get("last_used", 0)
+        if self.eviction == "lfu":
+            return (active, script_info.get("hits", 0), last_used)
+        return (active, last_used, script_info.get("hits", 0))
+
+    def _evict(self, txn, keep: Optional[Tuple[str, str]] = None) -> Tuple[List[str], int]:
+        """
+        Drops the least valuable archetypes in *txn* until the cache fits
+        max_entries and max_bytes; *keep* (the archetype being saved) is never
+        evicted. Returns the files to delete after the commit and the eviction count.
+        """
+        if self.max_entries is None and self.max_bytes is None:
+            return [], 0
+        from symparse.compiler import invalidate_extractors
+        inventory = []
+        for schema_hash in txn.schema_hashes():
+            for archetype_id, script_info in txn.edit(schema_hash).entry["archetypes"].items():
+                inventory.append((self._eviction_key(script_info), schema_hash, archetype_id, self._archetype_bytes(script_info)))
+        count = len(inventory)
+        total = sum(item[3] for item in inventory)
+
+        stale, evicted = [], 0
+        for _, schema_hash, archetype_id, size in sorted(inventory):
+            if (self.max_entries is None or count <= self.max_entries) and (self.max_bytes is None or total <= self.max_bytes):
+                break
+            if (schema_hash, archetype_id) == keep:
+                continue
+            invalidate_extractors(schema_hash, archetype_id)
+            stale += self._drop_archetype(txn.edit(schema_hash), archetype_id)
+            count -= 1
+            total -= size
+            evicted += 1
+        if evicted:
+            logger.info(f"Evicted {evicted} cached extractor(s) ({self.eviction}) to stay within the cache limits.")
+        return stale, evicted
+
+    def compact(self) -> dict:
+        """
+        Rebuilds the index: drops archetypes whose script is missing or no longer
+        matches its digest, evicts down to the configured limits and removes
+        script, vector and temp files nothing references. Returns counts of what changed.
+        """
+        from symparse.compiler import invalidate_extractors
+        self.flush_usage()
+        summary = {"dropped": 0, "evicted": 0}
+
+        def operation(txn) -> List[str]:
+            stale = []
+            for schema_hash in txn.schema_hashes():
+                edit = txn.edit(schema_hash)
+                for archetype_id, script_info in list(edit.entry["archetypes"].items()):
+                    script = self._store.read_script(script_info.get("script", f"{schema_hash}-{archetype_id}.py"))
+                    digest = script_info.get("digest")
+                    if script is None or (digest is not None and self._script_digest(script) != digest):
+                        stale += self._drop_archetype(edit, archetype_id)
+                        summary["dropped"] += 1
+            evicted_files, summary["evicted"] = self._evict(txn)
+            return stale + evicted_files
 
+        invalidate_extractors()
+        self._commit([operation])
+        summary["removed_files"] = len(self._store.remove_orphans())
+        summary["archetypes"] = sum(len(entry["archetypes"]) for entry in self.list_cache().values())
+        return summary
@@ -9,26 +9,79 @@ warnings.filterwarnings("ignore", message="Pydantic serializer warnings")
 warnings.filterwarnings("ignore", category=DeprecationWarning, module="litellm")
 warnings.filterwarnings("ignore", category=DeprecationWarning, module="httpx")
 
-def parse_args():
-    parser = argparse.ArgumentParser(description="Symparse: LLM to Fast-Path Regex Compiler pipeline")
-    
+def _package_version() -> str:
+    # importlib.metadata scans site-packages, so it is only imported when the version is shown
     try:
         from importlib.metadata import version
-        v = version("symparse")
+        return version("symparse")
     except Exception:
-        v = "unknown"
-        
+        return "unknown"
+
+class _VersionAction(argparse.Action):
+    """``--version`` that looks the version up only when the flag is given."""
+    def __init__(self, option_strings, dest=argparse.SUPPRESS, default=argparse.SUPPRESS, help="show program's version number and exit"):
+        super().__init__(option_strings=option_strings, dest=dest, default=default, nargs=0, help=help)
+
+    def __call__(self, parser, namespace, values, option_string=None):
+        print(f"{parser.prog} {_package_version()}")
+        parser.exit()
+
+_STATS_ORDER = {
+    "traffic": lambda row: (row["hits"], row["executions"]),
+    "failures": lambda row: (row["failure_rate"], row["validation_failures"] + row["execution_failures"]),
+    "cpu": lambda row: (row["exec_ns"], row["mean_exec_ms"]),
+}
+
+def _print_extractor_stats(rows: list, sort: str, limit: int, as_json: bool):
+    rows = sorted(rows, key=_STATS_ORDER[sort], reverse=True)
+    if limit > 0:
+        rows = rows[:limit]
+    if as_json:
+        print(json.dumps(rows, indent=2))
+        return
+    if not rows:
+        print("No cached extractors.")
+        return
+    print(f"{'SCHEMA':<12} {'ARCHETYPE':<16} {'HITS':>8} {'FAIL%':>6} {'VALID':>6} {'EXEC':>6} {'REJECT':>7} {'QUAR':>4} {'MEAN MS':>8}  EXAMPLE")
+    for row in rows:
+        example = ("[quarantined] " if row["quarantined"] else "") + row["archetype_text"].replace("\n", " ")
+        if len(example) > 40:
+            example = example[:37] + "..."
+        print(
+            f"{row['schema_hash'][:12]:<12} {row['archetype_id'][:16]:<16} {row['hits']:>8} "
+            f"{row['failure_rate'] * 100:>5.1f}% {row['validation_failures']:>6} {row['execution_failures']:>6} "
+            f"{row['similarity_rejections']:>7} {row['quarantines']:>4} {row['mean_exec_ms']:>8.3f}  {example}"
+        )
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Symparse: LLM to Fast-Path Regex Compiler pipeline")
+    
     parser.add_argument("-v", "--verbose", action="store_true", help="Enable debug logging")
-    parser.add_argument("--version", action="version", version=f"%(prog)s {v}")
+    parser.add_argument("--version", action=_VersionAction)
     parser.add_argument("--log-level", choices=["DEBUG", "INFO", "WARNING", "ERROR"], default=None,
                         help="Set logging verbosity (default: ERROR, or DEBUG with -v)")
+    parser.add_argument("--cache-backend", choices=["json", "sqlite"], default=None,
+                        help="Cache storage: metadata.json plus script files, or a WAL-mode SQLite database "
+                             "(default: $SYMPARSE_CACHE_BACKEND, else sqlite if the cache already has one, else json)")
     
     subparsers = parser.add_subparsers(dest="command", required=True)
     
     # "run" command
     run_parser = subparsers.add_parser("run", help="Run the pipeline parser")
     run_parser.add_argument("--stats", action="store_true", help="Print performance cache stats when finished")
+    run_parser.add_argument("--failure-window", type=int, default=20,
+                            help="Fast Path executions per cached script considered by the quarantine circuit breaker (default: 20)")
+    run_parser.add_argument("--failure-threshold", type=float, default=0.5,
+                            help="Share of failures within the window (and at least 3) that quarantines a cached script (default: 0.5)")
+    run_parser.add_argument("--profile", default=None, metavar="PATH",
+                            help="Profile the run loop and write the result to PATH (pstats by default, covering the AI threads; --workers processes are not profiled)")
+    run_parser.add_argument("--profiler", choices=["cprofile", "sampling"], default="cprofile",
+                            help="Profiler for --profile: deterministic cProfile, or sampling via pyinstrument if installed (default: cprofile)")
+    run_parser.add_argument("--stats-json", nargs="?", const="-", default=None, metavar="PATH",
+                            help="Write run stats with per-stage latency percentiles as JSON to PATH (stderr if no PATH is given)")
     run_parser.add_argument("--schema", required=True, help="Path to JSON schema file")
+    run_parser.add_argument("--input", metavar="FILE",
+                            help="Read records from FILE (memory-mapped; split into byte ranges across --workers) instead of stdin")
     run_parser.add_argument("--compile", action="store_true", help="Compile a fast-path script on success")
     run_parser.add_argument("--force-ai", action="store_true", help="Bypass local cache and force AI execution")
     run_parser.add_argument("--confidence", type=float, default=None, help="Token logprob threshold (default: -2.0)")
@@ -36,14 +89,63 @@ def parse_args():
     run_parser.add_argument("--embed", action="store_true", help="Use local embeddings for tier-2 caching (requires sentence-transformers)")
     run_parser.add_argument("--sanitize", action="store_true", help="Strip control characters from stdin before AI Path")
     run_parser.add_argument("--max-tokens", type=int, default=4000, help="Max tokens per LLM request (default: 4000)")
+    run_parser.add_argument("--validator", choices=["jsonschema", "codegen"], default="jsonschema",
+                            help="Schema validator backend; codegen compiles a Python validator for simple schemas (default: jsonschema)")
+    run_parser.add_argument("--workers", type=int, default=1,
+                            help="Process records on N worker processes (default: 1, in-process)")
+    run_parser.add_argument("--unordered", action="store_true",
+                            help="With --workers, emit results as chunks finish instead of in input order")
+    run_parser.add_argument("--chunk-size", type=int, default=256,
+                            help="Records per worker chunk with --workers (default: 256)")
+    run_parser.add_argument("--ai-concurrency", type=int, default=0,
+                            help="Run up to N AI Path requests in background threads while fast-path records keep flowing (default: 0, inline)")
+    run_parser.add_argument("--max-buffer", type=int, default=1000,
+                            help="With --ai-concurrency, max records held in the reorder buffer before reading pauses (default: 1000)")
+    run_parser.add_argument("--ai-batch-size", type=int, default=1,
+                            help="Pack up to N cache-miss records into one LLM request returning a JSON array (default: 1, unbatched)")
+    run_parser.add_argument("--ai-batch-tokens", type=int, default=2000,
+                            help="With --ai-batch-size, max estimated input tokens per batched request (default: 2000)")
+    run_parser.add_argument("--ai-batch-wait-ms", type=int, default=100,
+                            help="With --ai-batch-size, send a partial batch once its oldest line has waited this long (default: 100)")
+    run_parser.add_argument("--flush-interval-ms", type=int, default=100,
+                            help="Flush buffered output at least this often; 0 flushes every record (default: 100)")
+    run_parser.add_argument("--writer-thread", action="store_true",
+                            help="Serialize and write output on a dedicated thread")
+    run_parser.add_argument("--compact", action="store_true",
+                            help="Emit compact UTF-8 JSON (no spaces after separators), serialized with orjson when installed")
+    run_parser.add_argument("--output-format", choices=["ndjson", "csv", "tsv", "arrow", "parquet"], default="ndjson",
+                            help="Output format; columnar formats take columns from the schema, flattening nested objects to dotted names (default: ndjson)")
 
     # "cache" command
     cache_parser = subparsers.add_parser("cache", help="Manage the local cache")
     cache_subparsers = cache_parser.add_subparsers(dest="cache_command", required=True)
     cache_subparsers.add_parser("list", help="Display cached extraction scripts")
     cache_subparsers.add_parser("clear", help="Wipe the local compilation directory")
+    stats_parser = cache_subparsers.add_parser(
+        "stats", help="Rank cached extractors by traffic, failure rate or execution time"
+    )
+    stats_parser.add_argument("--sort", choices=["traffic", "failures", "cpu"], default="traffic",
+                              help="Order by fast-path hits, failure rate or total script execution time (default: traffic)")
+    stats_parser.add_argument("--limit", type=int, default=20, help="Show the top N extractors (default: 20, 0 for all)")
+    stats_parser.add_argument("--json", action="store_true", help="Print the counters as JSON instead of a table")
+    compact_parser = cache_subparsers.add_parser(
+        "compact", help="Rebuild the cache index, evict down to the size limits and remove orphaned script files"
+    )
+    compact_parser.add_argument("--max-entries", type=int, default=None,
+                                help="Keep at most N extractors (default: $SYMPARSE_CACHE_MAX_ENTRIES, else unbounded)")
+    compact_parser.add_argument("--max-bytes", type=int, default=None,
+                                help="Keep at most N bytes of scripts and index records (default: $SYMPARSE_CACHE_MAX_BYTES, else unbounded)")
+    compact_parser.add_argument("--eviction", choices=["lru", "lfu"], default=None,
+                                help="Evict least recently used or least frequently used extractors first (default: $SYMPARSE_CACHE_EVICTION, else lru)")
     
-    return parser.parse_args()
+    args = parser.parse_args()
+    if args.command == "run":
+        # The breaker needs at least 3 failures in a window to trip
+        if args.failure_window < 3:
+            run_parser.error("--failure-window must be at least 3")
+        if not 0 < args.failure_threshold <= 1:
+            run_parser.error("--failure-threshold must be greater than 0 and at most 1")
+    return args
 
 def main():
     args = parse_args()
@@ -59,22 +161,42 @@ def main():
     
     if args.command == "cache":
         from symparse.cache_manager import CacheManager
-        manager = CacheManager()
+        cache_kwargs = {}
+        for option, name in (("cache_backend", "backend"), ("max_entries", "max_entries"),
+                             ("max_bytes", "max_bytes"), ("eviction", "eviction")):
+            if getattr(args, option, None) is not None:
+                cache_kwargs[name] = getattr(args, option)
+        manager = CacheManager(**cache_kwargs)
         if args.cache_command == "list":
             print(json.dumps(manager.list_cache(), indent=2))
         elif args.cache_command == "clear":
             manager.clear_cache()
             print("Cache cleared.")
+        elif args.cache_command == "stats":
+            _print_extractor_stats(manager.extractor_stats(), args.sort, args.limit, args.json)
+        elif args.cache_command == "compact":
+            summary = manager.compact()
+            print(
+                f"Cache compacted: {summary['archetypes']} extractors kept, {summary['evicted']} evicted, "
+                f"{summary['dropped']} with missing scripts dropped, {summary['removed_files']} orphaned files removed."
+            )
         sys.exit(0)
         
     if args.command == "run":
-        if sys.stdin.isatty():
+        import os
+        input_path = getattr(args, "input", None)
+        if input_path is None and sys.stdin.isatty():
             print("Error: No data piped into stdin.", file=sys.stderr)
             sys.exit(1)
+        if input_path is not None and not os.path.isfile(input_path):
+            print(f"Error: Input file not found: {input_path}", file=sys.stderr)
+            sys.exit(1)
             
-        import os
-        from symparse.engine import process_stream, EngineFailure, GracefulDegradationMode, global_stats
-        from symparse.utils import is_binary_line, estimate_tokens
+        from symparse.engine import Engine, EngineFailure, GracefulDegradationMode, global_stats
+        from symparse.pipeline import InputStats, iter_file_lines, iter_records, run_concurrent, run_file_parallel, run_parallel
+        from symparse.codec import dumps_compact
+        from symparse.output import open_sink
+        from symparse.utils import estimate_tokens
         
         try:
             with open(args.schema, 'r') as f:
@@ -82,63 +204,163 @@ def main():
         except Exception as e:
             print(f"Error reading schema file: {e}", file=sys.stderr)
             sys.exit(1)
+        # A malformed schema is an input error, not an Engine (or worker) traceback
+        from jsonschema.exceptions import SchemaError
+        from symparse.validator import compile_validator
+        try:
+            compile_validator(schema_dict, backend=getattr(args, "validator", "jsonschema"))
+        except SchemaError as e:
+            print(f"Error: Invalid schema file: {e.message}", file=sys.stderr)
+            sys.exit(1)
             
         degradation_mode = os.getenv("SYMPARSE_DEGRADATION_MODE", "halt").lower()
         mode = GracefulDegradationMode.PASSTHROUGH if degradation_mode == "passthrough" else GracefulDegradationMode.HALT
-            
-        total_input_chars = 0
-        skipped_binary_lines = 0
+
+        engine_kwargs = dict(
+            schema_dict=schema_dict,
+            compile=args.compile,
+            force_ai=args.force_ai,
+            degradation_mode=mode,
+            confidence_threshold=getattr(args, "confidence", None),
+            use_embeddings=getattr(args, "embed", False),
+            model=getattr(args, "model", None),
+            sanitize=getattr(args, "sanitize", False),
+            max_tokens=getattr(args, "max_tokens", 4000),
+            validator_backend=getattr(args, "validator", "jsonschema"),
+            cache_backend=getattr(args, "cache_backend", None),
+            failure_window=getattr(args, "failure_window", 20),
+            failure_threshold=getattr(args, "failure_threshold", 0.5)
+        )
+
+        # Output is batched and flushed by size, by --flush-interval-ms and at EOF
         try:
-            for line in sys.stdin:
-                line = line.strip()
-                if not line:
-                    continue
-                if is_binary_line(line):
-                    skipped_binary_lines += 1
-                    logging.getLogger(__name__).warning(
-                        f"Skipped binary/null-byte line (line {skipped_binary_lines}). "
-                        "Pipe text-only input or pre-filter with 'strings' or 'grep -a'."
-                    )
-                    continue
-                total_input_chars += len(line)
-                result = process_stream(
-                    line, 
-                    schema_dict, 
-                    compile=args.compile,
-                    force_ai=args.force_ai,
-                    degradation_mode=mode,
-                    confidence_threshold=getattr(args, "confidence", None),
-                    use_embeddings=getattr(args, "embed", False),
-                    model=getattr(args, "model", None),
-                    sanitize=getattr(args, "sanitize", False),
-                    max_tokens=getattr(args, "max_tokens", 4000)
+            writer = open_sink(
+                getattr(args, "output_format", "ndjson"),
+                schema_dict,
+                sys.stdout,
+                flush_interval_ms=getattr(args, "flush_interval_ms", 100),
+                threaded=getattr(args, "writer_thread", False),
+                serialize=dumps_compact if getattr(args, "compact", False) else json.dumps
+            )
+        except ImportError as e:
+            print(f"Error: {e}", file=sys.stderr)
+            sys.exit(1)
+        from symparse.metrics import timed_call
+
+        def emit(record, _write=writer.write):
+            timed_call("output_write", global_stats.record_stage, _write, record)
+
+        input_stats = InputStats()
+        source = iter_file_lines(input_path) if input_path is not None else sys.stdin
+        records = iter_records(source, input_stats)
+        workers = getattr(args, "workers", 1) or 1
+        ai_concurrency = getattr(args, "ai_concurrency", 0) or 0
+        ai_batch_size = getattr(args, "ai_batch_size", 1) or 1
+        ai_batch_tokens = getattr(args, "ai_batch_tokens", 2000)
+        ai_batch_wait_ms = getattr(args, "ai_batch_wait_ms", 100)
+
+        # --profile covers the run loop only, not argument parsing or the stats report
+        from contextlib import ExitStack
+        profiling = ExitStack()
+        profile_path = getattr(args, "profile", None)
+        if profile_path:
+            from symparse.profiling import profile_run
+            try:
+                profiling.enter_context(profile_run(profile_path, getattr(args, "profiler", "cprofile")))
+            except ImportError as e:
+                print(f"Error: {e}", file=sys.stderr)
+                sys.exit(1)
+        try:
+            if workers > 1 and input_path is not None:
+                # Workers map and decode their own byte ranges; the parent only merges results
+                run_file_parallel(
+                    input_path,
+                    engine_kwargs,
+                    emit,
+                    workers=workers,
+                    ordered=not getattr(args, "unordered", False),
+                    input_stats=input_stats,
+                    ai_concurrency=ai_concurrency,
+                    ai_batch_size=ai_batch_size,
+                    ai_batch_tokens=ai_batch_tokens,
+                    ai_batch_wait_ms=ai_batch_wait_ms
+                )
+            elif workers > 1:
+                # Each worker process holds its own warm Engine; stats are merged back here
+                run_parallel(
+                    records,
+                    engine_kwargs,
+                    emit,
+                    workers=workers,
+                    ordered=not getattr(args, "unordered", False),
+                    chunk_size=getattr(args, "chunk_size", 256),
+                    ai_concurrency=ai_concurrency,
+                    ai_batch_size=ai_batch_size,
+                    ai_batch_tokens=ai_batch_tokens,
+                    ai_batch_wait_ms=ai_batch_wait_ms
                 )
-                print(json.dumps(result))
-                sys.stdout.flush()
+            elif ai_concurrency > 0 or ai_batch_size > 1:
+                # LLM calls run in the background; a reorder buffer keeps output in input order
+                run_concurrent(
+                    records,
+                    Engine(**engine_kwargs),
+                    emit,
+                    ai_concurrency=max(1, ai_concurrency),
+                    max_buffer=getattr(args, "max_buffer", 1000),
+                    ai_batch_size=ai_batch_size,
+                    ai_batch_tokens=ai_batch_tokens,
+                    ai_batch_wait_ms=ai_batch_wait_ms
+                )
+            else:
+                # One session per run: client, cache and schema hash are built once, not per line
+                engine = Engine(**engine_kwargs)
+                for line in records:
+                    emit(engine.process(line))
         except EngineFailure as e:
+            writer.close()
             print(f"Engine Failure: {e}", file=sys.stderr)
             sys.exit(1)
         except KeyboardInterrupt:
             pass
+        finally:
+            profiling.close()
+            # Records emitted before an unexpected error still reach the sink
+            writer.close()
             
         if getattr(args, "stats", False):
             total_runs = global_stats.fast_path_hits + global_stats.ai_path_hits
             avg_latency = global_stats.total_latency_ms / total_runs if total_runs > 0 else 0.0
+            total_input_chars = input_stats.total_input_chars
             estimated_tokens = estimate_tokens("x" * total_input_chars) if total_input_chars else 0
             
-            try:
-                from importlib.metadata import version
-                v = version("symparse")
-            except Exception:
-                v = "unknown"
-                
-            print(f"\n--- Symparse Run Stats (v{v}) ---", file=sys.stderr)
+            print(f"\n--- Symparse Run Stats (v{_package_version()}) ---", file=sys.stderr)
             print(f"Fast Path Hits: {global_stats.fast_path_hits}", file=sys.stderr)
             print(f"AI Path Hits:   {global_stats.ai_path_hits}", file=sys.stderr)
             print(f"Average Latency: {avg_latency:.2f}ms", file=sys.stderr)
             print(f"Total Input:    {total_input_chars:,} chars (~{estimated_tokens:,} tokens)", file=sys.stderr)
-            if skipped_binary_lines:
-                print(f"Binary Skipped: {skipped_binary_lines} lines", file=sys.stderr)
+            if input_stats.skipped_binary_lines:
+                print(f"Binary Skipped: {input_stats.skipped_binary_lines} lines", file=sys.stderr)
+            from symparse.metrics import STAGES
+            for stage in STAGES:
+                if stage in global_stats.stages:
+                    t = global_stats.stages[stage].summary()
+                    print(
+                        f"  {stage:<17} n={t['count']:<8} p50 {t['p50_ms']:.3f}ms  p95 {t['p95_ms']:.3f}ms  "
+                        f"p99 {t['p99_ms']:.3f}ms  max {t['max_ms']:.3f}ms",
+                        file=sys.stderr
+                    )
+
+        stats_json = getattr(args, "stats_json", None)
+        if stats_json:
+            report = global_stats.to_dict()
+            report["version"] = _package_version()
+            report["total_input_chars"] = input_stats.total_input_chars
+            report["skipped_binary_lines"] = input_stats.skipped_binary_lines
+            if stats_json == "-":
+                print(json.dumps(report), file=sys.stderr)
+            else:
+                with open(stats_json, "w") as f:
+                    json.dump(report, f, indent=2)
         
 if __name__ == "__main__":
     main()
@@ -0,0 +1,80 @@
+"""
+JSON codec used on the hot paths (run output, LLM responses, cache metadata).
+
+Uses orjson when it is installed (``pip install symparse[fast]``) and the
+standard library otherwise. Both backends produce the same bytes: values
+orjson rejects (ints beyond 64 bits, non-string keys, lone surrogates) and
+floats it formats differently (exponent range, NaN/Infinity) are handed to
+stdlib ``json``.
+"""
+
+import json
+import re
+from typing import Any, Union
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - exercised when the extra is absent
+    orjson = None
+
+BACKEND = "orjson" if orjson is not None else "json"
+
+# orjson silently turns integers beyond 64 bits into floats; those need 20+ digits
+_LONG_DIGITS = re.compile(r"\d{20}")
+_LONG_DIGITS_BYTES = re.compile(rb"\d{20}")
+# Types orjson serializes natively but stdlib rejects (or renders via the base type) raise instead
+_ORJSON_OPTIONS = (
+    orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_PASSTHROUGH_DATACLASS | orjson.OPT_PASSTHROUGH_SUBCLASS
+    if orjson is not None else 0
+)
+
+
+def _floats_identical(values) -> bool:
+    """
+    True if every float among *values* (and nested containers) is one orjson
+    formats like stdlib: NaN/Infinity become null and repr() switches to
+    exponent notation outside this range. Other values need no check, since
+    orjson raises on anything else it would render differently.
+    """
+    for value in values:
+        kind = type(value)
+        if kind is float:
+            if not (value == 0.0 or 1e-4 <= abs(value) < 1e16):
+                return False
+        elif kind is dict:
+            if not _floats_identical(value.values()):
+                return False
+        elif kind is list or kind is tuple:
+            if not _floats_identical(value):
+                return False
+    return True
+
+
+def dumps_compact(obj: Any) -> str:
+    """
+    Serializes *obj* without whitespace and with raw UTF-8, byte-identical to
+    ``json.dumps(obj, separators=(",", ":"), ensure_ascii=False)``.
+    """
+    if orjson is not None and _floats_identical(obj.values() if type(obj) is dict else (obj,)):
+        try:
+            return orjson.dumps(obj, option=_ORJSON_OPTIONS).decode("utf-8")
+        except (orjson.JSONEncodeError, TypeError):
+            # e.g. big ints, non-string keys or lone surrogates, which stdlib handles
+            pass
+    return json.dumps(obj, separators=(",", ":"), ensure_ascii=False)
+
+
+def loads(data: Union[str, bytes]) -> Any:
+    """
+    Parses a JSON document. Input orjson rejects but stdlib accepts (NaN,
+    Infinity) is retried with stdlib, whose JSONDecodeError is raised for
+    genuinely malformed documents; documents that may hold integers beyond 64
+    bits go straight to stdlib so they stay exact.
+    """
+    long_digits = _LONG_DIGITS_BYTES if isinstance(data, bytes) else _LONG_DIGITS
+    if orjson is not None and not long_digits.search(data):
+        try:
+            return orjson.loads(data)
+        except orjson.JSONDecodeError:
+            pass
+    return json.loads(data)
@@ -1,9 +1,11 @@
 import json
 import logging
 import ast
+import hashlib
+import threading
+from typing import Any, Callable, Dict, Optional, Tuple
 import re2
-from litellm import completion
-from symparse.ai_client import AIClient
+from symparse.ai_client import AIClient, completion
 
 logger = logging.getLogger(__name__)
 
@@ -189,7 +191,7 @@ def _self_test_script(script_code: str, text: str, schema: dict, successful_json
     Returns True if the script produces output matching the expected JSON.
     """
     try:
-        result = execute_script(script_code, text, schema)
+        result = execute_script(script_code, text, schema, memoize=False)
         if not isinstance(result, dict):
             return False
         # Check all required fields are present with correct values
@@ -302,11 +304,9 @@ Do not import any libraries other than `re2`. Return ONLY the python code, no JS
     except Exception as e:
         raise CompilationFailedError(f"All compilation strategies failed. LLM: {llm_error}. Deterministic: {e}")
         
-def execute_script(script_content: str, text: str, schema: dict) -> dict:
-    """
-    Executes the sandboxed python extraction script to build the extracted dictionary.
-    """
-    safe_globals = {
+def _sandbox_globals() -> dict:
+    """Restricted globals used when executing cached extraction scripts."""
+    return {
         "__builtins__": {
             "int": int, "float": float, "bool": bool, "list": list, "dict": dict, 
             "set": set, "tuple": tuple, "len": len, "enumerate": enumerate,
@@ -314,14 +314,117 @@ def execute_script(script_content: str, text: str, schema: dict) -> dict:
         },
         "re2": re2
     }
+
+
+# In-process registry of compiled `extract` callables.
+# Keyed by (schema_hash, archetype_id, script revision) so an unchanged script is
+# only exec()'d once per process; CacheManager invalidates entries on save/delete.
+_extractor_registry: Dict[Tuple[str, str, str], Callable[[str], Any]] = {}
+_registry_lock = threading.Lock()
+
+
+def script_digest(script_content: str) -> str:
+    """Content hash identifying a specific revision of a cached script."""
+    return hashlib.sha256(script_content.encode("utf-8")).hexdigest()
+
+
+def load_extractor(script_content: str, schema_hash: str = "", memoize: bool = True,
+                   archetype_id: str = "", revision: Optional[str] = None) -> Callable[[str], Any]:
+    """
+    Returns the sandboxed `extract` callable defined by *script_content*.
+    Compilation happens once per (schema_hash, archetype_id, revision); later
+    calls are a dictionary lookup. Callers that know the script's revision (the
+    cache passes the digest recorded in its index) skip hashing the source;
+    otherwise it is hashed. Throwaway candidates (e.g. self-tests) should pass
+    ``memoize=False`` so they do not linger in the registry.
+    """
+    if revision is not None:
+        key = (schema_hash, archetype_id, revision)
+        extract_func = _extractor_registry.get(key)
+        if extract_func is not None:
+            return extract_func
+    elif memoize:
+        key = (schema_hash, archetype_id, script_digest(script_content))
+        extract_func = _extractor_registry.get(key)
+        if extract_func is not None:
+            return extract_func
+
     local_env = {}
-    
+    exec(script_content, _sandbox_globals(), local_env)
+
+    extract_func = local_env.get("extract")
+    if not extract_func or not callable(extract_func):
+        raise ValueError("Script did not define a callable 'extract' function.")
+
+    if memoize:
+        with _registry_lock:
+            _extractor_registry[key] = extract_func
+    return extract_func
+
+
+def extract_template_pattern(script_content: str, archetype_text: Optional[str] = None) -> Optional[str]:
+    """
+    Returns the pattern of a template-style script: one whose only re2 call is a
+    single `re2.search(<literal pattern>, text)`, as the deterministic compiler
+    writes them. Returns None for any other script shape.
+
+    With *archetype_text*, the pattern is anchored to that line: the text the
+    search leaves unmatched on either side is added as literals, so a full
+    match accepts lines of the archetype's shape but not ones with extra
+    leading or trailing fields. Returns None if the pattern does not match
+    *archetype_text* at all.
+    """
     try:
-        exec(script_content, safe_globals, local_env)
-        
-        extract_func = local_env.get("extract")
-        if not extract_func or not callable(extract_func):
-            raise ValueError("Script did not define a callable 'extract' function.")
+        tree = ast.parse(script_content)
+    except SyntaxError:
+        return None
+    patterns = []
+    for node in ast.walk(tree):
+        if not (isinstance(node, ast.Call) and isinstance(node.func, ast.Attribute)
+                and isinstance(node.func.value, ast.Name) and node.func.value.id == "re2"):
+            continue
+        if node.func.attr != "search" or not node.args:
+            return None
+        first = node.args[0]
+        if not (isinstance(first, ast.Constant) and isinstance(first.value, str)):
+            return None
+        patterns.append(first.value)
+    if len(patterns) != 1:
+        return None
+    if archetype_text is None:
+        return patterns[0]
+    try:
+        m = re2.search(patterns[0], archetype_text)
+    except re2.error:
+        return None
+    if not m:
+        return None
+    return f"{re2.escape(archetype_text[:m.start()])}(?:{patterns[0]}){re2.escape(archetype_text[m.end():])}"
+
+
+def invalidate_extractors(schema_hash: Optional[str] = None, archetype_id: Optional[str] = None):
+    """
+    Drops memoized extractors for one archetype of *schema_hash*, for every
+    archetype of it if *archetype_id* is None, or every extractor if both are None.
+    """
+    with _registry_lock:
+        if schema_hash is None:
+            _extractor_registry.clear()
+            return
+        for key in [k for k in _extractor_registry if k[0] == schema_hash and archetype_id in (None, k[1])]:
+            del _extractor_registry[key]
+
+
+def execute_script(script_content: str, text: str, schema: dict, schema_hash: str = "", memoize: bool = True,
+                   archetype_id: str = "", revision: Optional[str] = None) -> dict:
+    """
+    Executes the sandboxed python extraction script to build the extracted dictionary.
+    The compiled `extract` callable is memoized, so repeated calls with the same
+    script only pay for the extraction itself.
+    """
+    try:
+        extract_func = load_extractor(script_content, schema_hash, memoize=memoize,
+                                      archetype_id=archetype_id, revision=revision)
             
         result = extract_func(text)
         if not isinstance(result, dict):
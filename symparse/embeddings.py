@@ -0,0 +1,115 @@
+"""
+Process-wide sentence embeddings for Tier-2 (``--embed``) routing.
+
+The SentenceTransformer is loaded once per process and shared by every
+CacheManager. Embeddings are memoized in an LRU keyed by the structurally
+normalized line, so lines of the same format are encoded once, and misses are
+encoded in micro-batches. NumPy comes with sentence-transformers and is only
+imported once embeddings are actually used.
+"""
+
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, List, Optional, Sequence
+
+logger = logging.getLogger(__name__)
+
+MODEL_NAME = "all-MiniLM-L6-v2"
+DEFAULT_CACHE_SIZE = 4096
+DEFAULT_BATCH_SIZE = 32
+
+_encoder = None
+_encoder_unavailable = False
+_encoder_lock = threading.Lock()
+
+
+def get_encoder():
+    """Returns the shared SentenceTransformer, loading it on first use (None if not installed)."""
+    global _encoder, _encoder_unavailable
+    if _encoder is not None or _encoder_unavailable:
+        return _encoder
+    with _encoder_lock:
+        if _encoder is None and not _encoder_unavailable:
+            try:
+                from sentence_transformers import SentenceTransformer
+                # Use a widely available, tiny and fast model
+                _encoder = SentenceTransformer(MODEL_NAME)
+            except ImportError:
+                logger.warning("sentence-transformers not installed. Falling back to Jaccard similarity.")
+                _encoder_unavailable = True
+    return _encoder
+
+
+class EmbeddingCache:
+    """
+    LRU of float32 embedding vectors keyed by normalized text.
+    :meth:`embed_many` encodes every uncached key in batches of *batch_size*.
+    """
+
+    def __init__(self, maxsize: int = DEFAULT_CACHE_SIZE, batch_size: int = DEFAULT_BATCH_SIZE, encoder=None):
+        self.maxsize = maxsize
+        self.batch_size = max(1, batch_size)
+        self._encoder = encoder
+        self._entries: "OrderedDict[str, Any]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def embed(self, key: str) -> Optional[Any]:
+        """Embedding vector for one normalized line, or None if no encoder is available."""
+        return self.embed_many([key])[0]
+
+    def embed_many(self, keys: Sequence[str]) -> List[Optional[Any]]:
+        """Embedding vectors for *keys*, encoding the uncached ones in micro-batches."""
+        found = {}
+        with self._lock:
+            for key in keys:
+                vec = self._entries.get(key)
+                if vec is not None:
+                    self._entries.move_to_end(key)
+                    found[key] = vec
+        missing = list(dict.fromkeys(k for k in keys if k not in found))
+
+        if missing:
+            encoder = self._encoder if self._encoder is not None else get_encoder()
+            if encoder is None:
+                return [found.get(key) for key in keys]
+            import numpy as np
+            for i in range(0, len(missing), self.batch_size):
+                batch = missing[i:i + self.batch_size]
+                vectors = np.asarray(encoder.encode(batch, batch_size=self.batch_size), dtype=np.float32)
+                with self._lock:
+                    for key, vec in zip(batch, vectors):
+                        found[key] = vec
+                        self._entries[key] = vec
+                        self._entries.move_to_end(key)
+                    while len(self._entries) > self.maxsize:
+                        self._entries.popitem(last=False)
+        return [found.get(key) for key in keys]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+_default_cache: Optional[EmbeddingCache] = None
+
+
+def default_cache() -> EmbeddingCache:
+    """The process-wide embedding cache shared by every CacheManager."""
+    global _default_cache
+    if _default_cache is None:
+        with _encoder_lock:
+            if _default_cache is None:
+                _default_cache = EmbeddingCache()
+    return _default_cache
+
+
+def cosine_similarity(vec1, vec2) -> float:
+    """Cosine similarity of two vectors (lists or arrays) computed with NumPy."""
+    import numpy as np
+    a = np.asarray(vec1, dtype=np.float32)
+    b = np.asarray(vec2, dtype=np.float32)
+    denom = float(np.linalg.norm(a) * np.linalg.norm(b))
+    if denom == 0.0:
+        return 0.0
+    return float(np.dot(a, b) / denom)
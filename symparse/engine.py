@@ -1,15 +1,24 @@
 import logging
-from dataclasses import dataclass
+import re
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass, field
 from enum import Enum
-from typing import Any, Dict
+from typing import Any, Callable, Dict, List, Optional
 
 from symparse.ai_client import AIClient, ConfidenceDegradationError
-from symparse.validator import enforce_schema, SchemaViolationError
+from symparse.validator import compile_validator, SchemaViolationError
 from symparse.cache_manager import CacheManager
 from symparse.compiler import generate_script, execute_script
+from symparse.metrics import LatencyHistogram, timed_call
+from symparse.utils import token_budget_warning
 
 logger = logging.getLogger(__name__)
 
+# Control characters stripped by --sanitize before the AI Path
+_CONTROL_CHARS = re.compile(r'[\x00-\x08\x0b\x0c\x0e-\x1f\x7f]')
+
 class GracefulDegradationMode(Enum):
     HALT = "halt"
     PASSTHROUGH = "passthrough"
@@ -19,13 +28,404 @@ class EngineStats:
     fast_path_hits: int = 0
     ai_path_hits: int = 0
     total_latency_ms: float = 0.0
+    # Stage name (see symparse.metrics.STAGES) -> latency histogram
+    stages: Dict[str, LatencyHistogram] = field(default_factory=dict)
+
+    def record_stage(self, stage: str, elapsed_ns: int):
+        histogram = self.stages.get(stage)
+        if histogram is None:
+            histogram = self.stages[stage] = LatencyHistogram()
+        histogram.record(elapsed_ns)
+
+    def merge(self, other: "EngineStats"):
+        """Accumulates counters from another session (e.g. a worker process)."""
+        self.fast_path_hits += other.fast_path_hits
+        self.ai_path_hits += other.ai_path_hits
+        self.total_latency_ms += other.total_latency_ms
+        for stage, histogram in other.stages.items():
+            self.stages.setdefault(stage, LatencyHistogram()).merge(histogram)
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Machine-readable form used by ``--stats-json``."""
+        return {
+            "fast_path_hits": self.fast_path_hits,
+            "ai_path_hits": self.ai_path_hits,
+            "total_latency_ms": round(self.total_latency_ms, 3),
+            "stages": {stage: histogram.summary() for stage, histogram in self.stages.items()},
+        }
 
 global_stats = EngineStats()
 
+class CircuitBreaker:
+    """
+    Sliding-window failure counter for cached extractors. An extractor trips
+    once at least ``min_failures`` of its last ``window`` Fast Path executions
+    failed and their share reaches ``threshold``. Every execution counts from
+    the first one, so a burst of failures after a long run of successes is
+    judged against those successes; a success is one dictionary lookup and a
+    deque append.
+    """
+
+    def __init__(self, window: int = 20, threshold: float = 0.5, min_failures: int = 3):
+        self.window = window
+        self.threshold = threshold
+        self.min_failures = min_failures
+        self._outcomes: Dict[tuple, deque] = {}
+        self._lock = threading.Lock()
+
+    def _window(self, key: tuple) -> deque:
+        outcomes = self._outcomes.get(key)
+        if outcomes is None:
+            with self._lock:
+                outcomes = self._outcomes.setdefault(key, deque(maxlen=self.window))
+        return outcomes
+
+    def record_success(self, key: tuple):
+        # deque.append is atomic; a window dropped by a concurrent trip just loses this entry
+        self._window(key).append(False)
+
+    def record_failure(self, key: tuple) -> bool:
+        """Records a failure for *key*; returns True (and resets its window) if the breaker tripped."""
+        outcomes = self._window(key)
+        with self._lock:
+            outcomes.append(True)
+            failures = sum(outcomes)
+            if failures < self.min_failures or failures / len(outcomes) < self.threshold:
+                return False
+            self._outcomes.pop(key, None)
+            return True
+
 class EngineFailure(Exception):
     """Raised when engine fails and degradation mode is HALT."""
     pass
 
+class Engine:
+    """
+    Long-lived extraction session for a single schema.
+
+    Owns the AI client, the cache manager, the precomputed schema hash and the
+    validator so that a stream only pays their setup cost once. The CLI builds
+    one Engine per run and calls :meth:`process` for every line.
+    """
+
+    def __init__(
+        self,
+        schema_dict: dict,
+        compile: bool = False,
+        force_ai: bool = False,
+        max_retries: int = 3,
+        degradation_mode: GracefulDegradationMode = GracefulDegradationMode.HALT,
+        confidence_threshold: float = None,
+        use_embeddings: bool = False,
+        model: str = None,
+        sanitize: bool = False,
+        max_tokens: int = 4000,
+        stats: EngineStats = None,
+        validator_backend: str = "jsonschema",
+        cache_dir: Optional[str] = None,
+        cache_backend: Optional[str] = None,
+        failure_window: int = 20,
+        failure_threshold: float = 0.5
+    ):
+        self.schema_dict = schema_dict
+        self.compile = compile
+        self.force_ai = force_ai
+        self.max_retries = max_retries
+        self.degradation_mode = degradation_mode
+        self.use_embeddings = use_embeddings
+        self.model = model
+        self.sanitize = sanitize
+        self.stats = stats if stats is not None else global_stats
+        self._stats_lock = threading.Lock()
+        # Single-flight cold starts: (schema hash, structural signature) -> event set when the leader finishes
+        self._inflight: Dict[tuple, threading.Event] = {}
+        self._inflight_lock = threading.Lock()
+        # A failing script only loses the line it failed on until its failure rate trips the breaker
+        self.breaker = CircuitBreaker(window=failure_window, threshold=failure_threshold)
+
+        self.ai_client = AIClient(logprob_threshold=confidence_threshold, model=model, max_tokens=max_tokens)
+        cache_kwargs = {}
+        if cache_dir:
+            cache_kwargs["cache_dir"] = cache_dir
+        if cache_backend:
+            cache_kwargs["backend"] = cache_backend
+        self.cache_manager = CacheManager(**cache_kwargs)
+        # The cache times the stages it runs internally (the similarity gate) through the engine
+        self.cache_manager.run_stage = self._timed
+        self.schema_hash = self.cache_manager._hash_schema(schema_dict)
+        # Compiled once per schema and shared by the fast and AI paths
+        self._validator = compile_validator(schema_dict, backend=validator_backend, schema_key=self.schema_hash)
+
+    def validate(self, data: dict) -> bool:
+        """Validate an extraction result against the session schema."""
+        return self._validator(data)
+
+    def process(self, input_text: str) -> Dict[str, Any]:
+        """
+        Entry point handling routing logic for a single record.
+        Routes Fast Paths (sandboxed re2 scripts) vs AI Paths (LLM extraction).
+        """
+        input_text = self.prepare(input_text)
+        start_time = time.perf_counter()
+        fast_json = self.try_fast_path(input_text, start_time)
+        if fast_json is not None:
+            return fast_json
+        return self.ai_path(input_text, start_time)
+
+    def prefetch(self, input_texts: List[str]):
+        """
+        Warms per-record state for a block of upcoming records. With embeddings on,
+        lines bound for the embedding gate are encoded together in micro-batches.
+        """
+        if self.use_embeddings and not self.force_ai:
+            self.cache_manager.prefetch_embeddings(self.schema_hash, [self.prepare(t) for t in input_texts])
+
+    def prepare(self, input_text: str) -> str:
+        """Applies per-record preprocessing shared by both paths."""
+        # Optional input sanitization to mitigate prompt injection
+        if self.sanitize:
+            input_text = _CONTROL_CHARS.sub('', input_text)
+        return input_text
+
+    def try_fast_path(self, input_text: str, start_time: Optional[float] = None) -> Optional[Dict[str, Any]]:
+        """
+        Returns the Fast Path extraction for a prepared record, or None when the
+        record needs the AI Path (cache miss, failing script, or --force-ai).
+        *start_time*, here and in the other paths, is a ``time.perf_counter()``
+        reading, so wall-clock adjustments do not skew the latency stats.
+        """
+        if self.force_ai:
+            return None
+        start_time = start_time if start_time is not None else time.perf_counter()
+        return self._replay_fast_path(input_text, start_time)
+
+    def ai_path(self, input_text: str, start_time: Optional[float] = None) -> Dict[str, Any]:
+        """
+        Runs the AI Path for a prepared record. Safe to call from worker threads,
+        which is how the concurrent pipeline keeps fast-path records flowing.
+
+        With compilation on, cold starts are coalesced per structural signature:
+        the first line of a new format goes to the LLM and compiles, while
+        concurrent lines of the same format wait for it and are replayed through
+        the Fast Path, only falling back to the LLM if that script fails them.
+        """
+        start_time = start_time if start_time is not None else time.perf_counter()
+        if not self.compile or self.force_ai:
+            return self._ai_path(input_text, start_time)
+
+        key = (self.schema_hash, self.cache_manager._archetype_id(input_text))
+        with self._inflight_lock:
+            leader = self._inflight.get(key)
+            if leader is None:
+                done = self._inflight[key] = threading.Event()
+
+        # Replays do not count towards the breaker: this record's own attempt already did
+        if leader is None:
+            try:
+                # A flight that finished after this record's fast-path attempt may have compiled its format
+                fast_json = self._replay_fast_path(input_text, start_time, track=False)
+                return fast_json if fast_json is not None else self._ai_path(input_text, start_time)
+            finally:
+                with self._inflight_lock:
+                    del self._inflight[key]
+                done.set()
+
+        leader.wait()
+        fast_json = self._replay_fast_path(input_text, start_time, track=False)
+        return fast_json if fast_json is not None else self._ai_path(input_text, start_time)
+
+    def _replay_fast_path(self, input_text: str, start_time: float, track: bool = True) -> Optional[Dict[str, Any]]:
+        fast_json = self._fast_path(input_text, track)
+        if fast_json is not None:
+            self._record_hit("fast", start_time)
+        return fast_json
+
+    def _record_hit(self, path: str, start_time: float):
+        latency_ms = (time.perf_counter() - start_time) * 1000
+        with self._stats_lock:
+            if path == "fast":
+                self.stats.fast_path_hits += 1
+            else:
+                self.stats.ai_path_hits += 1
+            self.stats.total_latency_ms += latency_ms
+            self.stats.record_stage(f"{path}_path", int(latency_ms * 1e6))
+
+    def _record_stage(self, stage: str, elapsed_ns: int):
+        with self._stats_lock:
+            self.stats.record_stage(stage, elapsed_ns)
+
+    def _timed(self, stage: str, func: Callable, *args, **kwargs):
+        """Calls *func*, recording its duration under *stage* and reporting it to any span hooks."""
+        return timed_call(stage, self._record_stage, func, *args, **kwargs)
+
+    def _fast_path(self, input_text: str, track: bool = True) -> Optional[Dict[str, Any]]:
+        """
+        Runs the archetype script routed for this line. A failure sends just this
+        line to the AI Path; the script is quarantined once the circuit breaker
+        trips. With *track* off (replays) outcomes are not counted.
+        """
+        cached = self._timed(
+            "cache_fetch", self.cache_manager.lookup,
+            self.schema_dict, input_text, self.use_embeddings, schema_hash=self.schema_hash, count=track
+        )
+        if not cached:
+            return None
+
+        logger.info("Executing Fast Path via cached script")
+        started_ns = time.perf_counter_ns()
+        try:
+            fast_json = self._timed(
+                "script_execution", execute_script, cached.script, input_text, self.schema_dict,
+                schema_hash=self.schema_hash, archetype_id=cached.archetype_id, revision=cached.revision
+            )
+            self._timed("validation", self.validate, fast_json)
+        except SchemaViolationError as e:
+            failure, error = "validation_failures", f"failed validation ({e})"
+        except Exception as e:
+            failure, error = "execution_failures", f"failed execution ({e})"
+        else:
+            if not self.cache_manager.confirm_route(cached, fast_json):
+                # Not the script's failure: the line is another format that needs its own extractor
+                logger.info("Similarity-routed script left part of the line unextracted. Routing it through the AI Path.")
+                return None
+            if track:
+                self.cache_manager.record_counters(
+                    self.schema_hash, cached.archetype_id, executions=1, exec_ns=time.perf_counter_ns() - started_ns
+                )
+                self.breaker.record_success((self.schema_hash, cached.archetype_id))
+            return fast_json
+
+        if not track:
+            logger.debug(f"Fast path replay {error}.")
+            return None
+        counters = {failure: 1, "executions": 1, "exec_ns": time.perf_counter_ns() - started_ns}
+        if self.breaker.record_failure((self.schema_hash, cached.archetype_id)):
+            logger.warning(f"Fast path {error}; failure rate crossed the threshold, quarantining the cached script.")
+            counters["quarantines"] = 1
+            self.cache_manager.quarantine_script(
+                self.schema_dict, schema_hash=self.schema_hash, archetype_id=cached.archetype_id, revision=cached.revision
+            )
+        else:
+            logger.warning(f"Fast path {error}. Routing this line through the AI Path.")
+        self.cache_manager.record_counters(self.schema_hash, cached.archetype_id, **counters)
+        return None
+
+    def ai_path_batch(self, input_texts: List[str], start_time: Optional[float] = None) -> List[Optional[Dict[str, Any]]]:
+        """
+        Extracts several prepared records with a single LLM request.
+
+        Each element is validated on its own; valid ones are returned (and, with
+        compilation on, the first record of each new structural signature is
+        compiled), while records whose element failed validation, or every record
+        if the request itself failed, come back as None for the caller to retry
+        individually through :meth:`ai_path`.
+        """
+        start_time = start_time if start_time is not None else time.perf_counter()
+        logger.info(f"Routing {len(input_texts)} records through batched AI Path")
+        try:
+            extracted = self._timed("ai_call", self.ai_client.extract_batch, input_texts, self.schema_dict)
+        except Exception as e:
+            logger.warning(f"Batched extraction failed ({e}); retrying records individually.")
+            return [None] * len(input_texts)
+
+        results: List[Optional[Dict[str, Any]]] = []
+        compiled = set()
+        # Every script compiled from this response lands in one cache commit. The
+        # commit runs when the block exits, outside _compile's own error handling
+        extracted_all = False
+        try:
+            with self.cache_manager.batch():
+                for input_text, extracted_json in zip(input_texts, extracted):
+                    try:
+                        self._timed("validation", self.validate, extracted_json)
+                    except SchemaViolationError as e:
+                        logger.warning(f"Batch element failed validation: {e}")
+                        results.append(None)
+                        continue
+                    if self._should_compile(input_text):
+                        archetype_id = self.cache_manager._archetype_id(input_text)
+                        if archetype_id not in compiled:
+                            compiled.add(archetype_id)
+                            self._timed("compile", self._compile, input_text, extracted_json)
+                    self._record_hit("ai", start_time)
+                    results.append(extracted_json)
+                extracted_all = True
+        except Exception as commit_err:
+            if not extracted_all:
+                raise
+            logger.warning(f"Compilation failed (non-fatal, extraction still valid): {commit_err}")
+        return results
+
+    def _should_compile(self, input_text: str) -> bool:
+        """
+        Compilation is on and the line's format has no healthy script. A rare
+        variant its format's script failed on must not overwrite that script;
+        only a quarantined (or missing) script is replaced.
+        """
+        return self.compile and not self.cache_manager.has_extractor(
+            self.schema_hash, self.cache_manager._archetype_id(input_text)
+        )
+
+    def _compile(self, input_text: str, extracted_json: Dict[str, Any]):
+        """Auto-compiler logic (non-fatal: compilation failure should not block returning valid extraction)."""
+        logger.info("Compiling extraction to local python script cache")
+        try:
+            generated_script = generate_script(input_text, self.schema_dict, extracted_json)
+            self.cache_manager.save_script(
+                self.schema_dict, input_text, generated_script, self.use_embeddings,
+                schema_hash=self.schema_hash
+            )
+        except Exception as compile_err:
+            logger.warning(f"Compilation failed (non-fatal, extraction still valid): {compile_err}")
+
+    def _ai_path(self, input_text: str, start_time: float) -> Dict[str, Any]:
+        """Cold Start extraction through the LLM with validation retries."""
+        logger.info("Routing through AI Path (Cold Start)")
+
+        # Token budget warning before sending to LLM
+        budget_warn = token_budget_warning(input_text, model=self.model)
+        if budget_warn:
+            logger.warning(budget_warn)
+
+        last_error_message = ""
+        prompt_text = input_text
+
+        for attempt in range(self.max_retries):
+            try:
+                current_prompt = prompt_text
+                if last_error_message:
+                    current_prompt += f"\n\nERROR FROM PREVIOUS ATTEMPT:\n{last_error_message}\nPlease fix your output to strictly adhere to the schema."
+
+                extracted_json = self._timed("ai_call", self.ai_client.extract, current_prompt, self.schema_dict)
+
+                # Pass to validator
+                self._timed("validation", self.validate, extracted_json)
+
+                if self._should_compile(input_text):
+                    self._timed("compile", self._compile, input_text, extracted_json)
+
+                self._record_hit("ai", start_time)
+                return extracted_json
+
+            except (SchemaViolationError, ConfidenceDegradationError) as e:
+                logger.warning(f"Attempt {attempt + 1} failed: {e}")
+                last_error_message = str(e)
+
+            except Exception as e:
+                logger.error(f"Unexpected error during extraction: {e}")
+                break
+
+        # If we get here, validation utterly failed after retries
+        if self.degradation_mode == GracefulDegradationMode.HALT:
+            raise EngineFailure(f"Failed to extract matching schema after {self.max_retries} attempts. Last error: {last_error_message}")
+        elif self.degradation_mode == GracefulDegradationMode.PASSTHROUGH:
+            return {
+                "error": "Validation failed",
+                "last_error": last_error_message,
+                "raw_text": input_text
+            }
+
+
 def process_stream(
     input_text: str, 
     schema_dict: dict, 
@@ -37,91 +437,25 @@ def process_stream(
     use_embeddings: bool = False,
     model: str = None,
     sanitize: bool = False,
-    max_tokens: int = 4000
+    max_tokens: int = 4000,
+    validator_backend: str = "jsonschema"
 ) -> Dict[str, Any]:
     """
-    Entry point handling routing logic.
-    Routes Fast Paths (sandboxed re2 scripts) vs AI Paths (LLM extraction).
+    One-shot convenience wrapper around :class:`Engine`.
+    Builds a fresh session for a single record; streams should create one
+    Engine and reuse it so the client and cache setup is only paid once.
     """
-    ai_client = AIClient(logprob_threshold=confidence_threshold, model=model, max_tokens=max_tokens)
-    cache_manager = CacheManager()
-    
-    # Optional input sanitization to mitigate prompt injection
-    if sanitize:
-        import re
-        input_text = re.sub(r'[\x00-\x08\x0b\x0c\x0e-\x1f\x7f]', '', input_text)
-    
-    # Fast path logic
-    import time
-    start_time = time.time()
-    if not force_ai:
-        cached_script = cache_manager.fetch_script(schema_dict, input_text, use_embeddings)
-        if cached_script:
-            logger.info("Executing Fast Path via cached script")
-            try:
-                fast_json = execute_script(cached_script, input_text, schema_dict)
-                enforce_schema(fast_json, schema_dict)
-                global_stats.fast_path_hits += 1
-                global_stats.total_latency_ms += (time.time() - start_time) * 1000
-                return fast_json
-            except SchemaViolationError as e:
-                logger.warning(f"Fast path failed validation ({e}). Falling back to AI Path and purging cache.")
-                cache_manager.delete_script(schema_dict)
-            except Exception as e:
-                logger.warning(f"Fast path failed execution ({e}). Falling back to AI Path and purging cache.")
-                cache_manager.delete_script(schema_dict)
-
-    # AI Path (Cold Start)
-    logger.info("Routing through AI Path (Cold Start)")
-    
-    # Token budget warning before sending to LLM
-    from symparse.utils import token_budget_warning
-    budget_warn = token_budget_warning(input_text, model=model)
-    if budget_warn:
-        logger.warning(budget_warn)
-    
-    last_error_message = ""
-    prompt_text = input_text
-    
-    for attempt in range(max_retries):
-        try:
-            current_prompt = prompt_text
-            if last_error_message:
-                current_prompt += f"\n\nERROR FROM PREVIOUS ATTEMPT:\n{last_error_message}\nPlease fix your output to strictly adhere to the schema."
-            
-            extracted_json = ai_client.extract(current_prompt, schema_dict)
-            
-            # Pass to validator
-            enforce_schema(extracted_json, schema_dict)
-            
-            # Auto-compiler logic (non-fatal: compilation failure should not block returning valid extraction)
-            if compile:
-                logger.info("Compiling extraction to local python script cache")
-                try:
-                    generated_script = generate_script(input_text, schema_dict, extracted_json)
-                    cache_manager.save_script(schema_dict, input_text, generated_script, use_embeddings)
-                except Exception as compile_err:
-                    logger.warning(f"Compilation failed (non-fatal, extraction still valid): {compile_err}")
-                
-            global_stats.ai_path_hits += 1
-            global_stats.total_latency_ms += (time.time() - start_time) * 1000
-            return extracted_json
-            
-        except (SchemaViolationError, ConfidenceDegradationError) as e:
-            logger.warning(f"Attempt {attempt + 1} failed: {e}")
-            last_error_message = str(e)
-            
-        except Exception as e:
-            logger.error(f"Unexpected error during extraction: {e}")
-            break
-
-    # If we get here, validation utterly failed after retries
-    if degradation_mode == GracefulDegradationMode.HALT:
-        raise EngineFailure(f"Failed to extract matching schema after {max_retries} attempts. Last error: {last_error_message}")
-    elif degradation_mode == GracefulDegradationMode.PASSTHROUGH:
-        return {
-            "error": "Validation failed",
-            "last_error": last_error_message,
-            "raw_text": input_text
-        }
-
+    engine = Engine(
+        schema_dict,
+        compile=compile,
+        force_ai=force_ai,
+        max_retries=max_retries,
+        degradation_mode=degradation_mode,
+        confidence_threshold=confidence_threshold,
+        use_embeddings=use_embeddings,
+        model=model,
+        sanitize=sanitize,
+        max_tokens=max_tokens,
+        validator_backend=validator_backend
+    )
+    return engine.process(input_text)
@@ -0,0 +1,149 @@
+import logging
+import time
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Pipeline stages timed by the engine, in the order a record meets them
+STAGES = (
+    "cache_fetch",
+    "similarity_gate",
+    "script_execution",
+    "validation",
+    "ai_call",
+    "compile",
+    "output_write",
+    "fast_path",
+    "ai_path",
+)
+
+# Each power-of-two range of nanoseconds is split into 2**_SUB_BUCKET_BITS
+# buckets, so a reported quantile is within 12.5% of the recorded value
+_SUB_BUCKET_BITS = 3
+_EXACT_LIMIT = 1 << (_SUB_BUCKET_BITS + 1)
+
+def _bucket_index(value_ns: int) -> int:
+    if value_ns < _EXACT_LIMIT:
+        return max(value_ns, 0)
+    shift = value_ns.bit_length() - (_SUB_BUCKET_BITS + 1)
+    return (shift << _SUB_BUCKET_BITS) + (value_ns >> shift)
+
+def _bucket_upper(index: int) -> int:
+    """Largest value that falls in bucket *index*."""
+    if index < _EXACT_LIMIT:
+        return index
+    shift = (index >> _SUB_BUCKET_BITS) - 1
+    mantissa = index - (shift << _SUB_BUCKET_BITS)
+    return ((mantissa + 1) << shift) - 1
+
+@dataclass
+class LatencyHistogram:
+    """
+    Log-linear histogram of durations in nanoseconds. Recording is one bucket
+    increment, histograms from worker processes merge by adding buckets, and
+    quantiles are read back with bounded relative error instead of an average.
+    """
+    buckets: Dict[int, int] = field(default_factory=dict)
+    count: int = 0
+    total_ns: int = 0
+    max_ns: int = 0
+
+    def record(self, elapsed_ns: int):
+        index = _bucket_index(elapsed_ns)
+        self.buckets[index] = self.buckets.get(index, 0) + 1
+        self.count += 1
+        self.total_ns += elapsed_ns
+        if elapsed_ns > self.max_ns:
+            self.max_ns = elapsed_ns
+
+    def merge(self, other: "LatencyHistogram"):
+        for index, n in other.buckets.items():
+            self.buckets[index] = self.buckets.get(index, 0) + n
+        self.count += other.count
+        self.total_ns += other.total_ns
+        self.max_ns = max(self.max_ns, other.max_ns)
+
+    def quantile(self, q: float) -> int:
+        """Upper bound (in ns, capped at the maximum) of the bucket holding the q-th quantile."""
+        if not self.count:
+            return 0
+        rank = max(1, int(q * self.count + 0.5))
+        seen = 0
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if seen >= rank:
+                return min(_bucket_upper(index), self.max_ns)
+        return self.max_ns
+
+    def summary(self) -> Dict[str, float]:
+        """Count plus mean, p50, p95, p99 and max in milliseconds."""
+        return {
+            "count": self.count,
+            "mean_ms": round(self.total_ns / self.count / 1e6, 3) if self.count else 0.0,
+            "p50_ms": round(self.quantile(0.50) / 1e6, 3),
+            "p95_ms": round(self.quantile(0.95) / 1e6, 3),
+            "p99_ms": round(self.quantile(0.99) / 1e6, 3),
+            "max_ms": round(self.max_ns / 1e6, 3),
+        }
+
+
+class SpanHook:
+    """
+    Receives a start and an end event for every timed pipeline stage.
+    Subclass it and register an instance with :func:`add_span_hook` to feed
+    stage timings into your own tracing (e.g. open an OpenTelemetry span in
+    :meth:`span_start` and return it, then end it in :meth:`span_end`).
+
+    Hooks run inline on the thread doing the work, so keep them cheap. An
+    exception raised by a hook is logged and does not affect extraction.
+    """
+
+    def span_start(self, stage: str) -> Any:
+        """Called before *stage* runs; the return value is passed back to :meth:`span_end`."""
+        return None
+
+    def span_end(self, stage: str, token: Any, elapsed_ns: int, error: Optional[BaseException]):
+        """Called after *stage* finished (or raised *error*) with its duration."""
+
+
+# Registered hooks; a tuple so the hot path reads it without locking
+_span_hooks: Tuple[SpanHook, ...] = ()
+
+def add_span_hook(hook: SpanHook):
+    """Registers *hook* for every stage timed in this process."""
+    global _span_hooks
+    _span_hooks = _span_hooks + (hook,)
+
+def remove_span_hook(hook: SpanHook):
+    global _span_hooks
+    _span_hooks = tuple(h for h in _span_hooks if h is not hook)
+
+def timed_call(stage: str, record: Callable[[str, int], None], func: Callable, *args, **kwargs):
+    """
+    Calls *func*, passes its duration (even when it raises) to *record* and
+    reports the span to the registered hooks. Without hooks this is two
+    ``perf_counter_ns`` reads.
+    """
+    hooks = _span_hooks
+    tokens = [_call_hook(h.span_start, stage) for h in hooks] if hooks else None
+    error = None
+    started_ns = time.perf_counter_ns()
+    try:
+        return func(*args, **kwargs)
+    except BaseException as e:
+        error = e
+        raise
+    finally:
+        elapsed_ns = time.perf_counter_ns() - started_ns
+        record(stage, elapsed_ns)
+        if tokens is not None:
+            for hook, token in zip(hooks, tokens):
+                _call_hook(hook.span_end, stage, token, elapsed_ns, error)
+
+def _call_hook(method: Callable, *args):
+    try:
+        return method(*args)
+    except Exception as e:
+        logger.warning(f"Span hook {method.__qualname__} failed: {e}")
+        return None
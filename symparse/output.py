@@ -0,0 +1,333 @@
+"""Buffered record output and columnar sinks for the ``symparse run`` loop."""
+
+import csv
+import io
+import json
+import logging
+import sys
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, BinaryIO, Callable, List, Optional, TextIO, Tuple
+
+from symparse.codec import dumps_compact
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUFFER_BYTES = 64 * 1024
+DEFAULT_FLUSH_INTERVAL_MS = 100
+DEFAULT_BATCH_ROWS = 8192
+
+OUTPUT_FORMATS = ("ndjson", "csv", "tsv", "arrow", "parquet")
+
+
+class RecordWriter:
+    """
+    Writes records to *stream* as newline-delimited JSON, batching the writes.
+
+    Pending output is flushed once it reaches *buffer_bytes*, once the oldest
+    pending record has waited *flush_interval_ms* (checked by a background thread,
+    so an idle ``tail -f`` stream still sees every line promptly) and on
+    :meth:`close`. An interval of 0 flushes after every record, like the former
+    print-and-flush loop. With *threaded*, serialization also moves to the writer
+    thread and :meth:`write` only queues the record. A *header* line, if given,
+    is written ahead of the first record.
+    """
+
+    def __init__(
+        self,
+        stream: TextIO,
+        flush_interval_ms: int = DEFAULT_FLUSH_INTERVAL_MS,
+        buffer_bytes: int = DEFAULT_BUFFER_BYTES,
+        threaded: bool = False,
+        serialize: Callable[[Any], str] = json.dumps,
+        header: Optional[str] = None
+    ):
+        self._stream = stream
+        self._interval = max(0, flush_interval_ms) / 1000
+        self._buffer_bytes = max(1, buffer_bytes)
+        self._threaded = threaded
+        self._serialize = serialize
+
+        self._cond = threading.Condition()
+        self._records: List[Any] = []
+        self._pending: List[str] = []
+        self._pending_bytes = 0
+        self._pending_since: Optional[float] = None
+        self._closed = False
+        self._error: Optional[BaseException] = None
+
+        if header is not None:
+            with self._cond:
+                self._append_locked([header + "\n"])
+
+        self._thread = None
+        if threaded or self._interval > 0:
+            self._thread = threading.Thread(target=self._run, name="symparse-writer", daemon=True)
+            self._thread.start()
+
+    def write(self, record: Any):
+        """Queues one record for output."""
+        if self._error is not None:
+            raise self._error
+        if self._threaded:
+            with self._cond:
+                self._records.append(record)
+                self._cond.notify()
+            return
+        line = self._serialize(record) + "\n"
+        with self._cond:
+            was_idle = not self._pending
+            self._append_locked([line])
+            if was_idle and self._pending:
+                # Let the timer thread pick up the new deadline
+                self._cond.notify()
+
+    def close(self):
+        """Writes everything still pending and stops the writer thread."""
+        with self._cond:
+            if self._closed:
+                return
+            self._closed = True
+            self._cond.notify()
+        if self._thread is not None:
+            self._thread.join()
+        with self._cond:
+            self._flush_locked()
+        if self._error is not None:
+            raise self._error
+
+    def __enter__(self) -> "RecordWriter":
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _append_locked(self, lines: List[str]):
+        self._pending.extend(lines)
+        self._pending_bytes += sum(len(line) for line in lines)
+        if self._pending_since is None:
+            self._pending_since = time.monotonic()
+        if self._interval == 0 or self._pending_bytes >= self._buffer_bytes:
+            self._flush_locked()
+
+    def _flush_locked(self):
+        if not self._pending:
+            return
+        self._stream.write("".join(self._pending))
+        self._stream.flush()
+        self._pending = []
+        self._pending_bytes = 0
+        self._pending_since = None
+
+    def _run(self):
+        with self._cond:
+            try:
+                while True:
+                    if self._records:
+                        records, self._records = self._records, []
+                        # Serialize without holding the lock so producers are never blocked on it
+                        self._cond.release()
+                        try:
+                            lines = [self._serialize(record) + "\n" for record in records]
+                        finally:
+                            self._cond.acquire()
+                        self._append_locked(lines)
+                        continue
+                    if self._closed:
+                        return
+                    if self._pending and self._interval > 0:
+                        remaining = self._pending_since + self._interval - time.monotonic()
+                        if remaining <= 0:
+                            self._flush_locked()
+                        else:
+                            self._cond.wait(remaining)
+                    else:
+                        self._cond.wait()
+            except BaseException as e:
+                self._error = e
+
+
+# --- Columnar sinks ---
+
+@dataclass
+class Column:
+    """One output column derived from the schema; nested objects become dotted names."""
+    name: str
+    keys: Tuple[str, ...]
+    type: str  # string | integer | number | boolean | json
+
+
+_SCALAR_TYPES = ("string", "integer", "number", "boolean")
+
+
+def schema_columns(schema: dict, _keys: Tuple[str, ...] = ()) -> List[Column]:
+    """
+    Derives the column order and types from a JSON schema's ``properties``.
+    Objects with declared properties are flattened into dotted columns; arrays
+    and free-form objects become a single column holding compact JSON.
+    """
+    columns = []
+    for name, prop in schema.get("properties", {}).items():
+        keys = _keys + (name,)
+        ptype = prop.get("type", "string")
+        if isinstance(ptype, list):
+            non_null = [t for t in ptype if t != "null"]
+            ptype = non_null[0] if len(non_null) == 1 else "json"
+        if ptype == "object" and prop.get("properties"):
+            columns.extend(schema_columns(prop, keys))
+        elif ptype in _SCALAR_TYPES:
+            columns.append(Column(".".join(keys), keys, ptype))
+        else:
+            columns.append(Column(".".join(keys), keys, "json"))
+    return columns
+
+
+def _typed_value(record: Any, column: Column) -> Any:
+    """Looks up *column* in *record*, coercing to the column type (None when absent or mismatched)."""
+    value = record
+    for key in column.keys:
+        if not isinstance(value, dict) or key not in value:
+            return None
+        value = value[key]
+    if value is None:
+        return None
+    kind = column.type
+    if kind == "json":
+        return dumps_compact(value)
+    if kind == "string":
+        return value if isinstance(value, str) else dumps_compact(value)
+    if kind == "boolean":
+        return value if isinstance(value, bool) else None
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        return None
+    if kind == "integer":
+        if isinstance(value, float):
+            return int(value) if value.is_integer() else None
+        return value
+    return float(value)
+
+
+def _row(record: Any, columns: List[Column]) -> List[Any]:
+    if isinstance(record, dict) and "error" in record and "raw_text" in record:
+        logger.warning(f"Passthrough record has no columnar form: {record.get('last_error', record['error'])}")
+    return [_typed_value(record, column) for column in columns]
+
+
+def _cell(value: Any) -> str:
+    if value is None:
+        return ""
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    return str(value)
+
+
+def delimited_serializer(columns: List[Column], delimiter: str) -> Callable[[Any], str]:
+    """Returns a RecordWriter serializer rendering one CSV/TSV row (without the newline)."""
+    def serialize(record: Any) -> str:
+        buf = io.StringIO()
+        csv.writer(buf, delimiter=delimiter, lineterminator="").writerow(_cell(v) for v in _row(record, columns))
+        return buf.getvalue()
+    return serialize
+
+
+def delimited_header(columns: List[Column], delimiter: str) -> str:
+    buf = io.StringIO()
+    csv.writer(buf, delimiter=delimiter, lineterminator="").writerow(c.name for c in columns)
+    return buf.getvalue()
+
+
+def _require_pyarrow():
+    try:
+        import pyarrow
+    except ImportError:
+        raise ImportError("Arrow/Parquet output requires pyarrow. Install it with `pip install symparse[arrow]`.")
+    return pyarrow
+
+
+class ArrowBatchWriter:
+    """
+    Accumulates records into typed column batches and writes them as an Arrow
+    IPC stream or a Parquet file once *batch_rows* rows are pending and on
+    :meth:`close`. Requires the optional ``pyarrow`` dependency.
+    """
+
+    def __init__(self, sink: BinaryIO, columns: List[Column], output_format: str = "arrow",
+                 batch_rows: int = DEFAULT_BATCH_ROWS):
+        pa = _require_pyarrow()
+        self._pa = pa
+        arrow_types = {"string": pa.string(), "integer": pa.int64(), "number": pa.float64(),
+                       "boolean": pa.bool_(), "json": pa.string()}
+        self._columns = columns
+        self._schema = pa.schema([pa.field(c.name, arrow_types[c.type]) for c in columns])
+        self._batch_rows = max(1, batch_rows)
+        self._values: List[List[Any]] = [[] for _ in columns]
+        self._count = 0
+        self._lock = threading.Lock()
+        self._sink = sink
+        if output_format == "parquet":
+            import pyarrow.parquet as pq
+            self._writer = pq.ParquetWriter(sink, self._schema)
+        else:
+            self._writer = pa.ipc.new_stream(sink, self._schema)
+        self._closed = False
+
+    def write(self, record: Any):
+        row = _row(record, self._columns)
+        with self._lock:
+            for values, value in zip(self._values, row):
+                values.append(value)
+            self._count += 1
+            if self._count >= self._batch_rows:
+                self._flush_locked()
+
+    def close(self):
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._flush_locked()
+            self._writer.close()
+        self._sink.flush()
+
+    def __enter__(self) -> "ArrowBatchWriter":
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _flush_locked(self):
+        if not self._count:
+            return
+        arrays = [self._pa.array(values, type=field.type) for values, field in zip(self._values, self._schema)]
+        self._writer.write_batch(self._pa.record_batch(arrays, schema=self._schema))
+        self._values = [[] for _ in self._columns]
+        self._count = 0
+
+
+def open_sink(
+    output_format: str,
+    schema: dict,
+    stream: Optional[TextIO] = None,
+    flush_interval_ms: int = DEFAULT_FLUSH_INTERVAL_MS,
+    threaded: bool = False,
+    serialize: Callable[[Any], str] = json.dumps
+):
+    """
+    Builds the output stage for ``symparse run --output-format``. Every sink has
+    ``write(record)`` and ``close()``; columnar formats take their column order
+    and types from *schema*.
+    """
+    stream = stream if stream is not None else sys.stdout
+    if output_format not in OUTPUT_FORMATS:
+        raise ValueError(f"Unknown output format: {output_format}")
+    if output_format in ("arrow", "parquet"):
+        return ArrowBatchWriter(stream.buffer, schema_columns(schema), output_format)
+    if output_format in ("csv", "tsv"):
+        delimiter = "," if output_format == "csv" else "\t"
+        columns = schema_columns(schema)
+        serialize = delimited_serializer(columns, delimiter)
+        header = delimited_header(columns, delimiter)
+        return RecordWriter(stream, flush_interval_ms, threaded=threaded, serialize=serialize, header=header)
+    return RecordWriter(stream, flush_interval_ms, threaded=threaded, serialize=serialize)
+
@@ -0,0 +1,412 @@
+"""Record iteration, concurrent AI Path and multi-process execution for the ``symparse run`` loop."""
+
+import logging
+import mmap
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, ThreadPoolExecutor, as_completed, wait
+from dataclasses import dataclass
+from itertools import islice
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from symparse.engine import Engine, EngineFailure, EngineStats, global_stats
+from symparse.utils import estimate_tokens, is_binary_line
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CHUNK_SIZE = 256
+DEFAULT_MAX_BUFFER = 1000
+DEFAULT_BATCH_TOKENS = 2000
+DEFAULT_BATCH_WAIT_MS = 100
+DEFAULT_RANGE_BYTES = 8 * 1024 * 1024
+
+
+@dataclass
+class InputStats:
+    """Counters for the raw input side of a run (reported by ``--stats``)."""
+    total_input_chars: int = 0
+    skipped_binary_lines: int = 0
+
+    def merge(self, other: "InputStats"):
+        self.total_input_chars += other.total_input_chars
+        self.skipped_binary_lines += other.skipped_binary_lines
+
+
+def iter_records(lines: Iterable[str], input_stats: InputStats) -> Iterator[str]:
+    """Yields stripped, non-empty text records, skipping binary/null-byte lines."""
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        if is_binary_line(line):
+            input_stats.skipped_binary_lines += 1
+            logger.warning(
+                f"Skipped binary/null-byte line (line {input_stats.skipped_binary_lines}). "
+                "Pipe text-only input or pre-filter with 'strings' or 'grep -a'."
+            )
+            continue
+        input_stats.total_input_chars += len(line)
+        yield line
+
+
+def file_ranges(path: str, range_bytes: int = DEFAULT_RANGE_BYTES) -> List[Tuple[int, int]]:
+    """
+    Splits *path* into newline-aligned ``(start, end)`` byte ranges of roughly
+    *range_bytes* each. Boundaries are found on a read-only memory map, so only
+    the pages around each cut are touched.
+    """
+    size = os.path.getsize(path)
+    if size == 0:
+        return []
+    ranges = []
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        start = 0
+        while start < size:
+            end = min(start + max(1, range_bytes), size)
+            if end < size:
+                # Extend the cut to just past the next newline (or keep it if it already is)
+                newline = mm.find(b"\n", end - 1)
+                end = size if newline == -1 else newline + 1
+            ranges.append((start, end))
+            start = end
+    return ranges
+
+
+def read_range_lines(path: str, start: int, end: int) -> List[str]:
+    """Decodes one byte range of *path* from a memory map and splits it into lines."""
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        data = mm[start:end]
+    return data.decode("utf-8", errors="replace").split("\n")
+
+
+def iter_file_lines(path: str, range_bytes: int = DEFAULT_RANGE_BYTES) -> Iterator[str]:
+    """Yields the lines of *path* range by range (the in-process ``--input`` reader)."""
+    for start, end in file_ranges(path, range_bytes):
+        yield from read_range_lines(path, start, end)
+
+
+def _chunked(records: Iterable[str], size: int) -> Iterator[List[str]]:
+    it = iter(records)
+    while True:
+        chunk = list(islice(it, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def _completed(result: Dict[str, Any]) -> Future:
+    future = Future()
+    future.set_result(result)
+    return future
+
+
+def _run_batch(engine: Engine, batch: List[Tuple[str, float, Future]]) -> None:
+    """Resolves each record's future from one batched request, retrying failed elements one by one."""
+    try:
+        pending = batch
+        if engine.compile and not engine.force_ai:
+            # An earlier batch may have compiled this format since the record missed
+            pending = []
+            for text, start_time, future in batch:
+                result = engine.try_fast_path(text, start_time)
+                if result is not None:
+                    future.set_result(result)
+                else:
+                    pending.append((text, start_time, future))
+        if not pending:
+            return
+        results = engine.ai_path_batch([text for text, _, _ in pending], pending[0][1])
+        for (text, start_time, future), result in zip(pending, results):
+            if result is None:
+                try:
+                    result = engine.ai_path(text, start_time)
+                except BaseException as e:
+                    future.set_exception(e)
+                    continue
+            future.set_result(result)
+    except BaseException as e:
+        for _, _, future in batch:
+            if not future.done():
+                future.set_exception(e)
+
+
+def run_concurrent(
+    records: Iterable[str],
+    engine: Engine,
+    emit: Callable[[dict], None],
+    ai_concurrency: int,
+    max_buffer: int = DEFAULT_MAX_BUFFER,
+    ai_batch_size: int = 1,
+    ai_batch_tokens: int = DEFAULT_BATCH_TOKENS,
+    ai_batch_wait_ms: float = DEFAULT_BATCH_WAIT_MS
+):
+    """
+    Runs *records* through *engine*, sending AI Path misses to a pool of
+    *ai_concurrency* threads while Fast Path records keep flowing.
+
+    Results pass through a reorder buffer and reach *emit* in input order, as soon
+    as every earlier record is done (LLM completions drain it from their own
+    thread, so output does not wait for the next input line). Once *max_buffer*
+    records are pending the reader blocks on the oldest one. Raises EngineFailure
+    after emitting the records that precede a halting failure.
+
+    With *ai_batch_size* above 1, misses are packed into a single LLM request of
+    up to that many records or *ai_batch_tokens* estimated input tokens. A
+    partial batch is sent at end of input, when the reader would otherwise
+    block on it, or once its oldest record has waited *ai_batch_wait_ms*, so a
+    quiet stream (``tail -f``) does not hold a miss back until the next line.
+    """
+    buffer: deque = deque()
+    lock = threading.Lock()
+    max_buffer = max(1, max_buffer)
+    batch: List[Tuple[str, float, Future]] = []
+    batch_tokens = 0
+    # The batch is also flushed from the deadline timer's thread
+    batch_lock = threading.Lock()
+    batch_timer: Optional[threading.Timer] = None
+
+    def _drain(_future=None) -> None:
+        with lock:
+            while buffer and buffer[0].done():
+                if buffer[0].exception() is not None:
+                    # Left at the head; the reader thread re-raises it
+                    return
+                emit(buffer.popleft().result())
+
+    def _check_failure() -> None:
+        with lock:
+            head = buffer[0] if buffer else None
+        if head is not None and head.done() and head.exception() is not None:
+            raise head.exception()
+
+    def _flush_batch_locked() -> None:
+        nonlocal batch, batch_tokens, batch_timer
+        if batch_timer is not None:
+            batch_timer.cancel()
+            batch_timer = None
+        if batch:
+            pool.submit(_run_batch, engine, batch)
+            batch, batch_tokens = [], 0
+
+    def _flush_batch() -> None:
+        with batch_lock:
+            _flush_batch_locked()
+
+    def _add_to_batch(text: str, start_time: float, future: Future) -> None:
+        nonlocal batch_tokens, batch_timer
+        tokens = estimate_tokens(text)
+        with batch_lock:
+            if batch and batch_tokens + tokens > ai_batch_tokens:
+                _flush_batch_locked()
+            batch.append((text, start_time, future))
+            batch_tokens += tokens
+            if len(batch) >= ai_batch_size:
+                _flush_batch_locked()
+            elif batch_timer is None:
+                batch_timer = threading.Timer(max(0.0, ai_batch_wait_ms) / 1000, _flush_batch)
+                batch_timer.daemon = True
+                batch_timer.start()
+
+    def _wait_head() -> None:
+        _flush_batch()
+        # Completion callbacks pop the head concurrently; it may already be gone
+        with lock:
+            head = buffer[0] if buffer else None
+        if head is None:
+            return
+        wait([head])
+        _drain()
+        _check_failure()
+
+    pool = ThreadPoolExecutor(max_workers=max(1, ai_concurrency), thread_name_prefix="symparse-ai")
+    try:
+        for record in records:
+            text = engine.prepare(record)
+            start_time = time.perf_counter()
+            result = engine.try_fast_path(text, start_time)
+            if result is not None:
+                future = _completed(result)
+            elif ai_batch_size > 1:
+                future = Future()
+                _add_to_batch(text, start_time, future)
+            else:
+                future = pool.submit(engine.ai_path, text, start_time)
+            with lock:
+                buffer.append(future)
+            future.add_done_callback(_drain)
+            _check_failure()
+
+            while len(buffer) >= max_buffer:
+                _wait_head()
+
+        while buffer:
+            _wait_head()
+    except BaseException:
+        with batch_lock:
+            if batch_timer is not None:
+                batch_timer.cancel()
+        pool.shutdown(wait=False, cancel_futures=True)
+        raise
+    pool.shutdown()
+
+
+# --- Worker process side ---
+
+_worker_engine: Optional[Engine] = None
+_worker_concurrency: Dict[str, Any] = {}
+
+
+def _init_worker(engine_kwargs: Dict[str, Any], concurrency: Optional[Dict[str, Any]] = None):
+    """Builds the worker's long-lived Engine so its extractor and validator state stays warm."""
+    global _worker_engine, _worker_concurrency
+    _worker_engine = Engine(**engine_kwargs)
+    _worker_concurrency = concurrency or {}
+    # Pool workers skip atexit handlers; commit the buffered hit counts when the worker shuts down
+    from multiprocessing.util import Finalize
+    Finalize(_worker_engine.cache_manager, _worker_engine.cache_manager.flush_usage, exitpriority=10)
+
+
+def _process_chunk(chunk: List[str]) -> Tuple[List[dict], EngineStats, Optional[str], Optional[InputStats]]:
+    """
+    Processes one chunk in a worker. Returns the results, the stats accrued for
+    this chunk, the failure message if the engine halted (results then hold the
+    records completed before the failure) and the input counters, which are None
+    here because the parent already counted the chunk's records.
+    """
+    engine = _worker_engine
+    engine.stats = EngineStats()
+    engine.prefetch(chunk)
+    results = []
+    try:
+        if _worker_concurrency:
+            run_concurrent(chunk, engine, results.append, max_buffer=len(chunk), **_worker_concurrency)
+        else:
+            for record in chunk:
+                results.append(engine.process(record))
+    except EngineFailure as e:
+        return results, engine.stats, str(e), None
+    return results, engine.stats, None, None
+
+
+def _process_range(path: str, start: int, end: int) -> Tuple[List[dict], EngineStats, Optional[str], Optional[InputStats]]:
+    """Reads and processes one newline-aligned byte range of an input file in a worker."""
+    input_stats = InputStats()
+    records = list(iter_records(read_range_lines(path, start, end), input_stats))
+    results, stats, failure, _ = _process_chunk(records)
+    return results, stats, failure, input_stats
+
+
+# --- Parent process side ---
+
+def _run_pool(
+    tasks: Iterable[Tuple[Callable, tuple]],
+    engine_kwargs: Dict[str, Any],
+    emit: Callable[[dict], None],
+    workers: int,
+    ordered: bool,
+    stats: Optional[EngineStats],
+    concurrency: Optional[Dict[str, Any]],
+    input_stats: Optional[InputStats] = None
+):
+    """Runs worker *tasks* on a process pool, emitting each task's results in order (or as they finish)."""
+    stats = stats if stats is not None else global_stats
+    window = max(1, workers * 4)
+
+    def _collect(future) -> None:
+        results, task_stats, failure, task_input_stats = future.result()
+        stats.merge(task_stats)
+        if input_stats is not None and task_input_stats is not None:
+            input_stats.merge(task_input_stats)
+        for result in results:
+            emit(result)
+        if failure is not None:
+            raise EngineFailure(failure)
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(engine_kwargs, concurrency)) as pool:
+        try:
+            if ordered:
+                pending = deque()
+                for fn, args in tasks:
+                    pending.append(pool.submit(fn, *args))
+                    if len(pending) >= window:
+                        _collect(pending.popleft())
+                while pending:
+                    _collect(pending.popleft())
+            else:
+                pending = set()
+                for fn, args in tasks:
+                    pending.add(pool.submit(fn, *args))
+                    if len(pending) >= window:
+                        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                        for future in done:
+                            _collect(future)
+                for future in as_completed(pending):
+                    _collect(future)
+        except BaseException:
+            pool.shutdown(wait=False, cancel_futures=True)
+            raise
+
+
+def _concurrency_options(ai_concurrency: int, ai_batch_size: int, ai_batch_tokens: int,
+                         ai_batch_wait_ms: float) -> Optional[Dict[str, Any]]:
+    if ai_concurrency > 0 or ai_batch_size > 1:
+        return dict(ai_concurrency=max(1, ai_concurrency), ai_batch_size=ai_batch_size,
+                    ai_batch_tokens=ai_batch_tokens, ai_batch_wait_ms=ai_batch_wait_ms)
+    return None
+
+
+def run_parallel(
+    records: Iterable[str],
+    engine_kwargs: Dict[str, Any],
+    emit: Callable[[dict], None],
+    workers: int,
+    ordered: bool = True,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    stats: Optional[EngineStats] = None,
+    ai_concurrency: int = 0,
+    ai_batch_size: int = 1,
+    ai_batch_tokens: int = DEFAULT_BATCH_TOKENS,
+    ai_batch_wait_ms: float = DEFAULT_BATCH_WAIT_MS
+):
+    """
+    Fans *records* out to *workers* processes in chunks and passes every result to
+    *emit*. With *ordered* results keep input order; otherwise chunks are emitted
+    as soon as they finish. Worker stats are merged into *stats* (the process-wide
+    ``global_stats`` by default). Raises EngineFailure after emitting the records
+    completed before a halting failure.
+
+    At most ``workers * 4`` chunks are in flight, so memory stays bounded on
+    arbitrarily long inputs. A positive *ai_concurrency* or an *ai_batch_size*
+    above 1 runs each chunk through :func:`run_concurrent` inside its worker.
+    """
+    tasks = ((_process_chunk, (chunk,)) for chunk in _chunked(records, chunk_size))
+    _run_pool(tasks, engine_kwargs, emit, workers, ordered, stats,
+              _concurrency_options(ai_concurrency, ai_batch_size, ai_batch_tokens, ai_batch_wait_ms))
+
+
+def run_file_parallel(
+    path: str,
+    engine_kwargs: Dict[str, Any],
+    emit: Callable[[dict], None],
+    workers: int,
+    ordered: bool = True,
+    range_bytes: int = DEFAULT_RANGE_BYTES,
+    stats: Optional[EngineStats] = None,
+    input_stats: Optional[InputStats] = None,
+    ai_concurrency: int = 0,
+    ai_batch_size: int = 1,
+    ai_batch_tokens: int = DEFAULT_BATCH_TOKENS,
+    ai_batch_wait_ms: float = DEFAULT_BATCH_WAIT_MS
+):
+    """
+    Like :func:`run_parallel`, but for a file on disk: the file is split into
+    newline-aligned byte ranges (see :func:`file_ranges`) and each worker maps,
+    decodes and processes its own range, so the parent never reads the data.
+    Results are merged back in file order unless *ordered* is False. Per-range
+    input counters are merged into *input_stats*.
+    """
+    tasks = ((_process_range, (path, start, end)) for start, end in file_ranges(path, range_bytes))
+    _run_pool(tasks, engine_kwargs, emit, workers, ordered, stats,
+              _concurrency_options(ai_concurrency, ai_batch_size, ai_batch_tokens, ai_batch_wait_ms), input_stats)
@@ -0,0 +1,61 @@
+import sys
+import threading
+from contextlib import contextmanager
+from typing import Iterator
+
+@contextmanager
+def profile_run(path: str, profiler: str = "cprofile") -> Iterator[None]:
+    """
+    Profiles the enclosed block and writes the result to *path*, even when
+    the block raises or exits.
+
+    ``cprofile`` writes a pstats file (``python -m pstats PATH``, snakeviz, ...)
+    covering the calling thread and every thread started inside the block (the
+    ``--ai-concurrency`` pool), merged into one profile. ``sampling`` uses
+    pyinstrument, whose overhead does not grow with the call count, and saves a
+    session file (``pyinstrument --load PATH``); it samples the calling thread
+    only. Neither profiles ``--workers`` processes.
+    """
+    if profiler == "sampling":
+        try:
+            from pyinstrument import Profiler
+        except ImportError:
+            raise ImportError("Sampling profiles require pyinstrument. Install it with `pip install pyinstrument`.")
+        sampler = Profiler()
+        sampler.start()
+        try:
+            yield
+        finally:
+            session = sampler.stop()
+            session.save(path)
+            print(f"Profile written to {path} (view with `pyinstrument --load {path}`)", file=sys.stderr)
+        return
+
+    import cProfile
+    import pstats
+    thread_tracers = []
+
+    def _profile_thread(frame, event, arg):
+        # First event of a thread started in the block: hand it its own profiler
+        sys.setprofile(None)
+        thread_tracer = cProfile.Profile()
+        try:
+            thread_tracer.enable()
+        except ValueError:
+            # Python 3.12+ allows one active profiler, which already sees every thread
+            return
+        thread_tracers.append(thread_tracer)
+
+    tracer = cProfile.Profile()
+    threading.setprofile(_profile_thread)
+    tracer.enable()
+    try:
+        yield
+    finally:
+        tracer.disable()
+        threading.setprofile(None)
+        merged = pstats.Stats(tracer)
+        for thread_tracer in list(thread_tracers):
+            merged.add(thread_tracer)
+        merged.dump_stats(path)
+        print(f"Profile written to {path} (view with `python -m pstats {path}`)", file=sys.stderr)
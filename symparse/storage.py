@@ -0,0 +1,562 @@
+"""
+Storage backends behind :class:`symparse.cache_manager.CacheManager`.
+
+``json`` is the original layout: one ``metadata.json`` index rewritten under an
+exclusive portalocker lock plus one ``.py`` file per script. ``sqlite`` keeps
+the same entries in a WAL-mode database (``cache.sqlite3``) with one row per
+schema, archetype and script, so a save or purge is a transactional upsert or
+delete of the rows it touches, readers never block writers, and the cost of a
+write does not grow with the number of cached schemas.
+
+Both stores hand out plain entry dicts (``{"archetypes": {...}, ...}``) and are
+edited through :meth:`transaction`, a read-modify-write over any number of
+schemas committed by a single store write. Auxiliary files (vector matrices)
+always live next to the store in the cache directory.
+"""
+
+import copy
+import logging
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+import portalocker
+
+from symparse import codec
+
+logger = logging.getLogger(__name__)
+
+CACHE_BACKENDS = ("json", "sqlite")
+METADATA_FILE = "metadata.json"
+SQLITE_FILE = "cache.sqlite3"
+
+# Entry upgrade hook: (schema_hash, stored entry) -> entry in the archetype layout
+Upgrade = Callable[[str, dict], dict]
+
+# Temp files younger than this may belong to a writer that is still committing
+_ORPHAN_TMP_AGE_S = 60.0
+
+
+def resolve_backend(cache_dir: Path, backend: Optional[str] = None) -> str:
+    """
+    Picks the backend for *cache_dir*: the explicit *backend*, else
+    ``SYMPARSE_CACHE_BACKEND``, else ``sqlite`` if the directory already holds a
+    database and ``json`` otherwise.
+    """
+    backend = backend or os.getenv("SYMPARSE_CACHE_BACKEND")
+    if not backend:
+        backend = "sqlite" if (Path(cache_dir) / SQLITE_FILE).exists() else "json"
+    backend = backend.lower()
+    if backend not in CACHE_BACKENDS:
+        raise ValueError(f"Unknown cache backend: {backend} (expected one of {', '.join(CACHE_BACKENDS)})")
+    return backend
+
+
+def open_store(cache_dir: Path, backend: Optional[str] = None, upgrade: Optional[Upgrade] = None):
+    """Opens the cache store for *cache_dir* (see :func:`resolve_backend`)."""
+    if resolve_backend(cache_dir, backend) == "sqlite":
+        return SqliteStore(cache_dir, upgrade)
+    return JsonStore(cache_dir, upgrade)
+
+
+def _unlink_locked(path: Path):
+    """Removes a cache file under an exclusive lock; missing files are ignored."""
+    try:
+        with open(path, "a") as f:
+            portalocker.lock(f, portalocker.LOCK_EX)
+            os.unlink(path)
+            # Note: unlinking does not intrinsically close/unlock the descriptor on all OSs,
+            # but portalocker context handles closure implicitly, or the file handle garbage collection does.
+    except FileNotFoundError:
+        pass
+
+
+def _no_upgrade(schema_hash: str, entry: dict) -> dict:
+    return entry
+
+
+def _referenced_files(schemas: Dict[str, dict]) -> Set[str]:
+    """Script and vector file names the index points at."""
+    names = set()
+    for entry in schemas.values():
+        if entry.get("vector_file"):
+            names.add(entry["vector_file"])
+        names.update(info["script"] for info in entry["archetypes"].values() if info.get("script"))
+    return names
+
+
+def _remove_orphan_files(cache_dir: Path, referenced: Set[str]) -> List[str]:
+    """Unlinks script, vector and stale temp files in *cache_dir* that the index does not reference."""
+    removed = []
+    now = time.time()
+    for p in cache_dir.iterdir():
+        if not p.is_file() or p.name in referenced:
+            continue
+        if p.name.startswith(".") and p.name.endswith(".tmp"):
+            try:
+                if now - p.stat().st_mtime < _ORPHAN_TMP_AGE_S:
+                    continue
+            except FileNotFoundError:
+                continue
+        elif p.suffix not in (".py", ".npy"):
+            continue
+        _unlink_locked(p)
+        removed.append(p.name)
+    return sorted(removed)
+
+
+class CacheEdit:
+    """
+    Pending changes to one schema inside a store transaction. ``entry`` is a
+    private copy that may be mutated freely; a schema left without archetypes
+    is removed. Scripts are written and dropped together with the entry.
+    """
+
+    def __init__(self, entry: dict):
+        self.entry = entry
+        self.scripts: Dict[str, str] = {}
+        self.dropped: Set[str] = set()
+
+    def put_script(self, name: str, source: str):
+        self.scripts[name] = source
+        self.dropped.discard(name)
+
+    def drop_script(self, name: str):
+        if name:
+            self.dropped.add(name)
+            self.scripts.pop(name, None)
+
+
+class CacheTransaction:
+    """Edits to any number of schemas, committed together when the transaction ends."""
+
+    def __init__(self, load: Callable[[str], Optional[dict]], list_hashes: Callable[[], Iterable[str]]):
+        self._load = load
+        self._list_hashes = list_hashes
+        # schema_hash -> (entry before the transaction or None, pending edit)
+        self.edits: Dict[str, Tuple[Optional[dict], CacheEdit]] = {}
+
+    def schema_hashes(self) -> List[str]:
+        """Every schema in the store, plus any created by this transaction."""
+        hashes = list(self._list_hashes())
+        return hashes + [h for h in self.edits if h not in set(hashes)]
+
+    def edit(self, schema_hash: str) -> CacheEdit:
+        """The pending edit of *schema_hash*, created from the committed entry on first use."""
+        if schema_hash not in self.edits:
+            before = self._load(schema_hash)
+            entry = copy.deepcopy(before) if before is not None else {"archetypes": {}}
+            self.edits[schema_hash] = (before, CacheEdit(entry))
+        return self.edits[schema_hash][1]
+
+
+class JsonStore:
+    """
+    metadata.json plus loose script files. Every file is replaced atomically
+    (temp file + ``os.replace``), so readers take no locks and never see a
+    partial write; writers serialize on an exclusive lock of metadata.json.
+    """
+
+    name = "json"
+
+    def __init__(self, cache_dir: Path, upgrade: Optional[Upgrade] = None):
+        self.cache_dir = Path(cache_dir)
+        self._upgrade = upgrade or _no_upgrade
+        self._meta_file = self.cache_dir / METADATA_FILE
+        # Parsed metadata.json for the last stamp seen
+        self._meta: dict = {"schemas": {}}
+        self._meta_stamp: Optional[tuple] = None
+        self._init_metadata()
+
+    def _init_metadata(self):
+        """Ensure the global metadata file exists safely."""
+        # Touch metadata file if it doesn't exist to allow read-locking later
+        if not self._meta_file.exists():
+            with open(self._meta_file, "a") as f:
+                portalocker.lock(f, portalocker.LOCK_EX)
+                if os.path.getsize(self._meta_file) == 0:
+                    f.write(codec.dumps_compact({"schemas": {}}))
+                portalocker.unlock(f)
+
+    def stamp(self) -> Optional[tuple]:
+        """Cheap change detector for metadata.json: (mtime_ns, size, inode), or None if missing."""
+        try:
+            st = os.stat(self._meta_file)
+        except FileNotFoundError:
+            return None
+        return (st.st_mtime_ns, st.st_size, st.st_ino)
+
+    def _parse(self, content: str) -> dict:
+        """Parses metadata.json, upgrading every entry to the archetype layout."""
+        meta = codec.loads(content) if content else {"schemas": {}}
+        meta.setdefault("schemas", {})
+        for schema_hash, entry in meta["schemas"].items():
+            meta["schemas"][schema_hash] = self._upgrade(schema_hash, entry)
+        return meta
+
+    def _snapshot(self) -> dict:
+        stamp = self.stamp()
+        if stamp is not None and stamp == self._meta_stamp:
+            return self._meta
+        try:
+            # Writers replace the file whole, so an unlocked read sees one complete revision
+            with open(self._meta_file, "r") as f:
+                content = f.read()
+        except FileNotFoundError:
+            content = ""
+        self._meta = self._parse(content)
+        self._meta_stamp = stamp
+        return self._meta
+
+    def load_entry(self, schema_hash: str) -> Optional[dict]:
+        return self._snapshot()["schemas"].get(schema_hash)
+
+    def load_all(self) -> dict:
+        return self._snapshot()["schemas"]
+
+    def read_script(self, name: str) -> Optional[str]:
+        try:
+            with open(self.cache_dir / name, "r") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def _replace_file(self, name: str, content: str, sync: bool = False):
+        """Writes *content* to a temp file in the cache directory and renames it over *name*."""
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, prefix=f".{name}.", suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w") as f:
+                f.write(content)
+                if sync:
+                    f.flush()
+                    os.fsync(f.fileno())
+            os.replace(tmp_path, self.cache_dir / name)
+        except BaseException:
+            try:
+                os.unlink(tmp_path)
+            except FileNotFoundError:
+                pass
+            raise
+
+    def _lock_metadata(self):
+        """
+        Opens metadata.json under an exclusive lock. Writers replace the file, so
+        the lock is only valid if it is still held on the current inode; a writer
+        that raced a replacement retries on the new file.
+        """
+        while True:
+            self._init_metadata()
+            f = open(self._meta_file, "r")
+            portalocker.lock(f, portalocker.LOCK_EX)
+            try:
+                if os.fstat(f.fileno()).st_ino == os.stat(self._meta_file).st_ino:
+                    return f
+            except FileNotFoundError:
+                pass
+            portalocker.unlock(f)
+            f.close()
+
+    @contextmanager
+    def transaction(self) -> Iterator[CacheTransaction]:
+        """
+        Read-modify-write under the exclusive metadata lock, committed as one
+        metadata.json replacement. Scripts are renamed into place before the
+        index that points at them and unlinked after it no longer does. The
+        fsync of the new index is the only sync: a script lost in a crash no
+        longer matches its recorded digest and is treated as a cache miss.
+        """
+        f = self._lock_metadata()
+        try:
+            meta = self._parse(f.read())
+            txn = CacheTransaction(meta["schemas"].get, lambda: list(meta["schemas"]))
+            yield txn
+
+            changed = False
+            dropped = set()
+            for schema_hash, (before, edit) in txn.edits.items():
+                for name, source in edit.scripts.items():
+                    self._replace_file(name, source)
+                dropped |= edit.dropped
+                if edit.entry["archetypes"]:
+                    changed |= edit.entry != before
+                    meta["schemas"][schema_hash] = edit.entry
+                else:
+                    changed |= meta["schemas"].pop(schema_hash, None) is not None
+                # Rewritten scripts also move the stamp so readers drop cached sources
+                changed |= bool(edit.scripts)
+            if changed:
+                self._replace_file(METADATA_FILE, codec.dumps_compact(meta), sync=True)
+        finally:
+            portalocker.unlock(f)
+            f.close()
+        for name in dropped:
+            _unlink_locked(self.cache_dir / name)
+
+    def remove_file(self, name: str):
+        _unlink_locked(self.cache_dir / name)
+
+    def remove_orphans(self) -> List[str]:
+        """Removes files the index does not reference, under the writer lock so no commit is in flight."""
+        f = self._lock_metadata()
+        try:
+            referenced = _referenced_files(self._parse(f.read())["schemas"])
+            return _remove_orphan_files(self.cache_dir, referenced | {METADATA_FILE})
+        finally:
+            portalocker.unlock(f)
+            f.close()
+
+    def clear(self):
+        """Wipes the cache directory and recreates an empty metadata.json."""
+        for p in self.cache_dir.glob("*"):
+            if p.is_file():
+                # Acquire exclusive lock on the file before unlinking to prevent racing
+                _unlink_locked(p)
+        self._init_metadata()
+
+
+_SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS schemas (
+    schema_hash TEXT PRIMARY KEY,
+    data TEXT NOT NULL
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS archetypes (
+    schema_hash TEXT NOT NULL,
+    archetype_id TEXT NOT NULL,
+    data TEXT NOT NULL,
+    PRIMARY KEY (schema_hash, archetype_id)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS scripts (
+    name TEXT PRIMARY KEY,
+    source TEXT NOT NULL
+) WITHOUT ROWID;
+"""
+_SQLITE_VERSION = 1
+
+
+class SqliteStore:
+    """
+    Cache entries and scripts in a WAL-mode SQLite database. Lookups are
+    primary-key reads by schema hash (and archetype id); every edit is one
+    ``BEGIN IMMEDIATE`` transaction that upserts or deletes only the changed
+    rows. ``PRAGMA data_version`` tells readers when another connection committed.
+    """
+
+    name = "sqlite"
+
+    def __init__(self, cache_dir: Path, upgrade: Optional[Upgrade] = None):
+        self.cache_dir = Path(cache_dir)
+        self.path = self.cache_dir / SQLITE_FILE
+        self._upgrade = upgrade or _no_upgrade
+        self._pid = None
+        # Reads (including the per-lookup data_version probe) and edits use
+        # separate connections so local commits register as changes too
+        self._read_lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._reader: Optional[sqlite3.Connection] = None
+        self._writer: Optional[sqlite3.Connection] = None
+        self._initialize()
+
+    def _open(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(str(self.path), timeout=30.0, isolation_level=None, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        # With WAL, NORMAL syncs at checkpoints: a crash never corrupts the database
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def _connections(self):
+        # Connections are never shared across a fork; worker processes open their own
+        if self._pid != os.getpid():
+            self._reader, self._writer = self._open(), self._open()
+            self._pid = os.getpid()
+        return self._reader, self._writer
+
+    def _initialize(self):
+        """Creates the tables, importing an existing metadata.json cache on first use."""
+        _, conn = self._connections()
+        with self._write_lock:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                if conn.execute("PRAGMA user_version").fetchone()[0] < _SQLITE_VERSION:
+                    # executescript() would commit first, so the DDL runs statement by statement
+                    for statement in filter(str.strip, _SQLITE_SCHEMA.split(";")):
+                        conn.execute(statement)
+                    self._import_json(conn)
+                    conn.execute(f"PRAGMA user_version={_SQLITE_VERSION}")
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+        os.chmod(self.path, 0o600)
+
+    def _import_json(self, conn: sqlite3.Connection):
+        if not (self.cache_dir / METADATA_FILE).exists():
+            return
+        legacy = JsonStore(self.cache_dir, self._upgrade)
+        schemas = legacy.load_all()
+        for schema_hash, entry in schemas.items():
+            self._apply(conn, schema_hash, None, self._import_edit(legacy, entry))
+        if schemas:
+            logger.info(f"Imported {len(schemas)} cached schemas from {METADATA_FILE} into {SQLITE_FILE}.")
+
+    @staticmethod
+    def _import_edit(legacy: JsonStore, entry: dict) -> CacheEdit:
+        edit = CacheEdit(entry)
+        for info in entry["archetypes"].values():
+            name = info.get("script")
+            source = legacy.read_script(name) if name else None
+            if source is not None:
+                edit.put_script(name, source)
+        return edit
+
+    def stamp(self) -> Optional[int]:
+        reader, _ = self._connections()
+        with self._read_lock:
+            return reader.execute("PRAGMA data_version").fetchone()[0]
+
+    @staticmethod
+    def _select_entry(conn: sqlite3.Connection, schema_hash: str) -> Optional[dict]:
+        row = conn.execute("SELECT data FROM schemas WHERE schema_hash = ?", (schema_hash,)).fetchone()
+        if row is None:
+            return None
+        entry = codec.loads(row[0])
+        entry["archetypes"] = {
+            archetype_id: codec.loads(data)
+            for archetype_id, data in conn.execute(
+                "SELECT archetype_id, data FROM archetypes WHERE schema_hash = ?", (schema_hash,)
+            )
+        }
+        return entry
+
+    def load_entry(self, schema_hash: str) -> Optional[dict]:
+        reader, _ = self._connections()
+        with self._read_lock:
+            reader.execute("BEGIN")
+            try:
+                entry = self._select_entry(reader, schema_hash)
+            finally:
+                reader.execute("COMMIT")
+        return self._upgrade(schema_hash, entry) if entry is not None else None
+
+    def load_all(self) -> dict:
+        reader, _ = self._connections()
+        with self._read_lock:
+            reader.execute("BEGIN")
+            try:
+                schemas = {h: codec.loads(data) for h, data in reader.execute("SELECT schema_hash, data FROM schemas")}
+                for entry in schemas.values():
+                    entry["archetypes"] = {}
+                for schema_hash, archetype_id, data in reader.execute("SELECT schema_hash, archetype_id, data FROM archetypes"):
+                    if schema_hash in schemas:
+                        schemas[schema_hash]["archetypes"][archetype_id] = codec.loads(data)
+            finally:
+                reader.execute("COMMIT")
+        return {h: self._upgrade(h, entry) for h, entry in schemas.items()}
+
+    def read_script(self, name: str) -> Optional[str]:
+        reader, _ = self._connections()
+        with self._read_lock:
+            row = reader.execute("SELECT source FROM scripts WHERE name = ?", (name,)).fetchone()
+        return row[0] if row else None
+
+    @staticmethod
+    def _apply(conn: sqlite3.Connection, schema_hash: str, before: Optional[dict], edit: CacheEdit):
+        """Writes the rows *edit* changed relative to *before* (None for a new schema)."""
+        old = before["archetypes"] if before is not None else {}
+        new = edit.entry["archetypes"]
+        for name, source in edit.scripts.items():
+            conn.execute("INSERT OR REPLACE INTO scripts (name, source) VALUES (?, ?)", (name, source))
+        for name in edit.dropped:
+            conn.execute("DELETE FROM scripts WHERE name = ?", (name,))
+
+        if not new:
+            conn.execute("DELETE FROM archetypes WHERE schema_hash = ?", (schema_hash,))
+            conn.execute("DELETE FROM schemas WHERE schema_hash = ?", (schema_hash,))
+            return
+        for archetype_id in old.keys() - new.keys():
+            conn.execute("DELETE FROM archetypes WHERE schema_hash = ? AND archetype_id = ?", (schema_hash, archetype_id))
+        for archetype_id, info in new.items():
+            if old.get(archetype_id) != info:
+                conn.execute(
+                    "INSERT OR REPLACE INTO archetypes (schema_hash, archetype_id, data) VALUES (?, ?, ?)",
+                    (schema_hash, archetype_id, codec.dumps_compact(info))
+                )
+        fields = {k: v for k, v in edit.entry.items() if k != "archetypes"}
+        if before is None or fields != {k: v for k, v in before.items() if k != "archetypes"}:
+            conn.execute(
+                "INSERT OR REPLACE INTO schemas (schema_hash, data) VALUES (?, ?)",
+                (schema_hash, codec.dumps_compact(fields))
+            )
+
+    @contextmanager
+    def transaction(self) -> Iterator[CacheTransaction]:
+        """Read-modify-write of any number of schemas in a single write transaction."""
+        _, conn = self._connections()
+
+        def load(schema_hash: str) -> Optional[dict]:
+            entry = self._select_entry(conn, schema_hash)
+            return self._upgrade(schema_hash, entry) if entry is not None else None
+
+        with self._write_lock:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                txn = CacheTransaction(load, lambda: [row[0] for row in conn.execute("SELECT schema_hash FROM schemas")])
+                yield txn
+                for schema_hash, (before, edit) in txn.edits.items():
+                    self._apply(conn, schema_hash, before, edit)
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+
+    def remove_file(self, name: str):
+        _unlink_locked(self.cache_dir / name)
+
+    def remove_orphans(self) -> List[str]:
+        """
+        Deletes script rows and files the index does not reference, then
+        reclaims the freed pages and truncates the write-ahead log.
+        """
+        _, conn = self._connections()
+        with self._write_lock:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                schemas = {}
+                for (schema_hash,) in conn.execute("SELECT schema_hash FROM schemas").fetchall():
+                    schemas[schema_hash] = self._upgrade(schema_hash, self._select_entry(conn, schema_hash))
+                referenced = _referenced_files(schemas)
+                orphans = [name for (name,) in conn.execute("SELECT name FROM scripts") if name not in referenced]
+                for name in orphans:
+                    conn.execute("DELETE FROM scripts WHERE name = ?", (name,))
+                # Scripts live in the database, so loose .py files (e.g. left by a JSON import) are orphans too
+                vector_files = {entry["vector_file"] for entry in schemas.values() if entry.get("vector_file")}
+                removed = _remove_orphan_files(
+                    self.cache_dir, vector_files | {SQLITE_FILE, SQLITE_FILE + "-wal", SQLITE_FILE + "-shm"}
+                )
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            conn.execute("VACUUM")
+            conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        return sorted(orphans + removed)
+
+    def clear(self):
+        """Deletes every row and every auxiliary file, keeping the database itself."""
+        _, conn = self._connections()
+        with self._write_lock:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                for table in ("scripts", "archetypes", "schemas"):
+                    conn.execute(f"DELETE FROM {table}")
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+        own = {SQLITE_FILE, SQLITE_FILE + "-wal", SQLITE_FILE + "-shm"}
+        for p in self.cache_dir.glob("*"):
+            if p.is_file() and p.name not in own:
+                _unlink_locked(p)
@@ -1,21 +1,219 @@
+import json
+import logging
+import threading
+from itertools import count
+from typing import Any, Callable, Dict, Optional, Tuple
+
 import jsonschema
 
+logger = logging.getLogger(__name__)
+
+VALIDATOR_BACKENDS = ("jsonschema", "codegen")
+
 class SchemaViolationError(Exception):
     """Raised when the parsed JSON data does not conform to the schema."""
-    
+
     def __init__(self, message: str, path: str = ""):
         self.message = message
         self.path = path
         super().__init__(f"Schema violation at '{path}': {message}" if path else f"Schema violation: {message}")
 
-def enforce_schema(data: dict, schema: dict) -> bool:
+
+class UnsupportedSchemaError(Exception):
+    """Raised when a schema uses keywords outside the code-generated validator subset."""
+    pass
+
+
+# Compiled validators keyed by (backend, schema key). Building a jsonschema
+# validator re-checks the schema against the metaschema, so it is done once.
+_validator_cache: Dict[Tuple[str, str], Callable[[Any], bool]] = {}
+_cache_lock = threading.Lock()
+
+# Keywords the code generator understands. Annotation-only keywords are
+# accepted and ignored, exactly as jsonschema does without a format checker.
+_ANNOTATION_KEYWORDS = frozenset({
+    "$schema", "$id", "$comment", "title", "description", "default", "examples", "format"
+})
+_CODEGEN_KEYWORDS = frozenset({"type", "properties", "required", "items", "enum"}) | _ANNOTATION_KEYWORDS
+
+# Type checks mirroring the TypeChecker of jsonschema's current drafts
+_TYPE_CHECKS = {
+    "object": "isinstance({v}, dict)",
+    "array": "isinstance({v}, list)",
+    "string": "isinstance({v}, str)",
+    "integer": "((isinstance({v}, int) and not isinstance({v}, bool)) or (isinstance({v}, float) and {v}.is_integer()))",
+    "number": "(isinstance({v}, (int, float)) and not isinstance({v}, bool))",
+    "boolean": "isinstance({v}, bool)",
+    "null": "{v} is None",
+}
+# Draft 3 and 4 do not count integral floats such as 1.0 as integers
+_STRICT_INTEGER_CHECK = "(isinstance({v}, int) and not isinstance({v}, bool))"
+
+
+def _type_checks_for(schema: dict) -> Dict[str, str]:
+    """The type checks of the draft *schema* declares (via ``$schema``, like jsonschema)."""
+    cls = jsonschema.validators.validator_for(schema)
+    if cls is jsonschema.Draft3Validator:
+        # Per-property boolean `required`, `any` types, schemas inside `type`, ...
+        raise UnsupportedSchemaError("Draft 3 schemas are not supported")
+    if cls.TYPE_CHECKER.is_type(1.0, "integer"):
+        return _TYPE_CHECKS
+    return dict(_TYPE_CHECKS, integer=_STRICT_INTEGER_CHECK)
+
+
+def _schema_key(schema: dict) -> str:
+    return json.dumps(schema, sort_keys=True)
+
+
+def _build_jsonschema_validator(schema: dict) -> Callable[[Any], bool]:
+    """Compiles a reusable jsonschema validator raising SchemaViolationError."""
+    cls = jsonschema.validators.validator_for(schema)
+    cls.check_schema(schema)
+    validator = cls(schema)
+
+    def check(data: Any) -> bool:
+        # Same error selection as jsonschema.validate()
+        error = jsonschema.exceptions.best_match(validator.iter_errors(data))
+        if error is not None:
+            path = ".".join(str(p) for p in error.path) if error.path else ""
+            raise SchemaViolationError(error.message, path)
+        return True
+
+    return check
+
+
+def _emit_checks(schema: Any, var: str, lines: list, depth: int, names, type_checks: Dict[str, str] = _TYPE_CHECKS) -> None:
+    """Appends Python statements that `return False` when *var* violates *schema*."""
+    pad = "    " * depth
+    if schema is True:
+        return
+    if schema is False:
+        lines.append(f"{pad}return False")
+        return
+    if not isinstance(schema, dict):
+        raise UnsupportedSchemaError(f"Unsupported subschema: {schema!r}")
+
+    unsupported = set(schema) - _CODEGEN_KEYWORDS
+    if unsupported:
+        raise UnsupportedSchemaError(f"Unsupported keywords: {sorted(unsupported)}")
+
+    types = schema.get("type")
+    if types is not None:
+        types = [types] if isinstance(types, str) else list(types)
+        if any(t not in type_checks for t in types):
+            raise UnsupportedSchemaError(f"Unsupported type: {types!r}")
+        cond = " or ".join(type_checks[t].format(v=var) for t in types)
+        lines.append(f"{pad}if not ({cond}):")
+        lines.append(f"{pad}    return False")
+
+    if "enum" in schema:
+        # jsonschema distinguishes 1 from True; `in` does not, so only plain strings are compiled
+        enum = schema["enum"]
+        if not isinstance(enum, list) or not all(isinstance(e, str) for e in enum):
+            raise UnsupportedSchemaError("Only string enums are supported")
+        lines.append(f"{pad}if not (isinstance({var}, str) and {var} in {tuple(enum)!r}):")
+        lines.append(f"{pad}    return False")
+
+    required = schema.get("required", [])
+    if not isinstance(required, list) or not all(isinstance(name, str) for name in required):
+        raise UnsupportedSchemaError(f"Unsupported `required`: {required!r}")
+    properties = schema.get("properties", {})
+    if required or properties:
+        # Object keywords only apply to objects; skip the guard when type already asserts it
+        guarded = types != ["object"]
+        if guarded:
+            lines.append(f"{pad}if isinstance({var}, dict):")
+        inner = "    " * (depth + 1 if guarded else depth)
+        for name in required:
+            lines.append(f"{inner}if {name!r} not in {var}:")
+            lines.append(f"{inner}    return False")
+        for name, subschema in properties.items():
+            sub_var = f"v{next(names)}"
+            lines.append(f"{inner}if {name!r} in {var}:")
+            lines.append(f"{inner}    {sub_var} = {var}[{name!r}]")
+            _emit_checks(subschema, sub_var, lines, depth + (2 if guarded else 1), names, type_checks)
+
+    if "items" in schema:
+        items = schema["items"]
+        if not isinstance(items, (dict, bool)):
+            raise UnsupportedSchemaError("Only single-schema `items` is supported")
+        item_var = f"v{next(names)}"
+        guarded = types != ["array"]
+        item_depth = depth + (2 if guarded else 1)
+        item_lines: list = []
+        _emit_checks(items, item_var, item_lines, item_depth, names, type_checks)
+        if item_lines:
+            if guarded:
+                lines.append(f"{pad}if isinstance({var}, list):")
+            loop_pad = "    " * (item_depth - 1)
+            lines.append(f"{loop_pad}for {item_var} in {var}:")
+            lines.extend(item_lines)
+
+
+def generate_validator_source(schema: dict) -> str:
+    """
+    Generates a standalone `is_valid(data)` Python function for *schema*.
+    Covers the object/properties/type/required/items subset symparse schemas use;
+    raises UnsupportedSchemaError for anything else. Type checks follow the
+    draft named by ``$schema``, as jsonschema's own validator selection does.
+    """
+    lines = ["def is_valid(data):"]
+    _emit_checks(schema, "data", lines, 1, count(), _type_checks_for(schema))
+    lines.append("    return True")
+    return "\n".join(lines)
+
+
+def _build_codegen_validator(schema: dict) -> Callable[[Any], bool]:
+    """
+    Compiles a generated-Python validator (in the style of fastjsonschema).
+    Valid records only run the generated checks; invalid ones are re-checked by
+    jsonschema so the SchemaViolationError path and message are identical.
+    """
+    source = generate_validator_source(schema)
+    namespace = {"__builtins__": {"isinstance": isinstance, "dict": dict, "list": list,
+                                  "str": str, "int": int, "float": float, "bool": bool}}
+    exec(compile(source, "<symparse-validator>", "exec"), namespace)
+    is_valid = namespace["is_valid"]
+    slow_check = _build_jsonschema_validator(schema)
+
+    def check(data: Any) -> bool:
+        if is_valid(data):
+            return True
+        return slow_check(data)
+
+    return check
+
+
+def compile_validator(schema: dict, backend: str = "jsonschema", schema_key: Optional[str] = None) -> Callable[[Any], bool]:
+    """
+    Returns a cached validator callable for *schema*.
+    The callable returns True or raises SchemaViolationError. *schema_key* (e.g. the
+    cache schema hash) skips re-serializing the schema on every lookup.
+    """
+    if backend not in VALIDATOR_BACKENDS:
+        raise ValueError(f"Unknown validator backend: {backend}")
+    key = (backend, schema_key or _schema_key(schema))
+    validator = _validator_cache.get(key)
+    if validator is not None:
+        return validator
+
+    if backend == "codegen":
+        try:
+            validator = _build_codegen_validator(schema)
+        except UnsupportedSchemaError as e:
+            logger.debug(f"Schema outside codegen subset ({e}); using jsonschema validator.")
+            validator = _build_jsonschema_validator(schema)
+    else:
+        validator = _build_jsonschema_validator(schema)
+
+    with _cache_lock:
+        _validator_cache[key] = validator
+    return validator
+
+
+def enforce_schema(data: dict, schema: dict, schema_key: Optional[str] = None, backend: str = "jsonschema") -> bool:
     """
     Validates a dictionary against a JSON schema.
     Returns True if valid. Raises SchemaViolationError on failure.
     """
-    try:
-        jsonschema.validate(instance=data, schema=schema)
-        return True
-    except jsonschema.exceptions.ValidationError as e:
-        path = ".".join(str(p) for p in e.path) if e.path else ""
-        raise SchemaViolationError(e.message, path) from e
+    return compile_validator(schema, backend=backend, schema_key=schema_key)(data)
@@ -36,3 +36,31 @@ def test_ai_client_network_failure(monkeypatch):
     
     with pytest.raises(Exception):
         client.extract("test", {"type": "object"})
+
+def _mock_response(content):
+    from types import SimpleNamespace
+    message = SimpleNamespace(content=content)
+    return SimpleNamespace(choices=[SimpleNamespace(message=message, logprobs=None)])
+
+def test_ai_client_extract_batch(monkeypatch):
+    prompts = []
+    def mock_completion(*args, **kwargs):
+        prompts.append(kwargs["messages"][1]["content"])
+        return _mock_response('```json\n[{"name": "Alice"}, {"name": "Bob"}]\n```')
+
+    monkeypatch.setattr('symparse.ai_client.completion', mock_completion)
+    client = AIClient()
+
+    results = client.extract_batch(["Alice logged in", "Bob logged in"], {"type": "object", "properties": {"name": {"type": "string"}}})
+
+    assert results == [{"name": "Alice"}, {"name": "Bob"}]
+    assert len(prompts) == 1
+    assert "1. Alice logged in\n2. Bob logged in" in prompts[0]
+
+def test_ai_client_extract_batch_rejects_wrong_length(monkeypatch):
+    monkeypatch.setattr('symparse.ai_client.completion', lambda **kwargs: _mock_response('[{"name": "Alice"}]'))
+    client = AIClient()
+
+    with pytest.raises(ValueError):
+        client.extract_batch(["Alice logged in", "Bob logged in"], {"type": "object"})
+
@@ -1,5 +1,8 @@
 import json
 import multiprocessing
+import pytest
+import re2
+import threading
 from symparse.cache_manager import CacheManager
 
 def test_cache_init_metadata(tmp_path):
@@ -70,3 +73,411 @@ def test_concurrent_writes(tmp_path):
         
     hash_val = cm._hash_schema(schema)
     assert hash_val in meta["schemas"]
+
+def test_fetch_serves_from_index_snapshot(tmp_path, monkeypatch):
+    cm = CacheManager(cache_dir=tmp_path)
+    schema = {"type": "object"}
+    script = "def extract(t): return {'key': 'val'}"
+    cm.save_script(schema, "The quick brown fox", script)
+    assert cm.fetch_script(schema, "The quick brown fox") == script
+
+    # Warm lookups must not reopen metadata.json or the script file
+    import builtins
+    real_open = builtins.open
+    opened = []
+    def tracking_open(file, *args, **kwargs):
+        opened.append(str(file))
+        return real_open(file, *args, **kwargs)
+    monkeypatch.setattr(builtins, "open", tracking_open)
+    for _ in range(3):
+        assert cm.fetch_script(schema, "The quick brown fox") == script
+    assert opened == []
+
+@pytest.mark.parametrize("backend", ["json", "sqlite"])
+def test_index_snapshot_sees_other_writers(tmp_path, backend):
+    reader = CacheManager(cache_dir=tmp_path, backend=backend)
+    writer = CacheManager(cache_dir=tmp_path, backend=backend)
+    schema = {"type": "object"}
+
+    assert reader.fetch_script(schema, "The quick brown fox") is None
+    writer.save_script(schema, "The quick brown fox", "v1")
+    assert reader.fetch_script(schema, "The quick brown fox") == "v1"
+
+    writer.save_script(schema, "The quick brown fox", "v2 with a longer body")
+    assert reader.fetch_script(schema, "The quick brown fox") == "v2 with a longer body"
+
+    writer.delete_script(schema)
+    assert reader.fetch_script(schema, "The quick brown fox") is None
+
+@pytest.mark.parametrize("backend", ["json", "sqlite"])
+def test_multiple_archetypes_per_schema(tmp_path, backend):
+    cm = CacheManager(cache_dir=tmp_path, backend=backend)
+    schema = {"type": "object"}
+    normal = "2024-01-15T10:00:00Z Normal Scheduled pod/web-1 assigned"
+    warning = "2024-01-15T10:00:05Z Warning BackOff pod/web-2 [restarting failed container] x3"
+
+    cm.save_script(schema, normal, "normal script")
+    cm.save_script(schema, warning, "warning script")
+
+    # The second shape is added alongside the first instead of overwriting it
+    archetypes = cm.list_cache()[cm._hash_schema(schema)]["archetypes"]
+    assert len(archetypes) == 2
+
+    # Structurally identical lines route by signature regardless of their data
+    assert cm.fetch_script(schema, "2025-03-01T08:30:00Z Normal Pulled pod/api-7 done") == "normal script"
+    assert cm.fetch_script(schema, "2025-03-01T08:30:09Z Warning Failed pod/api-9 [image pull error] x12") == "warning script"
+
+    # Purging one archetype leaves the other in place
+    hit = cm.lookup(schema, warning)
+    cm.delete_script(schema, archetype_id=hit.archetype_id)
+    assert cm.fetch_script(schema, warning) != "warning script"
+    assert cm.fetch_script(schema, normal) == "normal script"
+
+def sqlite_writer(cache_dir, schema, text, script):
+    cm = CacheManager(cache_dir=cache_dir, backend="sqlite")
+    cm.save_script(schema, text, script)
+
+def test_sqlite_backend(tmp_path):
+    import sqlite3
+    cm = CacheManager(cache_dir=tmp_path, backend="sqlite")
+    assert cm.backend == "sqlite"
+    schema = {"type": "object"}
+    cm.save_script(schema, "The quick brown fox", "fox script")
+
+    # Entries and scripts are rows in one WAL-mode database, not loose files
+    assert sorted(p.name for p in tmp_path.iterdir() if not p.name.endswith(("-wal", "-shm"))) == ["cache.sqlite3"]
+    conn = sqlite3.connect(tmp_path / "cache.sqlite3")
+    assert conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+    assert conn.execute("SELECT COUNT(*) FROM scripts").fetchone()[0] == 1
+    conn.close()
+
+    assert cm.fetch_script(schema, "The quick brown fox") == "fox script"
+    # A manager without an explicit backend picks up the existing database
+    assert CacheManager(cache_dir=tmp_path).fetch_script(schema, "The quick brown fox") == "fox script"
+
+    cm.delete_script(schema)
+    assert cm.list_cache() == {}
+    cm.save_script(schema, "The quick brown fox", "fox script")
+    cm.clear_cache()
+    assert cm.fetch_script(schema, "The quick brown fox") is None
+
+def test_sqlite_concurrent_writes(tmp_path):
+    schema = {"type": "object"}
+    shapes = ["alpha", "beta: gamma", "delta - epsilon", "zeta [eta]", "theta (iota)"]
+    processes = [
+        multiprocessing.Process(target=sqlite_writer, args=(tmp_path, schema, shape, f"script {i}"))
+        for i, shape in enumerate(shapes)
+    ]
+    for p in processes:
+        p.start()
+    for p in processes:
+        p.join()
+    assert all(p.exitcode == 0 for p in processes)
+
+    # Concurrent transactional upserts keep every archetype
+    cm = CacheManager(cache_dir=tmp_path, backend="sqlite")
+    assert len(cm.list_cache()[cm._hash_schema(schema)]["archetypes"]) == len(shapes)
+    for i, shape in enumerate(shapes):
+        assert cm.fetch_script(schema, shape) == f"script {i}"
+
+def test_sqlite_backend_imports_json_cache(tmp_path):
+    schema = {"type": "object"}
+    CacheManager(cache_dir=tmp_path, backend="json").save_script(schema, "The quick brown fox", "fox script")
+
+    cm = CacheManager(cache_dir=tmp_path, backend="sqlite")
+    assert cm.fetch_script(schema, "The quick brown fox") == "fox script"
+    assert list(cm.list_cache()) == [cm._hash_schema(schema)]
+
+def test_structural_signature_ignores_data():
+    a = CacheManager.structural_signature('10.0.0.1 - - [25/Feb/2026:14:22:11 +0000] "GET /a HTTP/1.1" 200 15')
+    b = CacheManager.structural_signature('192.168.1.42 - bob [01/Mar/2026:09:00:00 +0000] "POST /b/c HTTP/1.1" 404 99')
+    c = CacheManager.structural_signature('192.168.1.42 - bob [01/Mar/2026:09:00:00 +0000] "POST /b/c HTTP/1.1" 404 99 "curl"')
+    assert CacheManager.structural_signature("a - - b") != a
+    assert a.replace(" - - ", " - a ") == b
+    assert b != c
+
+def test_legacy_single_archetype_metadata(tmp_path):
+    cm = CacheManager(cache_dir=tmp_path)
+    schema = {"type": "object"}
+    schema_hash = cm._hash_schema(schema)
+    (tmp_path / f"{schema_hash}.py").write_text("legacy script")
+    (tmp_path / "metadata.json").write_text(json.dumps(
+        {"schemas": {schema_hash: {"archetype_text": "User ID is 42", "compiled": True}}}
+    ))
+
+    assert cm.fetch_script(schema, "User ID is 7") == "legacy script"
+
+    # Saving a new shape upgrades the entry and keeps the legacy archetype routable
+    cm.save_script(schema, "user=alice id=7 role=admin", "new script")
+    assert cm.fetch_script(schema, "User ID is 7") == "legacy script"
+    assert cm.fetch_script(schema, "user=bob id=9 role=viewer") == "new script"
+
+def _sequential_normalize(text):
+    """Reference implementation: the original one-substitution-per-kind normalizer."""
+    import re
+    t = re.sub(r'\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3}', '<IP>', text)
+    t = re.sub(r'\d{1,2}/\w{3}/\d{4}:\d{2}:\d{2}:\d{2}\s*[+\-]?\d{4}', '<TS>', t)
+    t = re.sub(r'\d{4}-\d{2}-\d{2}[T ]\d{2}:\d{2}:\d{2}[^\s]*', '<TS>', t)
+    t = re.sub(r'[\w.+-]+@[\w.-]+\.\w+', '<EMAIL>', t)
+    t = re.sub(r'/[\w./\-_%~]*', '<PATH>', t)
+    return re.sub(r'\b\d{2,}\b', '<NUM>', t)
+
+def test_single_pass_normalizer_matches_sequential():
+    from pathlib import Path
+    sample = Path(__file__).resolve().parent.parent / "examples" / "sample_nginx.log"
+    lines = [line.strip() for line in sample.read_text().splitlines() if line.strip()]
+    lines += [
+        "User alice@example.com logged in from 10.0.0.1 at 2024-01-15T10:00:00Z",
+        "order 12345 shipped to /warehouse/7 in 3 days",
+    ]
+    for line in lines:
+        assert CacheManager._normalize_for_similarity(line) == _sequential_normalize(line)
+
+def test_archetype_tokens_precomputed_on_save(tmp_path):
+    cm = CacheManager(cache_dir=tmp_path)
+    schema = {"type": "object"}
+    cm.save_script(schema, "GET /index.html 200 1532", "script")
+    archetype = next(iter(cm.list_cache()[cm._hash_schema(schema)]["archetypes"].values()))
+    assert archetype["archetype_tokens"] == sorted({"get", "<path>", "<num>"})
+
+def _template_script(pattern):
+    return f"import re2\n\ndef extract(text):\n    m = re2.search(r'{pattern}', text)\n    if not m:\n        return None\n    return {{\"v\": m.group(1)}}"
+
+def test_pattern_set_dispatch_across_archetypes(tmp_path, monkeypatch):
+    cm = CacheManager(cache_dir=tmp_path)
+    schema = {"type": "object"}
+    # Hundreds of archetypes, each a distinct template pattern
+    for i in range(300):
+        shape = "evt" + "." * (i % 20) + ":" * (i // 20)
+        cm.save_script(schema, f"{shape} code=1", _template_script(re2.escape(shape) + r" code=(\d+)"))
+    cm.save_script(schema, "user alice logged in from web", _template_script(r"user (\w+) logged in"))
+
+    archetypes = cm.list_cache()[cm._hash_schema(schema)]["archetypes"]
+    assert len(archetypes) == 301
+    assert all(a["pattern"] for a in archetypes.values())
+
+    # An unseen signature is routed by the single Set scan, never the similarity gate
+    monkeypatch.setattr(cm, "_tier2_route", lambda *args: pytest.fail("Tier-2 gate should not run"))
+    hit = cm.lookup(schema, "user bob logged in from web")
+    assert hit.script == _template_script(r"user (\w+) logged in")
+    hit = cm.lookup(schema, "evt...:: code=42")
+    assert hit.script == _template_script(re2.escape("evt...::") + r" code=(\d+)")
+
+    # Lines no pattern accepts as a whole miss instead of being handed to a script
+    # that cannot parse them, or would parse only part of them
+    assert cm.lookup(schema, "completely different line") is None
+    assert cm.lookup(schema, "[edge] user bob logged in via sso") is None
+    assert cm.lookup(schema, "evt...:: code=42 suffix") is None
+
+def test_pattern_set_does_not_route_longer_lines_to_shorter_formats(tmp_path):
+    from symparse.compiler import _build_deterministic_script
+    cm = CacheManager(cache_dir=tmp_path)
+    schema = {"type": "object", "properties": {"ip": {"type": "string"}, "status": {"type": "integer"}, "ua": {"type": "string"}}}
+    # The no-user-agent shape arrives first and compiles a template
+    short = '10.0.0.1 - - [10/Oct/2023:13:55:36 +0000] "GET /a HTTP/1.1" 200 512'
+    cm.save_script(schema, short, _build_deterministic_script(short, schema, {"ip": "10.0.0.1", "status": 200}))
+    assert cm.list_cache()[cm._hash_schema(schema)]["archetypes"][cm._archetype_id(short)]["pattern"]
+
+    same_shape = '10.0.0.7 - - [10/Oct/2023:13:55:36 +0000] "GET /a HTTP/1.1" 404 512'
+    assert cm.lookup(schema, same_shape) is not None
+    # A line with a trailing user agent gets its own extractor instead of losing the field
+    with_ua = short + ' "Mozilla/5.0 (X11; Linux)"'
+    assert cm.lookup(schema, with_ua) is None
+
+def test_pattern_set_leaves_free_form_scripts_to_tier2(tmp_path):
+    cm = CacheManager(cache_dir=tmp_path)
+    schema = {"type": "object"}
+    cm.save_script(schema, "user alice logged in from web", _template_script(r"user (\w+) logged in"))
+    cm.save_script(schema, "GET /index.html 200 1024", "import re2\ndef extract(text):\n    return dict(m.groupdict() for m in re2.finditer(r'x', text))")
+
+    dispatch = cm._pattern_dispatch(cm._hash_schema(schema), cm.list_cache()[cm._hash_schema(schema)]["archetypes"])
+    assert len(dispatch.archetype_ids) == 1
+    assert len(dispatch.uncovered) == 1
+    assert "finditer" in cm.fetch_script(schema, "POST /api/v1 201 77")
+
+
+def test_json_writes_replace_files_atomically(tmp_path, monkeypatch):
+    import os
+    import symparse.storage
+    cm = CacheManager(cache_dir=tmp_path)
+    schema = {"type": "object"}
+    cm.save_script(schema, "The quick brown fox", "v1")
+    script_path = tmp_path / f"{cm._hash_schema(schema)}-{cm._archetype_id('The quick brown fox')}.py"
+    inodes = (os.stat(tmp_path / "metadata.json").st_ino, os.stat(script_path).st_ino)
+
+    syncs = []
+    real_fsync = os.fsync
+    monkeypatch.setattr(symparse.storage.os, "fsync", lambda fd: (syncs.append(fd), real_fsync(fd)))
+    cm.save_script(schema, "The quick brown fox", "v2")
+
+    # New revisions are renamed into place (new inodes), with one sync for the index
+    assert os.stat(tmp_path / "metadata.json").st_ino != inodes[0]
+    assert os.stat(script_path).st_ino != inodes[1]
+    assert len(syncs) == 1
+    assert not list(tmp_path.glob(".*.tmp"))
+    assert cm.fetch_script(schema, "The quick brown fox") == "v2"
+
+def test_script_digest_mismatch_is_a_miss_not_a_purge(tmp_path):
+    cm = CacheManager(cache_dir=tmp_path)
+    schema = {"type": "object"}
+    cm.save_script(schema, "The quick brown fox", "def extract(t): return {}")
+    script_path = tmp_path / f"{cm._hash_schema(schema)}-{cm._archetype_id('The quick brown fox')}.py"
+
+    # e.g. a script that did not reach the disk before a crash
+    script_path.write_text("")
+    cm._invalidate_index()
+    assert cm.fetch_script(schema, "The quick brown fox") is None
+    assert cm._archetype_id("The quick brown fox") in cm.list_cache()[cm._hash_schema(schema)]["archetypes"]
+
+@pytest.mark.parametrize("backend", ["json", "sqlite"])
+def test_batch_groups_saves_into_one_commit(tmp_path, monkeypatch, backend):
+    cm = CacheManager(cache_dir=tmp_path, backend=backend)
+    schema = {"type": "object"}
+    commits = []
+    real_transaction = cm._store.transaction
+    def counting_transaction():
+        commits.append(1)
+        return real_transaction()
+    monkeypatch.setattr(cm._store, "transaction", counting_transaction)
+
+    shapes = ["alpha", "beta: gamma", "delta - epsilon"]
+    with cm.batch():
+        for i, shape in enumerate(shapes):
+            cm.save_script(schema, shape, f"script {i}")
+        # Pending saves are committed when the batch exits
+        assert cm.fetch_script(schema, "alpha") is None
+        assert commits == []
+    assert commits == [1]
+    for i, shape in enumerate(shapes):
+        assert cm.fetch_script(schema, shape) == f"script {i}"
+
+@pytest.mark.parametrize("backend", ["json", "sqlite"])
+def test_concurrent_saves_share_group_commits(tmp_path, monkeypatch, backend):
+    cm = CacheManager(cache_dir=tmp_path, backend=backend)
+    schema = {"type": "object"}
+    commits = []
+    real_transaction = cm._store.transaction
+    def slow_transaction():
+        commits.append(1)
+        # Stands in for the fsync; saves arriving meanwhile queue for the next commit
+        threading.Event().wait(0.05)
+        return real_transaction()
+    monkeypatch.setattr(cm._store, "transaction", slow_transaction)
+
+    shapes = [f"shape{i}" + ":" * i for i in range(8)]
+    threads = [threading.Thread(target=cm.save_script, args=(schema, shape, f"script {i}")) for i, shape in enumerate(shapes)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(commits) < len(shapes)
+    for i, shape in enumerate(shapes):
+        assert cm.fetch_script(schema, shape) == f"script {i}"
+
+def test_group_commit_failure_reaches_every_caller(tmp_path, monkeypatch):
+    cm = CacheManager(cache_dir=tmp_path)
+    def failing_transaction():
+        raise OSError("disk full")
+    monkeypatch.setattr(cm._store, "transaction", failing_transaction)
+
+    with pytest.raises(OSError):
+        cm.save_script({"type": "object"}, "alpha", "script")
+    assert not cm._committing and cm._commit_queue == []
+
+def test_usage_is_buffered_and_flushed(tmp_path):
+    cm = CacheManager(cache_dir=tmp_path)
+    schema = {"type": "object"}
+    cm.save_script(schema, "The quick brown fox", "fox script")
+    archetype_id = cm._archetype_id("The quick brown fox")
+    for _ in range(3):
+        assert cm.fetch_script(schema, "The quick brown fox") == "fox script"
+
+    # Hits are only counted in memory until the next flush
+    assert cm.list_cache()[cm._hash_schema(schema)]["archetypes"][archetype_id]["hits"] == 0
+    cm.flush_usage()
+    assert cm.list_cache()[cm._hash_schema(schema)]["archetypes"][archetype_id]["hits"] == 3
+
+@pytest.mark.parametrize("backend", ["json", "sqlite"])
+@pytest.mark.parametrize("eviction,survivor", [("lru", "beta: gamma"), ("lfu", "alpha")])
+def test_eviction_policies(tmp_path, monkeypatch, backend, eviction, survivor):
+    import symparse.cache_manager
+    clock = iter(range(100, 200))
+    monkeypatch.setattr(symparse.cache_manager, "_wall_now", lambda: next(clock))
+    cm = CacheManager(cache_dir=tmp_path, backend=backend, max_entries=2, eviction=eviction)
+    schema = {"type": "object"}
+    cm.save_script(schema, "alpha", "alpha script")
+    cm.save_script(schema, "beta: gamma", "beta script")
+    # alpha is used often but longer ago; beta once, more recently
+    for _ in range(5):
+        cm.fetch_script(schema, "alpha")
+    cm.fetch_script(schema, "beta: gamma")
+    cm.flush_usage()
+
+    cm.save_script(schema, "delta - epsilon", "delta script")
+    kept = {a["archetype_text"] for a in cm.list_cache()[cm._hash_schema(schema)]["archetypes"].values()}
+    assert kept == {survivor, "delta - epsilon"}
+
+def test_byte_limit_evicts_oldest(tmp_path):
+    cm = CacheManager(cache_dir=tmp_path, max_bytes=2000)
+    schema = {"type": "object"}
+    shapes = ["alpha", "beta: gamma", "delta - epsilon", "zeta [eta]", "theta (iota)", "kappa {lambda}"]
+    for shape in shapes:
+        cm.save_script(schema, shape, "x" * 300)
+
+    archetypes = cm.list_cache()[cm._hash_schema(schema)]["archetypes"].values()
+    assert sum(CacheManager._archetype_bytes(a) for a in archetypes) <= 2000
+    assert "kappa {lambda}" in {a["archetype_text"] for a in archetypes}
+    # Evicted scripts are deleted with their index records
+    assert len(list(tmp_path.glob("*.py"))) == len(archetypes) < len(shapes)
+
+@pytest.mark.parametrize("backend", ["json", "sqlite"])
+def test_compact_removes_orphans_and_broken_entries(tmp_path, backend):
+    import os
+    import time
+    cm = CacheManager(cache_dir=tmp_path, backend=backend)
+    schema = {"type": "object"}
+    cm.save_script(schema, "alpha", "alpha script")
+    cm.save_script(schema, "beta: gamma", "beta script")
+    # An archetype whose script is gone, plus files no entry points at
+    missing = cm._archetype_id("beta: gamma")
+    cm._store.read_script = lambda name, read=cm._store.read_script: None if missing in name else read(name)
+    (tmp_path / "deadbeef-0000.py").write_text("orphan")
+    (tmp_path / "deadbeef-vectors-3.npy").write_bytes(b"")
+    stale_tmp = tmp_path / ".metadata.json.abc.tmp"
+    stale_tmp.write_text("")
+    os.utime(stale_tmp, (time.time() - 3600, time.time() - 3600))
+
+    summary = cm.compact()
+    assert summary == {"dropped": 1, "evicted": 0, "removed_files": 3, "archetypes": 1}
+    assert not (tmp_path / "deadbeef-0000.py").exists()
+    assert not stale_tmp.exists()
+    assert cm.fetch_script(schema, "alpha") == "alpha script"
+
+def test_similarity_rejections_are_charged_to_nearest_extractor(tmp_path):
+    cm = CacheManager(cache_dir=tmp_path)
+    schema = {"type": "object"}
+    cm.save_script(schema, "GET /index.html 200", "script")
+    # Different structure and tokens: routed to the Tier-2 gate and rejected
+    assert cm.fetch_script(schema, "completely unrelated words here, nothing shared") is None
+
+    [row] = cm.extractor_stats()
+    assert row["similarity_rejections"] == 1
+    assert row["hits"] == 0
+
+def test_quarantine_skips_a_script_replaced_by_another_process(tmp_path):
+    schema = {"type": "object"}
+    text = "request 1 done"
+    worker_a = CacheManager(cache_dir=tmp_path)
+    worker_b = CacheManager(cache_dir=tmp_path)
+    worker_a.save_script(schema, text, "old script")
+    failed = worker_a.lookup(schema, text)
+
+    # Another worker recompiles the archetype before this one's breaker trips
+    worker_b.save_script(schema, text, "new script")
+    worker_a.quarantine_script(schema, archetype_id=failed.archetype_id, revision=failed.revision)
+    assert worker_b.fetch_script(schema, text) == "new script"
+
+    current = worker_a.lookup(schema, text)
+    worker_a.quarantine_script(schema, archetype_id=current.archetype_id, revision=current.revision)
+    assert worker_b.fetch_script(schema, text) is None
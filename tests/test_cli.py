@@ -2,6 +2,7 @@ import pytest
 from unittest.mock import patch, mock_open
 import sys
 import io
+import json
 from symparse.cli import main
 
 def test_cli_cache_list_clear(monkeypatch, capsys):
@@ -66,7 +67,125 @@ def test_run_command_success(capsys):
         with patch('sys.stdin.isatty', return_value=False):
             with patch('sys.stdin', io.StringIO('My name is Alice\n')):
                 with patch('builtins.open', mock_open(read_data=dummy_schema)):
-                    with patch('symparse.engine.process_stream', return_value={'name': 'Alice'}):
+                    with patch('symparse.engine.Engine') as mock_engine:
+                        mock_engine.return_value.process.return_value = {'name': 'Alice'}
                         main()
     captured = capsys.readouterr()
     assert '"name": "Alice"' in captured.out
+    # The session is built once per run, not once per line
+    assert mock_engine.call_count == 1
+
+
+def test_warm_path_does_not_import_ai_stack():
+    import subprocess
+    from pathlib import Path
+    code = (
+        "import sys, symparse.cli, symparse.pipeline, symparse.output\n"
+        "print(','.join(m for m in ('litellm', 'sentence_transformers', 'numpy') if m in sys.modules))"
+    )
+    result = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True,
+                            cwd=Path(__file__).resolve().parent.parent)
+    assert result.stdout.strip() == ""
+
+
+def test_version_flag(capsys):
+    with patch.object(sys, 'argv', ["symparse", "--version"]):
+        with pytest.raises(SystemExit) as e:
+            main()
+    assert e.value.code == 0
+    assert capsys.readouterr().out.startswith("symparse ")
+
+@pytest.mark.parametrize("flags,message", [
+    (["--failure-window", "2"], "--failure-window must be at least 3"),
+    (["--failure-threshold", "0"], "--failure-threshold must be greater than 0"),
+    (["--failure-threshold", "1.5"], "--failure-threshold must be greater than 0"),
+])
+def test_run_rejects_invalid_breaker_settings(capsys, flags, message):
+    with patch.object(sys, 'argv', ["symparse", "run", "--schema", "schema.json", *flags]):
+        with pytest.raises(SystemExit) as e:
+            main()
+    assert e.value.code == 2
+    assert message in capsys.readouterr().err
+
+def test_cache_stats_command(capsys, monkeypatch, tmp_path):
+    import symparse.cache_manager
+    cm = symparse.cache_manager.CacheManager(cache_dir=tmp_path)
+    schema = {"type": "object"}
+    cm.save_script(schema, "alpha", "alpha script")
+    cm.save_script(schema, "beta: gamma", "beta script")
+    for _ in range(3):
+        cm.fetch_script(schema, "beta: gamma")
+    cm.flush_usage()
+    monkeypatch.setattr(symparse.cache_manager, "CacheManager", lambda **kwargs: cm)
+
+    with patch.object(sys, 'argv', ["symparse", "cache", "stats", "--json"]):
+        with pytest.raises(SystemExit) as e:
+            main()
+        assert e.value.code == 0
+    rows = json.loads(capsys.readouterr().out)
+    assert [(row["archetype_text"], row["hits"]) for row in rows] == [("beta: gamma", 3), ("alpha", 0)]
+
+    with patch.object(sys, 'argv', ["symparse", "cache", "stats", "--limit", "1"]):
+        with pytest.raises(SystemExit):
+            main()
+    table = capsys.readouterr().out.splitlines()
+    assert table[0].startswith("SCHEMA") and len(table) == 2
+    assert "beta: gamma" in table[1]
+
+def test_run_stats_json(capsys, monkeypatch, tmp_path):
+    from symparse.engine import EngineStats
+    monkeypatch.setattr('symparse.engine.global_stats', EngineStats())
+    schema_path = tmp_path / "schema.json"
+    schema_path.write_text('{"type": "object", "properties": {"name": {"type": "string"}}}')
+    report_path = tmp_path / "stats.json"
+    test_args = ["symparse", "run", "--schema", str(schema_path), "--stats-json", str(report_path)]
+    with patch.object(sys, 'argv', test_args):
+        with patch('sys.stdin.isatty', return_value=False):
+            with patch('sys.stdin', io.StringIO('Alice\nBob\n')):
+                with patch('symparse.engine.Engine') as mock_engine:
+                    mock_engine.return_value.process.return_value = {'name': 'Alice'}
+                    main()
+    capsys.readouterr()
+    report = json.loads(report_path.read_text())
+    assert report["stages"]["output_write"]["count"] == 2
+    assert set(report["stages"]["output_write"]) == {"count", "mean_ms", "p50_ms", "p95_ms", "p99_ms", "max_ms"}
+
+def test_run_profile_writes_pstats(capsys, tmp_path):
+    import pstats
+    schema_path = tmp_path / "schema.json"
+    schema_path.write_text('{"type": "object", "properties": {"name": {"type": "string"}}}')
+    profile_path = tmp_path / "run.prof"
+    test_args = ["symparse", "run", "--schema", str(schema_path), "--profile", str(profile_path)]
+    with patch.object(sys, 'argv', test_args):
+        with patch('sys.stdin.isatty', return_value=False):
+            with patch('sys.stdin', io.StringIO('Alice\n')):
+                with patch('symparse.engine.Engine') as mock_engine:
+                    mock_engine.return_value.process.return_value = {'name': 'Alice'}
+                    main()
+    assert "Profile written to" in capsys.readouterr().err
+    assert pstats.Stats(str(profile_path)).total_calls > 0
+
+def test_run_invalid_schema_is_reported(capsys, tmp_path):
+    schema_path = tmp_path / "schema.json"
+    schema_path.write_text('{"type": "object", "properties": {"id": {"type": "intger"}}}')
+    with patch.object(sys, 'argv', ["symparse", "run", "--schema", str(schema_path)]):
+        with patch('sys.stdin.isatty', return_value=False):
+            with patch('sys.stdin', io.StringIO('x\n')):
+                with pytest.raises(SystemExit) as e:
+                    main()
+    assert e.value.code == 1
+    err = capsys.readouterr().err
+    assert err.startswith("Error: Invalid schema file:")
+    assert "Traceback" not in err
+
+def test_run_flushes_output_on_unexpected_error(capsys):
+    dummy_schema = '{"type": "object", "properties": {"name": {"type": "string"}}}'
+    with patch.object(sys, 'argv', ["symparse", "run", "--schema", "dummy.json"]):
+        with patch('sys.stdin.isatty', return_value=False):
+            with patch('sys.stdin', io.StringIO('Alice\nBob\n')):
+                with patch('builtins.open', mock_open(read_data=dummy_schema)):
+                    with patch('symparse.engine.Engine') as mock_engine:
+                        mock_engine.return_value.process.side_effect = [{'name': 'Alice'}, RuntimeError("boom")]
+                        with pytest.raises(RuntimeError):
+                            main()
+    assert '"name": "Alice"' in capsys.readouterr().out
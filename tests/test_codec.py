@@ -0,0 +1,48 @@
+import json
+import random
+import pytest
+from symparse import codec
+
+def _stdlib_compact(obj):
+    return json.dumps(obj, separators=(",", ":"), ensure_ascii=False)
+
+@pytest.mark.parametrize("obj", [
+    {"name": "Alice", "age": 30, "tags": ["a", "b"], "nested": {"ok": True, "none": None}},
+    {"text": "".join(chr(i) for i in range(0x80)) + " é \U0001f600  "},
+    {"floats": [0.0, -0.0, 1.5, 0.0001, 123456789.125, 1e16, 1e-05, 2.5e-300, float("inf"), float("nan")]},
+    {"ints": [0, -1, 2 ** 63, -(2 ** 63), 2 ** 64, -(2 ** 64)]},
+    {"surrogate": "\ud800"},
+    {1: "non-string key"},
+    [("tuple", 1)],
+])
+def test_dumps_compact_matches_stdlib(obj):
+    assert codec.dumps_compact(obj) == _stdlib_compact(obj)
+
+def test_dumps_compact_matches_stdlib_for_random_floats():
+    rng = random.Random(7)
+    values = [rng.uniform(-1e6, 1e6) for _ in range(2000)] + [rng.random() * 10 ** rng.randint(-8, 20) for _ in range(2000)]
+    assert codec.dumps_compact(values) == _stdlib_compact(values)
+
+def test_loads_accepts_what_stdlib_accepts():
+    assert codec.loads('{"a": [1, 2.5, "x"]}') == {"a": [1, 2.5, "x"]}
+    assert codec.loads(b'{"big": 123456789012345678901234567890}') == {"big": 123456789012345678901234567890}
+    assert codec.loads('[NaN]')[0] != codec.loads('[NaN]')[0]
+    with pytest.raises(json.JSONDecodeError):
+        codec.loads('{"a": ')
+
+def test_dumps_compact_rejects_what_stdlib_rejects():
+    import datetime
+    with pytest.raises(TypeError):
+        codec.dumps_compact({"at": datetime.datetime(2024, 1, 1)})
+    # str subclasses are passed to stdlib rather than serialized natively
+    class Tag(str):
+        pass
+    assert codec.dumps_compact({"tag": Tag("x")}) == _stdlib_compact({"tag": Tag("x")})
+
+@pytest.mark.skipif(codec.orjson is None, reason="orjson not installed")
+def test_dumps_compact_keeps_common_records_on_orjson(monkeypatch):
+    # Nulls and exponent-looking strings are not float formatting differences
+    record = {"host": "kube-node-1", "msg": "time-out on line1", "user": None, "latency": 12.5, "rows": [{"n": None}]}
+    expected = _stdlib_compact(record)
+    monkeypatch.setattr(codec.json, "dumps", lambda *args, **kwargs: pytest.fail("stdlib fallback used"))
+    assert codec.dumps_compact(record) == expected
@@ -81,3 +81,76 @@ def extract(text):
     schema = {"type": "object"}
     result = execute_script(script, text, schema)
     assert result["name"] is None
+
+def test_execute_script_memoizes_extractor(monkeypatch):
+    from symparse import compiler
+
+    script = "def extract(text):\n    return {'len': len(text)}\n"
+    compiler.invalidate_extractors("schema-a")
+
+    exec_calls = []
+    real_exec = exec
+
+    def counting_exec(*args, **kwargs):
+        exec_calls.append(args[0])
+        return real_exec(*args, **kwargs)
+
+    monkeypatch.setattr('builtins.exec', counting_exec)
+    for text in ("a", "bb", "ccc"):
+        assert execute_script(script, text, {}, schema_hash="schema-a") == {"len": len(text)}
+    assert len(exec_calls) == 1
+
+    # A changed script is a new revision and gets compiled on first use
+    changed = script.replace("'len'", "'size'")
+    assert execute_script(changed, "dd", {}, schema_hash="schema-a") == {"size": 2}
+    assert len(exec_calls) == 2
+
+    # Invalidation forces a recompile of the cached revision
+    compiler.invalidate_extractors("schema-a")
+    execute_script(script, "a", {}, schema_hash="schema-a")
+    assert len(exec_calls) == 3
+
+def test_revision_keyed_memo_skips_hashing_and_invalidates_one_archetype(monkeypatch):
+    from symparse import compiler
+
+    compiler.invalidate_extractors("schema-b")
+    script = "def extract(text):\n    return {'len': len(text)}\n"
+    exec_calls = []
+    real_exec = exec
+
+    def counting_exec(*args, **kwargs):
+        exec_calls.append(args[0])
+        return real_exec(*args, **kwargs)
+
+    def no_hashing(script_content):
+        raise AssertionError("source hashed despite a known revision")
+
+    monkeypatch.setattr('builtins.exec', counting_exec)
+    monkeypatch.setattr(compiler, 'script_digest', no_hashing)
+    for archetype_id in ("a1", "a2"):
+        for text in ("x", "yy"):
+            assert execute_script(script, text, {}, schema_hash="schema-b", archetype_id=archetype_id, revision="r1") == {"len": len(text)}
+    assert len(exec_calls) == 2
+
+    # Changing one archetype keeps the other's compiled callable
+    compiler.invalidate_extractors("schema-b", "a1")
+    execute_script(script, "z", {}, schema_hash="schema-b", archetype_id="a2", revision="r1")
+    assert len(exec_calls) == 2
+    execute_script(script, "z", {}, schema_hash="schema-b", archetype_id="a1", revision="r1")
+    assert len(exec_calls) == 3
+
+def test_extract_template_pattern():
+    import re2
+    from symparse.compiler import extract_template_pattern
+    template = "import re2\n\ndef extract(text):\n    m = re2.search(r'user (\\w+) id=(\\d+)', text)\n    return {'u': m.group(1)}"
+    assert extract_template_pattern(template) == r"user (\w+) id=(\d+)"
+    # Anchored to the archetype line, the text around the match becomes literal
+    anchored = extract_template_pattern(template, "[auth] user bob id=7 ok")
+    assert re2.fullmatch(anchored, "[auth] user alice id=42 ok")
+    assert not re2.fullmatch(anchored, "[auth] user alice id=42 ok extra=1")
+    assert extract_template_pattern(template, "no match here") is None
+    # Scripts with several or non-search re2 calls cannot be described by one pattern
+    assert extract_template_pattern("import re2\ndef extract(text):\n    a = re2.search(r'a', text)\n    b = re2.search(r'b', text)") is None
+    assert extract_template_pattern("import re2\ndef extract(text):\n    return list(re2.finditer(r'a', text))") is None
+    assert extract_template_pattern("not python (") is None
+
@@ -3,7 +3,7 @@ import os
 import json
 import portalocker
 
-from symparse.engine import process_stream
+from symparse.engine import Engine
 from symparse.cache_manager import CacheManager
 import openai
 from openai import APIConnectionError
@@ -41,14 +41,18 @@ def test_fallback_corrupted_script(tmp_path, monkeypatch):
         return cm
     monkeypatch.setattr('symparse.engine.CacheManager', mock_cache_manager)
         
+    engine = Engine(SCHEMA, degradation_mode=os.getenv("SYMPARSE_DEGRADATION_MODE", "passthrough"))
     try:
         # Fallback path runs AIClient...
-        process_stream("User ID is 42", SCHEMA, degradation_mode=os.getenv("SYMPARSE_DEGRADATION_MODE", "passthrough"))
+        engine.process("User ID is 42")
         # If no local containerized LLM, we might fail here
     except (APIConnectionError, openai.NotFoundError):
         pytest.skip("No local LLM to execute fallback Cold Start constraint.")
-        
-    # Fast Path deletion verification
+
+    # One failure only reroutes the line; a script that keeps failing is quarantined
+    assert cm.fetch_script(SCHEMA, "User ID is 42") is not None
+    engine.process("User ID is 42")
+    engine.process("User ID is 42")
     assert cm.fetch_script(SCHEMA, "User ID is 42") is None
     
 def test_stdin_concurrency_locking(tmp_path):
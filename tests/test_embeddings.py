@@ -0,0 +1,110 @@
+import pytest
+from symparse.cache_manager import CacheManager
+from symparse.embeddings import EmbeddingCache, cosine_similarity
+
+np = pytest.importorskip("numpy")
+
+class FakeEncoder:
+    """Letter-frequency vectors; records the batches it was asked to encode."""
+    def __init__(self):
+        self.batches = []
+
+    def encode(self, texts, batch_size=32):
+        self.batches.append(list(texts))
+        vectors = np.zeros((len(texts), 26), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for ch in text.lower():
+                if "a" <= ch <= "z":
+                    vectors[row, ord(ch) - ord("a")] += 1
+        return vectors
+
+def test_embedding_cache_memoizes_and_batches():
+    encoder = FakeEncoder()
+    cache = EmbeddingCache(maxsize=3, batch_size=2, encoder=encoder)
+
+    vectors = cache.embed_many(["alpha", "beta", "alpha", "gamma"])
+    assert encoder.batches == [["alpha", "beta"], ["gamma"]]
+    assert vectors[0] is vectors[2]
+
+    cache.embed("beta")
+    assert len(encoder.batches) == 2
+
+    # "alpha" is the least recently used entry and is evicted first
+    cache.embed("delta")
+    cache.embed("alpha")
+    assert encoder.batches[-1] == ["alpha"]
+
+def test_cosine_similarity():
+    assert cosine_similarity([1, 0], [1, 0]) == pytest.approx(1.0)
+    assert cosine_similarity([1, 0], [0, 1]) == pytest.approx(0.0)
+    assert cosine_similarity([0, 0], [1, 1]) == 0.0
+
+def test_cache_manager_routes_with_shared_embeddings(tmp_path):
+    encoder = FakeEncoder()
+    cm = CacheManager(cache_dir=tmp_path)
+    cm._embeddings = EmbeddingCache(encoder=encoder)
+    schema = {"type": "object"}
+    cm.save_script(schema, "GET index page served", "web script", use_embeddings=True)
+    cm.save_script(schema, "kernel: panic - not syncing", "kernel script", use_embeddings=True)
+    schema_hash = cm._hash_schema(schema)
+
+    lines = ["GET index page served quickly", "GET index page served [cached]", "kernel panic: not syncing now"]
+    encoder.batches.clear()
+    cm.prefetch_embeddings(schema_hash, lines)
+    assert len(encoder.batches) == 1
+
+    assert cm.fetch_script(schema, lines[0], use_embeddings=True) == "web script"
+    assert cm.fetch_script(schema, lines[1], use_embeddings=True) == "web script"
+    assert cm.fetch_script(schema, lines[2], use_embeddings=True) == "kernel script"
+    # Every lookup was served from the prefetched batch
+    assert len(encoder.batches) == 1
+
+def test_archetype_vectors_live_in_a_mapped_matrix(tmp_path):
+    import json
+    cm = CacheManager(cache_dir=tmp_path)
+    cm._embeddings = EmbeddingCache(encoder=FakeEncoder())
+    schema = {"type": "object"}
+    words = ["apple", "banana", "cherry", "damson", "elderberry", "fig", "grape", "kiwi"]
+    for i, word in enumerate(words):
+        # Distinct punctuation keeps every example a separate archetype
+        cm.save_script(schema, word + " -" * (i + 1), f"{word} script", use_embeddings=True)
+    schema_hash = cm._hash_schema(schema)
+
+    entry = json.loads((tmp_path / "metadata.json").read_text())["schemas"][schema_hash]
+    assert all("archetype_vector" not in a for a in entry["archetypes"].values())
+    assert sorted(a["vector_row"] for a in entry["archetypes"].values()) == list(range(len(words)))
+    # Only the latest generation of the matrix is kept
+    assert [p.name for p in tmp_path.glob("*.npy")] == [entry["vector_file"]]
+
+    index = cm._vector_index(schema_hash, entry["archetypes"])
+    assert isinstance(index.matrix, np.memmap) and index.matrix.shape == (len(words), 26)
+    query = cm._embeddings.embed("cherry")
+    assert index.top_k(query, 2)[0][1] == pytest.approx(1.0)
+    assert cm._read_script(entry["archetypes"][index.top_k(query, 1)[0][0]]["script"]) == "cherry script"
+
+    cm.delete_script(schema)
+    assert not list(tmp_path.glob("*.npy"))
+
+def test_inline_vectors_still_route_and_migrate(tmp_path):
+    import json
+    cm = CacheManager(cache_dir=tmp_path)
+    cm._embeddings = EmbeddingCache(encoder=FakeEncoder())
+    schema = {"type": "object"}
+    cm.save_script(schema, "GET index page served", "web script")
+    schema_hash = cm._hash_schema(schema)
+
+    # Caches written before the vector matrix kept embeddings in metadata.json
+    meta_file = tmp_path / "metadata.json"
+    meta = json.loads(meta_file.read_text())
+    for archetype in meta["schemas"][schema_hash]["archetypes"].values():
+        archetype["archetype_vector"] = cm._embeddings.embed("GET index page served").tolist()
+    meta_file.write_text(json.dumps(meta))
+    cm._invalidate_index()
+
+    assert cm.fetch_script(schema, "GET index page served again", use_embeddings=True) == "web script"
+
+    cm.save_script(schema, "kernel: panic - not syncing", "kernel script", use_embeddings=True)
+    archetypes = json.loads(meta_file.read_text())["schemas"][schema_hash]["archetypes"]
+    assert all("archetype_vector" not in a and "vector_row" in a for a in archetypes.values())
+    assert cm.fetch_script(schema, "GET index page served again", use_embeddings=True) == "web script"
+    assert cm.fetch_script(schema, "kernel panic: not syncing now", use_embeddings=True) == "kernel script"
@@ -59,3 +59,207 @@ def test_process_stream_degradation_passthrough(monkeypatch):
     assert "error" in result
     assert result["error"] == "Validation failed"
     assert result["raw_text"] == "test input"
+
+def test_engine_reuses_session_across_lines(monkeypatch, tmp_path):
+    from symparse.engine import Engine
+    from symparse.cache_manager import CacheManager
+
+    created = {"ai": 0, "cache": 0}
+
+    class MockAIClient:
+        def __init__(self, *args, **kwargs):
+            created["ai"] += 1
+        def extract(self, text, schema):
+            return {"name": text, "age": 40}
+
+    def make_cache():
+        created["cache"] += 1
+        return CacheManager(cache_dir=tmp_path)
+
+    monkeypatch.setattr('symparse.engine.AIClient', MockAIClient)
+    monkeypatch.setattr('symparse.engine.CacheManager', make_cache)
+
+    schema = {
+        "type": "object",
+        "properties": {"name": {"type": "string"}, "age": {"type": "integer"}},
+        "required": ["name", "age"]
+    }
+
+    engine = Engine(schema)
+    assert engine.schema_hash == engine.cache_manager._hash_schema(schema)
+    for name in ("Bob", "Carol", "Dave"):
+        assert engine.process(name) == {"name": name, "age": 40}
+
+    assert created == {"ai": 1, "cache": 1}
+
+def test_engine_coalesces_cold_starts_per_signature(monkeypatch, tmp_path):
+    import threading
+    from symparse.engine import Engine, EngineStats
+    from symparse.cache_manager import CacheManager
+    from symparse.pipeline import run_concurrent
+
+    calls = []
+
+    class MockAIClient:
+        def __init__(self, *args, **kwargs):
+            pass
+        def extract(self, text, schema):
+            calls.append(text)
+            # Hold the leader long enough for the rest of the burst to queue behind it
+            threading.Event().wait(0.2)
+            return {"name": text.split()[1], "age": int(text.split()[3])}
+
+    script = """import re2
+def extract(text):
+    m = re2.search(r'user (\\w+) age (\\d+)', text)
+    if not m:
+        return None
+    return {"name": m.group(1), "age": int(m.group(2))}
+"""
+    monkeypatch.setattr('symparse.engine.AIClient', MockAIClient)
+    monkeypatch.setattr('symparse.engine.CacheManager', lambda: CacheManager(cache_dir=tmp_path))
+    monkeypatch.setattr('symparse.engine.generate_script', lambda text, schema, example: script)
+
+    schema = {
+        "type": "object",
+        "properties": {"name": {"type": "string"}, "age": {"type": "integer"}},
+        "required": ["name", "age"]
+    }
+    engine = Engine(schema, compile=True, stats=EngineStats())
+    records = [f"user u{i} age {i % 10}" for i in range(50)]
+    results = []
+
+    run_concurrent(records, engine, results.append, ai_concurrency=8)
+
+    assert results == [{"name": f"u{i}", "age": i % 10} for i in range(50)]
+    assert calls == ["user u0 age 0"]
+    assert engine.stats.ai_path_hits == 1
+    assert engine.stats.fast_path_hits == 49
+
+
+def test_engine_records_stage_latencies(monkeypatch, tmp_path):
+    from symparse.engine import Engine, EngineStats
+    from symparse.cache_manager import CacheManager
+
+    class MockAIClient:
+        def __init__(self, *args, **kwargs):
+            pass
+        def extract(self, text, schema):
+            return {"name": text}
+
+    cm = CacheManager(cache_dir=tmp_path)
+    monkeypatch.setattr('symparse.engine.AIClient', MockAIClient)
+    monkeypatch.setattr('symparse.engine.CacheManager', lambda: cm)
+    monkeypatch.setattr('symparse.engine.generate_script', lambda *args, **kwargs: "def extract(text):\n    return {'name': text}\n")
+
+    schema = {"type": "object", "properties": {"name": {"type": "string"}}, "required": ["name"]}
+    stats = EngineStats()
+    engine = Engine(schema, compile=True, stats=stats)
+    engine.process("Bob")
+    engine.process("Bob")
+
+    assert stats.stages["ai_call"].count == 1
+    assert stats.stages["compile"].count == 1
+    # The compiling leader re-checks the cache once before its LLM call
+    assert stats.stages["cache_fetch"].count == 3
+    assert stats.stages["script_execution"].count == 1
+    assert stats.stages["validation"].count == 2
+    assert stats.stages["fast_path"].count == stats.stages["ai_path"].count == 1
+
+    merged = EngineStats()
+    merged.merge(stats)
+    merged.merge(stats)
+    report = merged.to_dict()
+    assert report["fast_path_hits"] == 2
+    assert report["stages"]["cache_fetch"]["count"] == 6
+
+def test_latencies_ignore_wall_clock_steps(monkeypatch, tmp_path):
+    import time
+    from symparse.engine import Engine, EngineStats
+    from symparse.cache_manager import CacheManager
+
+    class MockAIClient:
+        def __init__(self, *args, **kwargs):
+            pass
+        def extract(self, text, schema):
+            return {"name": text}
+
+    cm = CacheManager(cache_dir=tmp_path)
+    monkeypatch.setattr('symparse.engine.AIClient', MockAIClient)
+    monkeypatch.setattr('symparse.engine.CacheManager', lambda: cm)
+    monkeypatch.setattr('symparse.engine.generate_script', lambda *args, **kwargs: "def extract(text):\n    return {'name': text}\n")
+
+    schema = {"type": "object", "properties": {"name": {"type": "string"}}, "required": ["name"]}
+    stats = EngineStats()
+    engine = Engine(schema, compile=True, stats=stats)
+    engine.process("Bob")
+    archetype = cm.list_cache()[engine.schema_hash]["archetypes"][cm._archetype_id("Bob")]
+
+    # Every wall-clock read lands an hour before the previous one
+    clock = [time.time()]
+    def stepping_back():
+        clock[0] -= 3600
+        return clock[0]
+    monkeypatch.setattr(time, "time", stepping_back)
+    engine.process("Bob")
+    cm.flush_usage()
+
+    assert 0 <= stats.total_latency_ms < 60_000
+    assert stats.stages["fast_path"].max_ns < 60 * 10**9
+    assert cm.list_cache()[engine.schema_hash]["archetypes"][cm._archetype_id("Bob")]["last_used"] >= archetype["last_used"]
+
+def test_circuit_breaker_ignores_rare_failures():
+    from symparse.engine import CircuitBreaker
+
+    breaker = CircuitBreaker(window=20, threshold=0.5, min_failures=3)
+    key = ("schema", "archetype")
+    # A rare variant among healthy traffic never trips
+    for i in range(1000):
+        if i % 50 == 0:
+            assert not breaker.record_failure(key)
+        else:
+            breaker.record_success(key)
+
+    # A burst of failures does, and the window starts over afterwards
+    assert not breaker.record_failure(key)
+    assert not breaker.record_failure(key)
+    for _ in range(8):
+        if breaker.record_failure(key):
+            break
+    else:
+        raise AssertionError("breaker did not trip")
+    assert not breaker.record_failure(key)
+
+def test_circuit_breaker_counts_successes_before_first_failure():
+    from symparse.engine import CircuitBreaker
+
+    breaker = CircuitBreaker(window=20, threshold=0.5, min_failures=3)
+    key = ("schema", "archetype")
+    for _ in range(1000):
+        breaker.record_success(key)
+    # 3 failures in the last 20 executions is a 0.15 failure rate
+    assert [breaker.record_failure(key) for _ in range(3)] == [False, False, False]
+
+def test_ai_path_batch_survives_cache_commit_failure(monkeypatch, tmp_path):
+    from symparse.engine import Engine, EngineStats
+    from symparse.cache_manager import CacheManager
+
+    class MockAIClient:
+        def __init__(self, *args, **kwargs):
+            pass
+        def extract_batch(self, texts, schema):
+            return [{"name": t} for t in texts]
+
+    cm = CacheManager(cache_dir=tmp_path)
+    monkeypatch.setattr('symparse.engine.AIClient', MockAIClient)
+    monkeypatch.setattr('symparse.engine.CacheManager', lambda: cm)
+    monkeypatch.setattr('symparse.engine.generate_script', lambda *args, **kwargs: "def extract(text):\n    return {'name': text}\n")
+    def failing_apply(operations):
+        raise OSError("disk full")
+    monkeypatch.setattr(cm, "_apply", failing_apply)
+
+    schema = {"type": "object", "properties": {"name": {"type": "string"}}, "required": ["name"]}
+    engine = Engine(schema, compile=True, stats=EngineStats())
+    # The deferred save fails when the batch commits; the validated results are kept
+    assert engine.ai_path_batch(["Bob", "Carol: x"]) == [{"name": "Bob"}, {"name": "Carol: x"}]
+    assert engine.stats.ai_path_hits == 2
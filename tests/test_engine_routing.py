@@ -51,8 +51,8 @@ def test_process_stream_fast_path_fallback(monkeypatch, tmp_path):
     result = process_stream(text, schema)
     assert result == {"age": 30}
     
-    # Assert cache is purged
-    assert cm.fetch_script(schema, text) is None
+    # A single failure only reroutes that line; the script stays cached
+    assert cm.fetch_script(schema, text) == script
 
 def test_process_stream_compile(monkeypatch, tmp_path):
     schema = {"type": "object", "properties": {"id": {"type": "string"}}, "required": ["id"]}
@@ -82,3 +82,99 @@ def test_process_stream_compile(monkeypatch, tmp_path):
     script = cm.fetch_script(schema, text)
     assert script is not None
     assert "ID: (\\\\d+)" in script
+
+def test_failing_script_is_quarantined_then_recompiled(monkeypatch, tmp_path):
+    schema = {"type": "object", "properties": {"age": {"type": "integer"}}, "required": ["age"]}
+    text = "I am 30 years old"
+
+    cm = CacheManager(cache_dir=tmp_path)
+    # Extracts a string, so every replay fails validation
+    cm.save_script(schema, text, "def extract(text):\n    return {'age': 'thirty'}\n")
+    compiles = []
+
+    class MockAIClient:
+        def __init__(self, *args, **kwargs):
+            pass
+        def extract(self, *args, **kwargs):
+            return {"age": 30}
+
+    def mock_generate_script(*args, **kwargs):
+        compiles.append(args[0])
+        return "def extract(text):\n    return {'age': 30}\n"
+
+    monkeypatch.setattr('symparse.engine.AIClient', MockAIClient)
+    monkeypatch.setattr('symparse.engine.generate_script', mock_generate_script)
+    monkeypatch.setattr('symparse.engine.CacheManager', lambda: cm)
+
+    from symparse.engine import Engine
+    engine = Engine(schema, compile=True)
+    # The first two failures only reroute their lines; the script is neither purged nor overwritten
+    for _ in range(2):
+        assert engine.process(text) == {"age": 30}
+    assert compiles == []
+    assert cm.has_extractor(engine.schema_hash, cm._archetype_id(text))
+
+    # The third trips the breaker: quarantined, then replaced by a fresh compile
+    assert engine.process(text) == {"age": 30}
+    assert compiles == [text]
+    assert engine.process(text) == {"age": 30}
+
+    [row] = cm.extractor_stats()
+    assert row["hits"] == 4
+    assert row["validation_failures"] == 3
+    assert row["quarantines"] == 1
+    assert row["executions"] == 4
+    assert not row["quarantined"]
+    assert row["mean_exec_ms"] > 0
+
+def test_similar_format_with_extra_field_gets_its_own_extractor(monkeypatch, tmp_path):
+    from symparse.engine import Engine, EngineStats
+
+    schema = {
+        "type": "object",
+        "properties": {"ip": {"type": "string"}, "status": {"type": "integer"}, "ua": {"type": "string"}},
+        "required": ["ip", "status"]
+    }
+    # Free-form LLM-style scripts: no single template pattern, so only the Tier-2 gate can route to them
+    short_script = """import re2
+def extract(text):
+    ip = re2.search(r'^(\\S+)', text).group(1)
+    status = re2.search(r'" (\\d{3}) ', text).group(1)
+    return {"ip": ip, "status": int(status)}
+"""
+    ua_script = """import re2
+def extract(text):
+    ip = re2.search(r'^(\\S+)', text).group(1)
+    status = re2.search(r'" (\\d{3}) ', text).group(1)
+    ua = re2.search(r'"([^"]*)"$', text).group(1)
+    return {"ip": ip, "status": int(status), "ua": ua}
+"""
+    ai_calls = []
+
+    class MockAIClient:
+        def __init__(self, *args, **kwargs):
+            pass
+        def extract(self, text, schema):
+            ai_calls.append(text)
+            return {"ip": "10.0.0.2", "status": 200, "ua": "Mozilla/5.0 (X11; Linux)"}
+
+    cm = CacheManager(cache_dir=tmp_path)
+    monkeypatch.setattr('symparse.engine.AIClient', MockAIClient)
+    monkeypatch.setattr('symparse.engine.CacheManager', lambda: cm)
+    monkeypatch.setattr('symparse.engine.generate_script', lambda *args, **kwargs: ua_script)
+
+    # The no-user-agent shape arrives first
+    short = '10.0.0.1 - - [10/Oct/2023:13:55:36 +0000] "GET /a HTTP/1.1" 200 512'
+    cm.save_script(schema, short, short_script)
+    engine = Engine(schema, compile=True, stats=EngineStats())
+
+    with_ua = '10.0.0.2 - - [10/Oct/2023:13:55:37 +0000] "GET /b HTTP/1.1" 200 512 "Mozilla/5.0 (X11; Linux)"'
+    assert engine.process(with_ua)["ua"] == "Mozilla/5.0 (X11; Linux)"
+    assert len(ai_calls) == 1
+    # The shape now has its own extractor, and later lines of it keep the field
+    assert len(cm.list_cache()[engine.schema_hash]["archetypes"]) == 2
+    other_ua = '10.0.0.3 - - [10/Oct/2023:13:56:00 +0000] "GET /c HTTP/1.1" 404 77 "Mozilla/4.0 (X11; BSD)"'
+    assert engine.process(other_ua)["ua"] == "Mozilla/4.0 (X11; BSD)"
+    assert len(ai_calls) == 1
+    # The short format still has its own script
+    assert engine.process('10.0.0.9 - - [10/Oct/2023:13:57:00 +0000] "GET /d HTTP/1.1" 200 64') == {"ip": "10.0.0.9", "status": 200}
@@ -0,0 +1,95 @@
+import pickle
+
+import pytest
+
+from symparse.metrics import LatencyHistogram, _bucket_index, _bucket_upper
+
+
+def test_buckets_are_contiguous_and_bound_their_values():
+    previous = -1
+    for value in list(range(200)) + [10**3, 10**6, 123456789, 5 * 10**9]:
+        index = _bucket_index(value)
+        assert index >= previous
+        previous = index
+        upper = _bucket_upper(index)
+        assert value <= upper <= value * 1.125 + 1
+
+
+def test_quantiles_within_relative_error():
+    histogram = LatencyHistogram()
+    for ms in range(1, 1001):
+        histogram.record(ms * 1_000_000)
+
+    assert histogram.count == 1000
+    assert histogram.max_ns == 1_000_000_000
+    for q, expected in ((0.5, 500e6), (0.95, 950e6), (0.99, 990e6)):
+        assert expected <= histogram.quantile(q) <= expected * 1.125
+    assert histogram.quantile(1.0) == histogram.max_ns
+
+
+def test_outliers_show_up_in_tail_not_median():
+    histogram = LatencyHistogram()
+    for _ in range(990):
+        histogram.record(50_000)
+    for _ in range(10):
+        histogram.record(3_000_000_000)
+
+    summary = histogram.summary()
+    assert summary["p50_ms"] == pytest.approx(0.05, rel=0.125)
+    assert summary["p99_ms"] == pytest.approx(0.05, rel=0.125)
+    assert summary["max_ms"] == 3000.0
+    assert summary["mean_ms"] > 30
+
+
+def test_merge_matches_single_histogram():
+    combined, left, right = LatencyHistogram(), LatencyHistogram(), LatencyHistogram()
+    for value in range(0, 10**6, 997):
+        combined.record(value)
+        (left if value % 2 else right).record(value)
+    # Worker histograms travel back to the parent pickled
+    left.merge(pickle.loads(pickle.dumps(right)))
+
+    assert left == combined
+
+
+def test_empty_histogram_summary():
+    assert LatencyHistogram().summary() == {
+        "count": 0, "mean_ms": 0.0, "p50_ms": 0.0, "p95_ms": 0.0, "p99_ms": 0.0, "max_ms": 0.0
+    }
+
+
+def test_span_hooks_see_start_and_end():
+    from symparse.metrics import SpanHook, add_span_hook, remove_span_hook, timed_call
+
+    events = []
+
+    class Recorder(SpanHook):
+        def span_start(self, stage):
+            events.append(("start", stage))
+            return stage.upper()
+
+        def span_end(self, stage, token, elapsed_ns, error):
+            events.append(("end", stage, token, type(error).__name__ if error else None))
+
+    class Broken(SpanHook):
+        def span_start(self, stage):
+            raise RuntimeError("tracing backend down")
+
+    recorded = []
+    hook, broken = Recorder(), Broken()
+    add_span_hook(broken)
+    add_span_hook(hook)
+    try:
+        assert timed_call("compile", lambda *a: recorded.append(a), lambda x: x * 2, 21) == 42
+        with pytest.raises(ValueError):
+            timed_call("ai_call", lambda *a: recorded.append(a), int, "not a number")
+    finally:
+        remove_span_hook(hook)
+        remove_span_hook(broken)
+    timed_call("validation", lambda *a: recorded.append(a), lambda: None)
+
+    assert events == [
+        ("start", "compile"), ("end", "compile", "COMPILE", None),
+        ("start", "ai_call"), ("end", "ai_call", "AI_CALL", "ValueError"),
+    ]
+    assert [stage for stage, _ in recorded] == ["compile", "ai_call", "validation"]
@@ -0,0 +1,132 @@
+import io
+import json
+import time
+import pytest
+from symparse.output import RecordWriter
+
+class CountingStream(io.StringIO):
+    def __init__(self):
+        super().__init__()
+        self.writes = 0
+
+    def write(self, s):
+        self.writes += 1
+        return super().write(s)
+
+def test_writer_batches_until_close():
+    stream = CountingStream()
+    writer = RecordWriter(stream, flush_interval_ms=60_000)
+    for i in range(100):
+        writer.write({"id": i})
+    assert stream.getvalue() == ""
+
+    writer.close()
+    assert [json.loads(line) for line in stream.getvalue().splitlines()] == [{"id": i} for i in range(100)]
+    assert stream.writes == 1
+
+def test_writer_flushes_by_size():
+    stream = CountingStream()
+    with RecordWriter(stream, flush_interval_ms=60_000, buffer_bytes=40) as writer:
+        for i in range(10):
+            writer.write({"id": i})
+        # Every few ~10-byte records cross the 40-byte threshold
+        assert 0 < stream.writes < 10
+    assert stream.getvalue().count("\n") == 10
+
+def test_writer_flushes_idle_output_by_time():
+    stream = CountingStream()
+    writer = RecordWriter(stream, flush_interval_ms=20)
+    writer.write({"id": 1})
+
+    deadline = time.monotonic() + 2
+    while not stream.getvalue() and time.monotonic() < deadline:
+        time.sleep(0.005)
+    assert stream.getvalue() == '{"id": 1}\n'
+    writer.close()
+
+def test_writer_zero_interval_flushes_every_record():
+    stream = CountingStream()
+    writer = RecordWriter(stream, flush_interval_ms=0)
+    writer.write({"id": 1})
+    assert stream.getvalue() == '{"id": 1}\n'
+    writer.write({"id": 2})
+    assert stream.writes == 2
+    writer.close()
+
+def test_threaded_writer_keeps_order_and_reports_errors():
+    stream = CountingStream()
+    with RecordWriter(stream, flush_interval_ms=60_000, threaded=True) as writer:
+        for i in range(500):
+            writer.write({"id": i})
+    assert [json.loads(line)["id"] for line in stream.getvalue().splitlines()] == list(range(500))
+
+    writer = RecordWriter(io.StringIO(), threaded=True)
+    writer.write({"bad": object()})
+    with pytest.raises(TypeError):
+        writer.close()
+
+NESTED_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "ip": {"type": "string"},
+        "status": {"type": "integer"},
+        "latency": {"type": "number"},
+        "request": {
+            "type": "object",
+            "properties": {"method": {"type": "string"}, "secure": {"type": "boolean"}}
+        },
+        "tags": {"type": "array", "items": {"type": "string"}}
+    }
+}
+
+RECORDS = [
+    {"ip": "10.0.0.1", "status": 200, "latency": 1.5, "request": {"method": "GET", "secure": True}, "tags": ["a", "b"]},
+    {"ip": "10.0.0.2", "status": 404, "request": {"method": "POST, PUT", "secure": False}},
+]
+
+def test_schema_columns_flatten_nested_objects():
+    from symparse.output import schema_columns
+    columns = schema_columns(NESTED_SCHEMA)
+    assert [(c.name, c.type) for c in columns] == [
+        ("ip", "string"), ("status", "integer"), ("latency", "number"),
+        ("request.method", "string"), ("request.secure", "boolean"), ("tags", "json")
+    ]
+
+@pytest.mark.parametrize("output_format,delimiter", [("csv", ","), ("tsv", "\t")])
+def test_delimited_sinks(output_format, delimiter):
+    import csv
+    from symparse.output import open_sink
+    stream = io.StringIO()
+    sink = open_sink(output_format, NESTED_SCHEMA, stream, flush_interval_ms=60_000)
+    for record in RECORDS:
+        sink.write(record)
+    sink.close()
+
+    rows = list(csv.reader(io.StringIO(stream.getvalue()), delimiter=delimiter))
+    assert rows == [
+        ["ip", "status", "latency", "request.method", "request.secure", "tags"],
+        ["10.0.0.1", "200", "1.5", "GET", "true", '["a","b"]'],
+        ["10.0.0.2", "404", "", "POST, PUT", "false", ""],
+    ]
+
+@pytest.mark.parametrize("output_format", ["arrow", "parquet"])
+def test_arrow_sinks_write_typed_batches(output_format):
+    pa = pytest.importorskip("pyarrow")
+    from symparse.output import ArrowBatchWriter, schema_columns
+    sink = io.BytesIO()
+    writer = ArrowBatchWriter(sink, schema_columns(NESTED_SCHEMA), output_format, batch_rows=1)
+    for record in RECORDS:
+        writer.write(record)
+    writer.close()
+
+    if output_format == "parquet":
+        import pyarrow.parquet as pq
+        table = pq.read_table(io.BytesIO(sink.getvalue()))
+    else:
+        table = pa.ipc.open_stream(sink.getvalue()).read_all()
+    assert table.schema.field("status").type == pa.int64()
+    assert table.schema.field("request.secure").type == pa.bool_()
+    assert table.to_pylist() == [
+        {"ip": "10.0.0.1", "status": 200, "latency": 1.5, "request.method": "GET", "request.secure": True, "tags": '["a","b"]'},
+        {"ip": "10.0.0.2", "status": 404, "latency": None, "request.method": "POST, PUT", "request.secure": False, "tags": None},
+    ]
@@ -0,0 +1,243 @@
+import sys
+import threading
+import pytest
+from symparse.cache_manager import CacheManager
+from symparse.engine import Engine, EngineFailure, EngineStats, GracefulDegradationMode
+from symparse.pipeline import (
+    InputStats, file_ranges, iter_file_lines, iter_records, run_concurrent, run_file_parallel, run_parallel
+)
+
+SCHEMA = {"type": "object", "properties": {"id": {"type": "integer"}}, "required": ["id"]}
+
+SCRIPT = """import re2
+def extract(text):
+    m = re2.search(r'request (\\d+) done', text)
+    if not m:
+        return None
+    return {"id": int(m.group(1))}
+"""
+
+def _warm_cache(tmp_path):
+    cm = CacheManager(cache_dir=tmp_path)
+    cm.save_script(SCHEMA, "request 1 done", SCRIPT)
+    return {"schema_dict": SCHEMA, "cache_dir": str(tmp_path)}
+
+def test_iter_records_skips_blank_and_binary_lines():
+    input_stats = InputStats()
+    records = list(iter_records(["  a \n", "\n", "b\x00c\n", "dd\n"], input_stats))
+    assert records == ["a", "dd"]
+    assert input_stats.total_input_chars == 3
+    assert input_stats.skipped_binary_lines == 1
+
+def test_run_parallel_keeps_input_order(tmp_path):
+    engine_kwargs = _warm_cache(tmp_path)
+    records = [f"request {i} done" for i in range(200)]
+    results, stats = [], EngineStats()
+
+    run_parallel(records, engine_kwargs, results.append, workers=2, chunk_size=7, stats=stats)
+
+    assert results == [{"id": i} for i in range(200)]
+    assert stats.fast_path_hits == 200
+    assert stats.ai_path_hits == 0
+
+def test_run_parallel_unordered_emits_everything(tmp_path):
+    engine_kwargs = _warm_cache(tmp_path)
+    records = [f"request {i} done" for i in range(100)]
+    results, stats = [], EngineStats()
+
+    run_parallel(records, engine_kwargs, results.append, workers=3, ordered=False, chunk_size=5, stats=stats)
+
+    assert sorted(r["id"] for r in results) == list(range(100))
+    assert stats.fast_path_hits == 100
+
+def test_run_parallel_halts_after_emitting_completed_records(tmp_path):
+    engine_kwargs = _warm_cache(tmp_path)
+    engine_kwargs.update(max_retries=0, degradation_mode=GracefulDegradationMode.HALT)
+    records = [f"request {i} done" for i in range(10)] + ["request X done"]
+    results = []
+
+    with pytest.raises(EngineFailure):
+        run_parallel(records, engine_kwargs, results.append, workers=2, chunk_size=4, stats=EngineStats())
+
+    assert results == [{"id": i} for i in range(10)]
+
+def test_run_concurrent_fast_path_flows_past_slow_ai(tmp_path):
+    engine = Engine(stats=EngineStats(), **_warm_cache(tmp_path))
+    records = ["request 0 done", "request 1 done", "unrelated trailing record", "request 3 done", "request 4 done"]
+    results = []
+    consumed = []
+    release = threading.Event()
+
+    def reader():
+        for record in records:
+            consumed.append(record)
+            yield record
+
+    def slow_extract(text, schema):
+        # Fast-path lines after the miss are read while the LLM call is outstanding
+        release.wait(timeout=5)
+        return {"id": 2}
+
+    engine.ai_client.extract = slow_extract
+    worker = threading.Thread(target=run_concurrent, args=(reader(), engine, results.append, 2))
+    worker.start()
+    while len(consumed) < len(records):
+        threading.Event().wait(0.01)
+    assert results == [{"id": 0}, {"id": 1}]
+    release.set()
+    worker.join(timeout=5)
+
+    assert results == [{"id": i} for i in range(5)]
+    assert engine.stats.fast_path_hits == 4
+    assert engine.stats.ai_path_hits == 1
+
+def test_run_concurrent_bounds_reorder_buffer(tmp_path):
+    engine = Engine(stats=EngineStats(), **_warm_cache(tmp_path))
+    records = ["unrelated trailing record"] + [f"request {i} done" for i in range(1, 20)]
+    consumed = []
+    seen_while_blocked = []
+
+    def reader():
+        for record in records:
+            consumed.append(record)
+            yield record
+
+    def slow_extract(text, schema):
+        threading.Event().wait(0.2)
+        seen_while_blocked.append(len(consumed))
+        return {"id": 0}
+
+    engine.ai_client.extract = slow_extract
+    results = []
+    run_concurrent(reader(), engine, results.append, ai_concurrency=1, max_buffer=4)
+
+    assert seen_while_blocked == [4]
+    assert results == [{"id": i} for i in range(20)]
+
+def test_run_concurrent_survives_instant_ai_completions(tmp_path):
+    engine = Engine(stats=EngineStats(), schema_dict=SCHEMA, cache_dir=str(tmp_path))
+    # The AI stub resolves immediately, so completion callbacks pop the buffer
+    # head while the reader is about to wait on it
+    engine.ai_client.extract_batch = lambda texts, schema: [{"id": int(t.split()[1])} for t in texts]
+    engine.ai_client.extract = lambda text, schema: {"id": int(text.split()[1])}
+
+    # Switch threads as often as possible to widen the race window
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    try:
+        for _ in range(200):
+            results = []
+            run_concurrent((f"job {i} finished" for i in range(9)), engine, results.append,
+                           ai_concurrency=4, max_buffer=2, ai_batch_size=2)
+            assert results == [{"id": i} for i in range(9)]
+    finally:
+        sys.setswitchinterval(interval)
+
+def test_run_concurrent_halts_in_order(tmp_path):
+    engine = Engine(stats=EngineStats(), max_retries=0, **_warm_cache(tmp_path))
+    records = ["request 0 done", "request 1 done", "unrelated trailing record", "request 3 done"]
+    results = []
+
+    with pytest.raises(EngineFailure):
+        run_concurrent(records, engine, results.append, ai_concurrency=2)
+
+    assert results == [{"id": 0}, {"id": 1}]
+
+def test_run_concurrent_batches_misses_and_retries_failed_elements(tmp_path):
+    engine = Engine(stats=EngineStats(), schema_dict=SCHEMA, cache_dir=str(tmp_path))
+    records = [f"job {i} finished" for i in range(7)]
+    batches, singles = [], []
+
+    def extract_batch(texts, schema):
+        batches.append(list(texts))
+        # The element for "job 2" comes back invalid and must be retried on its own
+        return [{"id": "bad"} if t == "job 2 finished" else {"id": int(t.split()[1])} for t in texts]
+
+    def extract(text, schema):
+        singles.append(text)
+        return {"id": int(text.split()[1])}
+
+    engine.ai_client.extract_batch = extract_batch
+    engine.ai_client.extract = extract
+    results = []
+
+    run_concurrent(records, engine, results.append, ai_concurrency=1, ai_batch_size=3)
+
+    assert results == [{"id": i} for i in range(7)]
+    assert [len(b) for b in batches] == [3, 3, 1]
+    assert singles == ["job 2 finished"]
+    assert engine.stats.ai_path_hits == 7
+
+def test_run_concurrent_batch_respects_token_budget(tmp_path):
+    engine = Engine(stats=EngineStats(), schema_dict=SCHEMA, cache_dir=str(tmp_path))
+    records = [f"job {i} finished " + "x" * 70 for i in range(4)]
+    batches = []
+
+    def extract_batch(texts, schema):
+        batches.append(len(texts))
+        return [{"id": int(t.split()[1])} for t in texts]
+
+    engine.ai_client.extract_batch = extract_batch
+    results = []
+
+    # ~24 estimated tokens per record, so a 50-token budget holds two
+    run_concurrent(records, engine, results.append, ai_concurrency=1, ai_batch_size=10, ai_batch_tokens=50)
+
+    assert results == [{"id": i} for i in range(4)]
+    assert batches == [2, 2]
+
+def test_run_concurrent_flushes_partial_batch_after_wait(tmp_path):
+    engine = Engine(stats=EngineStats(), schema_dict=SCHEMA, cache_dir=str(tmp_path))
+    engine.ai_client.extract_batch = lambda texts, schema: [{"id": int(t.split()[1])} for t in texts]
+    emitted = threading.Event()
+    emitted_while_paused = []
+    results = []
+
+    def emit(record):
+        results.append(record)
+        emitted.set()
+
+    def paused_input():
+        # A quiet stream: one miss arrives, then the reader blocks on the next line
+        yield "job 1 finished"
+        emitted_while_paused.append(emitted.wait(5))
+
+    run_concurrent(paused_input(), engine, emit, ai_concurrency=1, ai_batch_size=10, ai_batch_wait_ms=10)
+
+    assert results == [{"id": 1}]
+    # The wait deadline, not end of input, sent the partial batch
+    assert emitted_while_paused == [True]
+
+def test_file_ranges_are_newline_aligned(tmp_path):
+    path = tmp_path / "input.log"
+    lines = [f"request {i} done" for i in range(100)]
+    path.write_bytes(("\n".join(lines) + "\n").encode())
+
+    ranges = file_ranges(str(path), range_bytes=50)
+    data = path.read_bytes()
+
+    assert ranges[0][0] == 0 and ranges[-1][1] == len(data)
+    assert all(prev[1] == cur[0] for prev, cur in zip(ranges, ranges[1:]))
+    assert all(data[end - 1:end] == b"\n" for _, end in ranges)
+    assert [line for line in iter_file_lines(str(path), range_bytes=50) if line] == lines
+
+    empty = tmp_path / "empty.log"
+    empty.write_bytes(b"")
+    assert file_ranges(str(empty), range_bytes=50) == []
+
+def test_run_file_parallel_keeps_file_order(tmp_path):
+    engine_kwargs = _warm_cache(tmp_path)
+    path = tmp_path / "input.log"
+    # No trailing newline, a blank line and a binary line exercise the range reader
+    body = "\n".join(f"request {i} done" for i in range(300)).replace("request 150 done", "request 150 done\n\nbad\x00line")
+    path.write_bytes(body.encode())
+    results, stats, input_stats = [], EngineStats(), InputStats()
+
+    run_file_parallel(str(path), engine_kwargs, results.append, workers=2, range_bytes=256,
+                      stats=stats, input_stats=input_stats)
+
+    assert results == [{"id": i} for i in range(300)]
+    assert stats.fast_path_hits == 300
+    assert input_stats.skipped_binary_lines == 1
+    assert input_stats.total_input_chars == sum(len(f"request {i} done") for i in range(300))
+
@@ -0,0 +1,19 @@
+import pstats
+import threading
+from symparse.profiling import profile_run
+
+def _work_in_thread():
+    return sum(range(1000))
+
+def test_cprofile_covers_threads_started_in_block(tmp_path, capsys):
+    path = tmp_path / "run.prof"
+    with profile_run(str(path)):
+        worker = threading.Thread(target=_work_in_thread)
+        worker.start()
+        worker.join()
+
+    assert "Profile written to" in capsys.readouterr().err
+    functions = {name for _, _, name in pstats.Stats(str(path)).stats}
+    assert "_work_in_thread" in functions
+    # The hook is removed again, so later threads are not profiled
+    assert threading.getprofile() is None
@@ -1,3 +1,4 @@
+import jsonschema
 import pytest
 from symparse.validator import enforce_schema, SchemaViolationError
 
@@ -51,3 +52,100 @@ def test_enforce_schema_invalid_schema():
     # We will test an invalid schema to see what happens since jsonschema raises SchemaError on invalid schemas
     # But since we only catch ValidationError, we leave SchemaError uncaught and that's okay because it represents developer error rather than payload error.
     pass
+
+NESTED_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "ip": {"type": "string"},
+        "request": {
+            "type": "object",
+            "properties": {"method": {"type": "string", "enum": ["GET", "POST"]}, "url": {"type": "string"}},
+            "required": ["method", "url"]
+        },
+        "status": {"type": "integer"},
+        "tags": {"type": "array", "items": {"type": "string"}}
+    },
+    "required": ["ip", "request", "status"]
+}
+
+def test_compile_validator_is_cached():
+    from symparse.validator import compile_validator
+    first = compile_validator(NESTED_SCHEMA)
+    assert compile_validator(NESTED_SCHEMA) is first
+    assert compile_validator(NESTED_SCHEMA, schema_key="abc") is compile_validator(NESTED_SCHEMA, schema_key="abc")
+    assert compile_validator(NESTED_SCHEMA, backend="codegen") is not first
+
+@pytest.mark.parametrize("data", [
+    {"ip": "1.2.3.4", "request": {"method": "GET", "url": "/"}, "status": 200},
+    {"ip": "1.2.3.4", "request": {"method": "GET", "url": "/"}, "status": 200.0, "tags": ["a", "b"]},
+    {"ip": "1.2.3.4", "request": {"method": "PUT", "url": "/"}, "status": 200},
+    {"ip": "1.2.3.4", "request": {"method": "GET"}, "status": 200},
+    {"ip": "1.2.3.4", "request": {"method": "GET", "url": "/"}, "status": True},
+    {"ip": "1.2.3.4", "request": {"method": "GET", "url": "/"}, "status": "200"},
+    {"ip": "1.2.3.4", "request": {"method": "GET", "url": "/"}, "status": 200, "tags": ["a", 1]},
+    {"request": {"method": 1}, "status": "x"},
+    ["not", "an", "object"],
+])
+def test_codegen_validator_matches_jsonschema(data):
+    from symparse.validator import compile_validator
+    reference = compile_validator(NESTED_SCHEMA, backend="jsonschema")
+    generated = compile_validator(NESTED_SCHEMA, backend="codegen")
+
+    try:
+        reference(data)
+        expected = None
+    except SchemaViolationError as e:
+        expected = (e.path, str(e))
+
+    try:
+        generated(data)
+        actual = None
+    except SchemaViolationError as e:
+        actual = (e.path, str(e))
+
+    assert actual == expected
+
+@pytest.mark.parametrize("draft", [
+    None,
+    "http://json-schema.org/draft-03/schema#",
+    "http://json-schema.org/draft-04/schema#",
+    "http://json-schema.org/draft-07/schema#",
+    "https://json-schema.org/draft/2020-12/schema",
+])
+@pytest.mark.parametrize("value", [1, 1.0, 1.5, True, [1.0]])
+def test_codegen_honors_schema_draft(draft, value):
+    from symparse.validator import compile_validator
+    schema = {"type": "object", "properties": {"n": {"type": ["integer", "array"], "items": {"type": "integer"}}}}
+    if draft:
+        schema["$schema"] = draft
+    if draft and "draft-03" in draft:
+        # Draft 3 marks required properties with a boolean on the property itself
+        schema["properties"]["n"]["required"] = True
+
+    def outcome(backend):
+        try:
+            return compile_validator(schema, backend=backend)({"n": value})
+        except SchemaViolationError as e:
+            return str(e)
+
+    assert outcome("codegen") == outcome("jsonschema")
+
+def test_codegen_rejects_malformed_required():
+    from symparse.validator import compile_validator, generate_validator_source, UnsupportedSchemaError
+    schema = {"type": "object", "properties": {"n": {"type": "integer", "required": True}}}
+    with pytest.raises(UnsupportedSchemaError):
+        generate_validator_source(schema)
+    # The jsonschema fallback reports the invalid schema instead of a TypeError
+    with pytest.raises(jsonschema.exceptions.SchemaError):
+        compile_validator(schema, backend="codegen")
+
+def test_codegen_falls_back_for_unsupported_keywords():
+    from symparse.validator import compile_validator, generate_validator_source, UnsupportedSchemaError
+    schema = {"type": "object", "properties": {"n": {"type": "integer", "minimum": 5}}}
+    with pytest.raises(UnsupportedSchemaError):
+        generate_validator_source(schema)
+
+    validator = compile_validator(schema, backend="codegen")
+    with pytest.raises(SchemaViolationError) as exc:
+        validator({"n": 1})
+    assert exc.value.path == "n"